@@ -0,0 +1,32 @@
+import os
+
+from txs import cache
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    value = 'x' * 100
+    for i in range(3):
+        cache.put('test', [i], value, max_size=1000)
+        # Modification times must differ
+        path = os.path.join(cache.cache_dir('test'), cache.key2name([i]) + '.json')
+        os.utime(path, (i, i))
+    assert cache.get('test', [0]) == value
+    for i in range(3, 10):
+        cache.put('test', [i], value, max_size=350)
+    names = os.listdir(cache.cache_dir('test'))
+    assert sum(os.path.getsize(os.path.join(cache.cache_dir('test'), name)) for name in names) <= 350
+    # Recently written and used entries are kept
+    assert cache.get('test', [9]) == value
+    assert cache.get('test', [1]) is None
+
+def test_directories(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    src = tmp_path / 'sample.mkv'
+    src.write_bytes(b'x' * 100)
+    cache.put_dir('encodes', ['a'], {'sample.mkv': str(src)}, {'size': 100}, max_size=10**6)
+    path, value = cache.get_dir('encodes', ['a'])
+    assert value == {'size': 100}
+    assert os.path.samefile(os.path.join(path, 'sample.mkv'), str(src))
+    cache.put_dir('encodes', ['b'], {'sample.mkv': str(src)}, {'size': 100}, max_size=150)
+    assert cache.get_dir('encodes', ['a']) is None
+    assert cache.get_dir('encodes', ['b']) is not None
@@ -0,0 +1,103 @@
+import os
+
+from txs import utils
+
+def update(estimates_file, key, time, size, **fields):
+    settings = utils.parse_settings(key)
+    return utils.update_estimates(estimates_file, settings, time, size, settings, **fields)
+
+def stripped(est):
+    # Compacted string fields lose their padding
+    return {key: {k: v.strip() if isinstance(v, str) else v for k,v in record.items()}
+            for key,record in est.items()}
+
+def test_journal_records_are_merged(tmp_path):
+    estimates_file = str(tmp_path / 'estimates')
+    update(estimates_file, 'crf=18', 100, 2000)
+    update(estimates_file, 'crf=20', 80, 1000)
+    utils.append_estimates(estimates_file, {'settings': 'crf=18', 'ssim': 0.98})
+    est = utils.read_estimates(estimates_file)
+    assert list(est) == ['crf=18', 'crf=20']
+    assert est['crf=18']['time'] == 100
+    assert est['crf=18']['ssim'] == 0.98
+    assert not os.path.exists(estimates_file)
+
+def test_later_fields_win(tmp_path):
+    estimates_file = str(tmp_path / 'estimates')
+    update(estimates_file, 'crf=18', 100, 2000)
+    update(estimates_file, 'crf=18', 120, 1900)
+    assert utils.read_estimates(estimates_file)['crf=18']['size'] == 1900
+
+def test_deleted_records(tmp_path):
+    estimates_file = str(tmp_path / 'estimates')
+    update(estimates_file, 'crf=18', 100, 2000, ssim=0.98)
+    utils.delete_estimates(estimates_file, 'crf=18')
+    assert utils.read_estimates(estimates_file) == {}
+    update(estimates_file, 'crf=18', 90, 2100)
+    assert 'ssim' not in utils.read_estimates(estimates_file)['crf=18']
+
+def test_incomplete_line_is_skipped(tmp_path):
+    estimates_file = str(tmp_path / 'estimates')
+    update(estimates_file, 'crf=18', 100, 2000)
+    with open(utils.estimates_journal(estimates_file), 'a') as f:
+        f.write('{"settings": "crf=2')
+    update(estimates_file, 'crf=20', 80, 1000)
+    assert list(utils.read_estimates(estimates_file)) == ['crf=18', 'crf=20']
+
+def test_compaction(tmp_path):
+    estimates_file = str(tmp_path / 'estimates')
+    update(estimates_file, 'crf=18', 100, 2000, time_err=5, ssim=0.98)
+    update(estimates_file, 'crf=20', 80, 1000, x264={'kb/s': 1234.5})
+    update(estimates_file, 'crf=22', 60, 500)
+    utils.delete_estimates(estimates_file, 'crf=22')
+    before = utils.read_estimates(estimates_file)
+    assert utils.compact_estimates(estimates_file) == before
+    assert os.path.getsize(utils.estimates_journal(estimates_file)) == 0
+    assert utils.read_estimates(estimates_file) == stripped(before)
+
+    # New records are merged with the compacted file
+    utils.append_estimates(estimates_file, {'settings': 'crf=20', 'psnr': 42.0})
+    assert utils.read_estimates(estimates_file)['crf=20']['psnr'] == 42.0
+    assert utils.read_estimates(estimates_file)['crf=20']['size'] == 1000
+
+def test_compaction_of_deleted_estimates_removes_file(tmp_path):
+    estimates_file = str(tmp_path / 'estimates')
+    update(estimates_file, 'crf=18', 100, 2000)
+    utils.compact_estimates(estimates_file)
+    assert os.path.exists(estimates_file)
+    utils.delete_estimates(estimates_file, 'crf=18')
+    assert utils.compact_estimates(estimates_file) == {}
+    assert not os.path.exists(estimates_file)
+
+def test_manifest(tmp_path):
+    samples_dir = str(tmp_path)
+    utils.update_manifest(samples_dir, 'crf=18', 'a', 'running')
+    utils.update_manifest(samples_dir, 'crf=20', 'b', 'running')
+    utils.update_manifest(samples_dir, 'crf=18', 'a', 'done', result={'size': 1})
+    manifest = utils.read_manifest(samples_dir)
+    assert manifest['crf=18']['state'] == 'done'
+    assert manifest['crf=18']['result'] == {'size': 1}
+    assert manifest['crf=20']['state'] == 'running'
+
+def test_standard_error_shows_seconds(tmp_path):
+    estimates_file = str(tmp_path / 'estimates')
+    record = update(estimates_file, 'crf=18', 3725, 2000, time_err=5)
+    assert record['time_str'] == '01:02 ±00:00:05'
+
+def test_compaction_keeps_records_appended_without_lock(tmp_path, monkeypatch):
+    estimates_file = str(tmp_path / 'estimates')
+    update(estimates_file, 'crf=18', 100, 2000)
+    update(estimates_file, 'crf=20', 80, 1000)
+    read = utils._read_estimates
+    def read_and_append(*args):
+        est = read(*args)
+        # Like txs-compare.lua deleting a sample during compaction
+        with open(utils.estimates_journal(estimates_file), 'a') as f:
+            f.write('{"settings": "crf=18", "deleted": true}\n')
+        return est
+    monkeypatch.setattr(utils, '_read_estimates', read_and_append)
+    assert list(utils.compact_estimates(estimates_file)) == ['crf=18', 'crf=20']
+    monkeypatch.undo()
+    assert list(utils.read_estimates(estimates_file)) == ['crf=20']
+    assert list(utils.compact_estimates(estimates_file)) == ['crf=20']
+    assert os.path.getsize(utils.estimates_journal(estimates_file)) == 0
@@ -0,0 +1,121 @@
+import types
+
+import pytest
+
+from txs import ffmpeg
+
+# ffmpeg's log of an encode with libx264 without and with x264's summary
+LOG_HEADER = '''\
+Input #0, matroska,webm, from 'src.original@5:00-10.mkv':
+  Duration: 00:00:10.01, start: 0.000000, bitrate: 4205 kb/s
+[libx264 @ 0x5581c4a0e9c0] using SAR=1/1
+[libx264 @ 0x5581c4a0e9c0] using cpu capabilities: MMX2 SSE2Fast SSSE3 SSE4.2 AVX FMA3 BMI2 AVX2
+[libx264 @ 0x5581c4a0e9c0] profile High, level 4.0, 4:2:0, 8-bit
+frame=  240 fps= 31 q=-1.0 Lsize=    2592kB time=00:00:09.97 bitrate=2129.5kbits/s speed=1.29x
+video:2584kB audio:0kB subtitle:0kB other streams:0kB global headers:0kB muxing overhead: 0.302513%
+'''
+
+LOG_SUMMARY = '''\
+[libx264 @ 0x5581c4a0e9c0] frame I:1     Avg QP:20.23  size: 79528
+[libx264 @ 0x5581c4a0e9c0] frame P:60    Avg QP:22.70  size: 21017
+[libx264 @ 0x5581c4a0e9c0] frame B:179   Avg QP:25.12  size:  6043
+[libx264 @ 0x5581c4a0e9c0] consecutive B-frames:  0.8%  0.0%  1.2% 97.9%
+[libx264 @ 0x5581c4a0e9c0] mb I  I16..4: 13.4% 70.5% 16.1%
+[libx264 @ 0x5581c4a0e9c0] mb P  I16..4:  1.9%  5.5%  0.7%  P16..4: 39.6% 14.9%  7.2%  0.0%  0.0%    skip:30.2%
+[libx264 @ 0x5581c4a0e9c0] mb B  I16..4:  0.2%  0.4%  0.1%  B16..8: 37.1%  5.1%  1.2%  direct: 2.9%  skip:53.0%  L0:42.5% L1:48.8% BI: 8.7%
+[libx264 @ 0x5581c4a0e9c0] 8x8 transform intra:68.6% inter:75.0%
+[libx264 @ 0x5581c4a0e9c0] direct mvs  spatial:98.9% temporal:1.1%
+[libx264 @ 0x5581c4a0e9c0] coded y,uvDC,uvAC intra: 56.7% 64.1% 19.3% inter: 11.0% 12.2% 0.9%
+[libx264 @ 0x5581c4a0e9c0] i16 v,h,dc,p: 30% 25%  9% 36%
+[libx264 @ 0x5581c4a0e9c0] Weighted P-Frames: Y:3.3% UV:1.7%
+[libx264 @ 0x5581c4a0e9c0] ref P L0: 58.2% 17.0% 16.6%  8.3%
+[libx264 @ 0x5581c4a0e9c0] ref B L0: 85.5% 11.2%  3.3%
+[libx264 @ 0x5581c4a0e9c0] ref B L1: 96.5%  3.5%
+[libx264 @ 0x5581c4a0e9c0] kb/s:2116.66
+'''
+
+def test_wait_reports_resources():
+    proc = ffmpeg._start('sh', '-c', 'exit 4')
+    assert proc.wait() == 4
+    assert ffmpeg._resources(proc)['maxrss'] > 0
+    assert proc not in ffmpeg._running
+
+def test_kill():
+    proc = ffmpeg._start('sleep', '10')
+    proc.kill()
+    assert proc.wait() == -9
+    assert ffmpeg._resources(proc)['maxrss'] > 0
+    # Killing a reaped process does nothing
+    proc.kill()
+    assert proc.wait() == -9
+
+@pytest.fixture
+def logfile(tmp_path):
+    def logfile(*parts):
+        path = tmp_path / 'sample.log'
+        path.write_text(''.join(parts))
+        return str(path)
+    return logfile
+
+def test_x264_stats(logfile):
+    stats = ffmpeg.x264_stats(logfile(LOG_HEADER, LOG_SUMMARY))
+    assert stats['frames'] == 240
+    assert (stats['frames_I'], stats['frames_P'], stats['frames_B']) == (1, 60, 179)
+    assert stats['size_P'] == 21017
+    # Weighted by the number of frames of each type
+    assert stats['qp'] == pytest.approx((20.23 * 1 + 22.70 * 60 + 25.12 * 179) / 240)
+    assert stats['bframes'] == [0.8, 0.0, 1.2, 97.9]
+    assert stats['mb_P_p16_4'] == [39.6, 14.9, 7.2, 0.0, 0.0]
+    assert stats['mb_B_skip'] == 53.0
+    assert stats['ref_B_l1'] == [96.5, 3.5]
+    assert stats['transform_8x8_inter'] == 75.0
+    assert stats['coded_intra'] == [56.7, 64.1, 19.3]
+    assert stats['direct_spatial'] == 98.9
+    assert stats['weightp_y'] == 3.3
+    assert stats['kbps'] == 2116.66
+
+def test_x264_stats_of_multiple_summaries(logfile):
+    other = (LOG_SUMMARY.replace('frame P:60 ', 'frame P:180')
+                        .replace('Avg QP:22.70', 'Avg QP:26.70')
+                        .replace('kb/s:2116.66', 'kb/s:1000'))
+    stats = ffmpeg.x264_stats(logfile(LOG_SUMMARY, other))
+    assert stats['frames'] == 240 + 360
+    assert stats['frames_P'] == 240
+    assert stats['qp_P'] == pytest.approx((22.70 * 60 + 26.70 * 180) / 240)
+    assert stats['kbps'] == pytest.approx((2116.66 * 240 + 1000 * 360) / 600)
+
+def test_x264_stats_without_summary(logfile):
+    assert ffmpeg.x264_stats(logfile(LOG_HEADER)) == {}
+    assert ffmpeg.x264_stats(logfile('')) == {}
+
+def test_time_shares():
+    assert ffmpeg.time_shares([30, 10]) == [0.75, 0.25]
+    # The decoder's CPU time is added to each encoder
+    assert ffmpeg.time_shares([30, 10], 10) == [40 / 50, 20 / 50]
+    assert ffmpeg.time_shares([0, 0]) == [0.5, 0.5]
+
+def finished(cpu_time, maxrss=1000):
+    # Terminated process that used `cpu_time` seconds of CPU time
+    return types.SimpleNamespace(rusage=types.SimpleNamespace(ru_utime=cpu_time * 0.75,
+                                                              ru_stime=cpu_time * 0.25,
+                                                              ru_maxrss=maxrss))
+
+def test_attribute_time():
+    results = [{}, {}]
+    ffmpeg._attribute_time(results, 10, [finished(30), finished(10)])
+    assert [result['time'] for result in results] == [7.5, 2.5]
+    assert [result['cpu_time'] for result in results] == [30, 10]
+    assert results[0]['user_time'] == 22.5
+    assert results[0]['maxrss'] > 0
+
+def test_attribute_time_with_shared_decoder():
+    results = [{}, {}]
+    ffmpeg._attribute_time(results, 10, [finished(30), finished(10)], shared_cpu_time=10)
+    assert [result['time'] for result in results] == [8, 4]
+    # Every sample would need its own decoder in a normal encode
+    assert [result['cpu_time'] for result in results] == [40, 20]
+
+def test_attribute_time_of_single_process():
+    results = [{}]
+    ffmpeg._attribute_time(results, 10, [finished(0)])
+    assert results[0]['time'] == 10
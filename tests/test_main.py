@@ -0,0 +1,158 @@
+import os
+import threading
+
+from txs import main, utils
+
+def test_project_from_wall_clock_time():
+    results = [{'duration': 5, 'progress': [[1, 24, 24, 1], [10, 120, 12, 0.5]], 'size': 100}]
+    assert main._project(results, 10, 100) == (200, 2000)
+    assert main._project(results, 10, 100, share=0.5) == (100, 2000)
+    # Too early to tell
+    assert main._project(results, 100, 100) is None
+
+def test_project_from_cpu_time():
+    # Two parts of a split excerpt that took 10 seconds in parallel
+    results = [{'duration': 5, 'progress': [[10, 120, 12, 0.5]], 'size': 100, 'cpu_time': 20},
+               {'duration': 5, 'progress': [[10, 120, 12, 0.5]], 'size': 100, 'cpu_time': 20}]
+    assert main._project(results, 10, 100, parallelism=2) == (200, 2000)
+    # CPU time isn't known on every platform
+    del results[0]['cpu_time']
+    assert main._project(results, 10, 100, parallelism=2) == (100, 2000)
+
+def test_whole_ranges():
+    assert main._whole_ranges(600, '5:00') == [('0:00:00', '5:00'), ('0:05:00', '0:05:00')]
+    # A short tail is part of the last range
+    assert main._whole_ranges(610.04, '5:00') == [('0:00:00', '5:00'), ('0:05:00', '0:05:10.040')]
+    assert main._whole_ranges(790, '5:00') == [('0:00:00', '5:00'), ('0:05:00', '5:00'),
+                                               ('0:10:00', '0:03:10')]
+    # Start times aren't truncated
+    assert main._whole_ranges(5, '1.5') == [('0:00:00', '1.5'), ('0:00:01.500', '1.5'),
+                                            ('0:00:03', '0:00:02')]
+
+def test_rejected_sample_restored_from_cache(tmp_path):
+    estimates_file = str(tmp_path / 'estimates')
+    settings = utils.parse_settings('crf=18')
+    utils.update_estimates(estimates_file, settings, 500, 9000, settings,
+                           rejected='Estimated final size exceeds 8.00 KiB')
+    cached = utils.read_estimates(estimates_file)['crf=18']
+    cached = {**cached, 'time': 100, 'size': 2000, 'ssim': 0.98}
+    del cached['rejected']
+    main._restore_estimates(estimates_file, cached, replace=True)
+    record = utils.read_estimates(estimates_file)['crf=18']
+    assert 'rejected' not in record
+    assert record['size'] == 2000
+    assert record['ssim'] == 0.98
+
+def test_failed_proxy_doesnt_stop_builder(tmp_path, monkeypatch):
+    for name in ('src.sample@5:00-10.crf=18.mkv', 'src.sample@5:00-10.crf=20.mkv'):
+        (tmp_path / name).write_bytes(b'x')
+    stop = threading.Event()
+    scans = []
+    proxy_jobs = main._proxy_jobs
+    def scan(samples_dir):
+        scans.append(None)
+        if len(scans) == 2:
+            stop.set()
+        return proxy_jobs(samples_dir)
+    built = []
+    def proxy(source, dest):
+        built.append(os.path.basename(source))
+        if 'crf=18' in source:
+            utils.croak()
+        with open(dest, 'w'):
+            pass
+    monkeypatch.setattr(main, '_proxy_jobs', scan)
+    monkeypatch.setattr(main, 'PROXY_RESCAN_INTERVAL', 0)
+    monkeypatch.setattr(main.ffmpeg, 'proxy', proxy)
+    main._build_proxies(str(tmp_path), 2, stop)
+    # The failed sample isn't tried again until it changes
+    assert sorted(built) == ['src.sample@5:00-10.crf=18.mkv', 'src.sample@5:00-10.crf=20.mkv']
+
+def test_unique_sample_settings():
+    grid = iter(utils.iter_sample_settings('crf=18/23:bframes=0/3:b-adapt=1/2'))
+    unique = main._unique_sample_settings(utils.parse_settings('preset=medium'), grid)
+    # b-adapt doesn't matter without B-frames
+    assert [str(settings) for settings in unique] == [
+        'crf=18:bframes=0:b-adapt=1',
+        'crf=18:bframes=3:b-adapt=1',
+        'crf=18:bframes=3:b-adapt=2',
+        'crf=23:bframes=0:b-adapt=1',
+        'crf=23:bframes=3:b-adapt=1',
+        'crf=23:bframes=3:b-adapt=2']
+    # The grid is only walked once
+    assert next(grid, None) is None
+    grid = utils.iter_sample_settings('crf=18/18.0:ref=3/03')
+    assert [str(s) for s in main._unique_sample_settings({}, grid)] == ['crf=18:ref=3']
+
+def test_pruned_samples_are_marked_in_manifest(tmp_path):
+    samples_dir = str(tmp_path)
+    estimates_file = str(tmp_path / 'estimates')
+    paths = {}
+    for key in ('crf=18', 'crf=20'):
+        settings = utils.parse_settings(key)
+        utils.update_estimates(estimates_file, settings, 100, 2000, settings)
+        utils.update_manifest(samples_dir, key, 'hash' + key, 'done')
+        paths[key] = str(tmp_path / f'src.sample@5:00-10.{key}.mkv')
+        with open(paths[key], 'w'):
+            pass
+    main._prune(samples_dir, estimates_file, {'crf=18': paths['crf=18']})
+    assert not os.path.exists(paths['crf=18'])
+    assert list(utils.read_estimates(estimates_file)) == ['crf=20']
+    manifest = utils.read_manifest(samples_dir)
+    assert manifest['crf=18']['state'] == 'pruned'
+    assert manifest['crf=18']['hash'] == 'hashcrf=18'
+    assert manifest['crf=20']['state'] == 'done'
+
+def test_project_fan_out_with_decoder():
+    # One of two encoders that share a decoder and use 3 of 4 seconds of CPU
+    # time without the decoder
+    result = {'duration': 5, 'progress': [[10, 120, 12, 0.5]], 'size': 100, 'cpu_time': 15}
+    assert main._project([result], 10, 100, share=0.75) == (150, 2000)
+    assert main._project([result], 10, 100, parallelism=2, shared_cpu_time=5) == (200, 2000)
+
+def test_uses_cpu_time():
+    assert not main._uses_cpu_time(1, 1)
+    assert main._uses_cpu_time(4, 1)
+    assert main._uses_cpu_time(1, 2)
+
+def store(tmp_path, result, **kwargs):
+    dest = tmp_path / 'sample.mkv'
+    dest.write_bytes(b'x' * 1000)
+    (tmp_path / 'sample.log').write_text('')
+    settings = utils.parse_settings('crf=18')
+    record, _ = main._store_result(dict(result, metrics={}), str(tmp_path),
+                                   str(tmp_path / 'estimates'), settings, settings, str(dest),
+                                   'hash', 100, **kwargs)
+    return record
+
+def test_store_result_of_parallel_jobs(tmp_path):
+    # Wall clock time is inflated by the other jobs, so time is estimated from
+    # CPU time spread over the cores x264 keeps busy
+    result = {'duration': 10, 'time': 30, 'cpu_time': 20}
+    assert store(tmp_path, result)['time'] == 300
+    record = store(tmp_path, result, jobs=3, calibration={'parallelism': 4})
+    assert record['time'] == 50
+    assert record['size'] == 10000
+
+def test_store_result_of_split_excerpt(tmp_path):
+    chunks = [{'duration': 5, 'time': 3, 'cpu_time': 10, 'size': 500},
+              {'duration': 5, 'time': 3, 'cpu_time': 10, 'size': 500}]
+    result = {'duration': 10, 'time': 6, 'cpu_time': 20, 'chunks': chunks}
+    record = store(tmp_path, result, split=2, calibration={'parallelism': 4})
+    assert record['time'] == 50
+    assert 'time_err' not in record
+
+def test_tune_jobs_splits_cores_like_samples(monkeypatch):
+    measured = []
+    def throughput(excerpt, settings, processes, threads=None, vf=None, topic=None):
+        measured.append((processes, threads))
+        return {'fps': 10 * processes}
+    monkeypatch.setattr(main.utils, 'cpu_count', lambda: 8)
+    monkeypatch.setattr(main.ffmpeg, 'throughput', throughput)
+    # Samples with 3 parts
+    assert main._tune_jobs('excerpt.mkv', {}, None, 3, 100) == 2
+    assert measured == [(3, 2), (6, 1)]
+    # Never more jobs than samples
+    measured.clear()
+    assert main._tune_jobs('excerpt.mkv', {}, None, 1, 1) == 1
+    assert measured == []
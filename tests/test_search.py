@@ -0,0 +1,95 @@
+import itertools
+
+from txs import search
+
+def run(space, budget, score):
+    # Return searcher after reporting score(settings) for every batch
+    searcher = search.CoordinateDescent(space, budget)
+    tried = []
+    while True:
+        batch = searcher.next_batch()
+        if not batch:
+            return searcher, tried
+        for settings in batch:
+            tried.append(settings)
+            searcher.report(settings, score(settings))
+
+def test_finds_best_of_separable_space():
+    space = {'crf': ['16', '18', '20', '22', '24'], 'me': ['dia', 'hex', 'umh']}
+    def score(settings):
+        return -abs(int(settings['crf']) - 20) + {'dia': 0, 'hex': 1, 'umh': 3}[settings['me']]
+    searcher, tried = run(space, 100, score)
+    assert searcher.best == {'crf': '20', 'me': 'umh'}
+    assert len(tried) < 5 * 3
+    # Nothing is tried twice
+    assert len(set(tuple(sorted(s.items())) for s in tried)) == len(tried)
+
+def test_starts_with_middle_values():
+    searcher = search.CoordinateDescent({'crf': ['16', '18', '20'], 'ref': ['1', '3', '5']}, 100)
+    batch = searcher.next_batch()
+    assert {'crf': '18', 'ref': '3'} in batch
+    assert all(s['ref'] == '3' for s in batch)
+
+def test_budget():
+    space = {'crf': [str(n) for n in range(10)], 'ref': [str(n) for n in range(10)]}
+    searcher, tried = run(space, 7, lambda settings: int(settings['crf']) + int(settings['ref']))
+    assert len(tried) == 7
+    assert searcher.tried == 7
+
+def test_flags_are_tried_with_and_without():
+    space = {'crf': ['18'], 'no-mbtree': [None]}
+    searcher, tried = run(space, 10, lambda settings: 1 if 'no-mbtree' in settings else 0)
+    assert {'crf': '18'} in tried
+    assert {'crf': '18', 'no-mbtree': None} in tried
+    assert searcher.best == {'crf': '18', 'no-mbtree': None}
+
+def test_settings_without_score_are_never_best():
+    space = {'crf': ['16', '18', '20']}
+    def score(settings):
+        return None if settings['crf'] == '16' else int(settings['crf'])
+    searcher, _ = run(space, 10, score)
+    assert searcher.best == {'crf': '20'}
+    assert searcher.best_score == 20
+
+def test_score():
+    record = {'size': 1000, 'time': 60, 'ssim': 0.98}
+    assert search.score(record, 'size', 'ssim') == -1000
+    assert search.score(record, 'quality', 'ssim') == 0.98
+    assert search.score(record, 'quality-per-byte', 'ssim') == 0.98 / 1000
+    assert search.score(record, 'quality', 'psnr') is None
+    assert search.score(record, 'size', 'ssim', max_size=999) is None
+    assert search.score(record, 'size', 'ssim', max_time=59) is None
+    assert search.score(dict(record, rejected=True), 'size', 'ssim') is None
+
+def grid(**space):
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*space.values())]
+
+def test_spread_is_a_permutation():
+    settings_list = grid(crf=['16', '18', '20', '22'], me=['hex', 'umh'], ref=['1', '3', '5'])
+    spread = search.spread(settings_list)
+    assert sorted(map(str, spread)) == sorted(map(str, settings_list))
+
+def test_spread_is_deterministic():
+    settings_list = grid(crf=[str(n) for n in range(20)], ref=[str(n) for n in range(20)])
+    assert search.spread(settings_list) == search.spread(settings_list)
+
+def test_spread_covers_grid_first():
+    settings_list = grid(crf=['16', '18', '20', '22'], me=['dia', 'hex', 'umh', 'tesa'])
+    spread = search.spread(settings_list)
+    # The first samples differ in every setting from each other
+    first = spread[:4]
+    for a,b in itertools.combinations(first, 2):
+        assert a['crf'] != b['crf'] and a['me'] != b['me']
+
+def test_spread_with_flags_and_few_settings():
+    assert search.spread([]) == []
+    assert search.spread([{'crf': '18'}]) == [{'crf': '18'}]
+    settings_list = [{'crf': '18'}, {'crf': '18', 'no-mbtree': None}]
+    assert sorted(map(str, search.spread(settings_list))) == sorted(map(str, settings_list))
+
+def test_spread_of_large_grid_keeps_order_of_the_rest():
+    settings_list = grid(crf=[str(n) for n in range(30)], ref=[str(n) for n in range(30)])
+    spread = search.spread(settings_list)
+    rest = spread[search.SPREAD_SIZE:]
+    assert rest == [s for s in settings_list if s in rest]
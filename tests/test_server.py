@@ -0,0 +1,23 @@
+import os
+
+import pytest
+
+from txs import server
+
+@pytest.mark.skipif(not hasattr(os, 'sched_setaffinity'), reason='No CPU affinity')
+def test_job_pins_itself(monkeypatch):
+    cpus = os.sched_getaffinity(0)
+    try:
+        monkeypatch.setenv(server.CPUS_ENV, str(min(cpus)))
+        server.pin()
+        assert os.sched_getaffinity(0) == {min(cpus)}
+        # Children of the job aren't pinned again
+        assert server.CPUS_ENV not in os.environ
+    finally:
+        os.sched_setaffinity(0, cpus)
+
+def test_unpinned_process(monkeypatch):
+    monkeypatch.delenv(server.CPUS_ENV, raising=False)
+    before = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else None
+    server.pin()
+    assert (os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else None) == before
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+
+from txs import spool
+
+def put_jobs(spool_dir, count):
+    spool._mkdirs(spool_dir)
+    for i in range(count):
+        spool.put(spool_dir, i, f'id{i}', {'number': i})
+
+def test_jobs_are_claimed_in_order(tmp_path):
+    spool_dir = str(tmp_path)
+    put_jobs(spool_dir, 3)
+    assert spool.spooled(spool_dir) == {'id0', 'id1', 'id2'}
+    claimed, job = spool.claim(spool_dir, 'a')
+    assert job == {'number': 0}
+    assert os.path.basename(claimed) == '000000.id0.job@a'
+    # Claimed jobs are still spooled
+    assert spool.spooled(spool_dir) == {'id0', 'id1', 'id2'}
+    spool.finish(spool_dir, claimed, spool.DONE)
+    assert spool.spooled(spool_dir) == {'id1', 'id2'}
+    assert spool.claim(spool_dir, 'a')[1] == {'number': 1}
+    assert spool.claim(spool_dir, 'a')[1] == {'number': 2}
+    assert spool.claim(spool_dir, 'a') is None
+
+def test_job_claimed_by_another_worker_is_skipped(tmp_path, monkeypatch):
+    spool_dir = str(tmp_path)
+    put_jobs(spool_dir, 2)
+    listdir = os.listdir
+    def stale_listdir(path):
+        # Listing from before the other worker renamed the first job
+        names = listdir(path)
+        if path.endswith(spool.QUEUE):
+            names.append('000000.id0.job')
+        return names
+    spool.claim(spool_dir, 'a')
+    monkeypatch.setattr(spool.os, 'listdir', stale_listdir)
+    claimed, job = spool.claim(spool_dir, 'b')
+    assert job == {'number': 1}
+    assert os.path.basename(claimed) == '000001.id1.job@b'
+
+def test_every_job_is_claimed_once(tmp_path):
+    spool_dir = str(tmp_path)
+    put_jobs(spool_dir, 50)
+    claims = []
+    def work(worker):
+        while True:
+            claim = spool.claim(spool_dir, worker)
+            if claim is None:
+                break
+            claims.append(claim[1]['number'])
+    workers = [threading.Thread(target=work, args=(f'w{i}',)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sorted(claims) == list(range(50))
+
+def test_expiry_is_judged_by_file_server_clock(tmp_path, monkeypatch):
+    spool_dir = str(tmp_path)
+    put_jobs(spool_dir, 1)
+    claimed, _ = spool.claim(spool_dir, 'a')
+    # The clock file is touched by the file server
+    assert abs(spool._now(spool_dir) - time.time()) < 60
+    touched = os.stat(claimed).st_mtime
+    # This machine's clock is irrelevant
+    monkeypatch.setattr(time, 'time', lambda: touched + 10**6)
+    monkeypatch.setattr(spool, '_now', lambda spool_dir: touched + 100)
+    spool.recover(spool_dir, lease=300)
+    assert os.path.exists(claimed)
+    monkeypatch.setattr(spool, '_now', lambda spool_dir: touched + 301)
+    spool.recover(spool_dir, lease=300)
+    assert not os.path.exists(claimed)
+    assert spool.spooled(spool_dir) == {'id0'}
+
+def test_stale_claim_is_taken_over(tmp_path):
+    spool_dir = str(tmp_path)
+    put_jobs(spool_dir, 2)
+    stale, _ = spool.claim(spool_dir, 'a')
+    # Worker "a" died a while ago
+    old = spool._now(spool_dir) - 1000
+    os.utime(stale, (old, old))
+    claimed, job = spool.claim(spool_dir, 'b', lease=300)
+    assert job == {'number': 0}
+    assert os.path.basename(claimed) == '000000.id0.job@b'
+    # Worker "a" comes back and finishes without taking the job back
+    spool.finish(spool_dir, stale, spool.DONE)
+    assert os.path.exists(claimed)
+    assert os.listdir(os.path.join(spool_dir, spool.DONE)) == []
+
+def test_lease_renews_claim(tmp_path):
+    spool_dir = str(tmp_path)
+    put_jobs(spool_dir, 1)
+    claimed, _ = spool.claim(spool_dir, 'a')
+    os.utime(claimed, (0, 0))
+    with spool.Lease(claimed, lease=0.05):
+        time.sleep(0.1)
+        assert os.stat(claimed).st_mtime > 0
+        # Another worker took over
+        spool.release(spool_dir, claimed)
+        time.sleep(0.05)
+    assert spool.spooled(spool_dir) == {'id0'}
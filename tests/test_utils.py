@@ -0,0 +1,41 @@
+import pytest
+
+from txs import utils
+
+@pytest.mark.parametrize('strings', (
+    ('crf=18',),
+    ('crf=18/20/22:me=hex/umh',),
+    ('crf=18/20:no-mbtree',),
+    ('crf=18/20:no-mbtree:no-fast-pskip:ref=1/3/5',),
+    ('crf=18/20', 'bframes=3/5:b-adapt=1/2', 'no-cabac'),
+    ('deblock=0\\:0/-1\\:-1:psy-rd=1\\/0.2',),
+))
+def test_count_sample_settings(strings):
+    assert utils.count_sample_settings(*strings) == len(utils.generate_sample_settings(*strings))
+
+def test_sample_settings_with_flags():
+    assert utils.generate_sample_settings('crf=18/20:no-mbtree') == [
+        utils.Settings({'crf': '18'}), utils.Settings({'crf': '18', 'no-mbtree': None}),
+        utils.Settings({'crf': '20'}), utils.Settings({'crf': '20', 'no-mbtree': None})]
+
+def test_pareto_front():
+    records = {'a': {'ssim': 0.99, 'size': 300},
+               'b': {'ssim': 0.98, 'size': 200},
+               'c': {'ssim': 0.97, 'size': 250},
+               'd': {'ssim': 0.99, 'size': 350}}
+    assert utils.pareto_front(records, maximize=('ssim',), minimize=('size',)) == ['a', 'b']
+
+def test_pareto_front_with_ties():
+    # Equal records don't dominate each other
+    records = {'a': {'ssim': 0.99, 'size': 300},
+               'b': {'ssim': 0.99, 'size': 300},
+               'c': {'ssim': 0.99, 'size': 301}}
+    assert utils.pareto_front(records, maximize=('ssim',), minimize=('size',)) == ['a', 'b']
+
+def test_pareto_front_with_missing_fields():
+    # Records without all fields are neither on the front nor dominate others
+    records = {'a': {'ssim': 0.98, 'size': 300},
+               'b': {'size': 100},
+               'c': {'ssim': 0.99}}
+    assert utils.pareto_front(records, maximize=('ssim',), minimize=('size',)) == ['a']
+    assert utils.pareto_front({'b': {'size': 100}}, maximize=('ssim',), minimize=('size',)) == []
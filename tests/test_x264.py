@@ -0,0 +1,53 @@
+import pytest
+
+from txs import x264, utils
+
+def canonical(string):
+    return x264.canonical(utils.parse_settings(string))
+
+@pytest.mark.parametrize('a, b', (
+    ('crf=23', ''),
+    ('deblock=0\\:0', 'deblock=0,0'),
+    ('qcomp=0.60', 'qcomp=0.6'),
+    ('crf=18.0', 'crf=18'),
+    ('keyint=1e3', 'keyint=1000'),
+    ('cabac', ''),
+    ('bframes=0:b-adapt=2:direct=auto', 'bframes=0'),
+    ('bframes=1:b-pyramid=strict', 'bframes=1'),
+    ('b-pyramid=2', ''),
+    ('no-cabac:trellis=2', 'no-cabac'),
+    ('no-deblock:deblock=-2,-1', 'no-deblock'),
+    ('aq-mode=0:aq-strength=0.5', 'aq-mode=0'),
+    ('ref=1:no-mixed-refs', 'ref=1'),
+    ('merange=32', ''),
+    ('me=dia:merange=2', 'me=dia:merange=4'),
+    ('subme=5:psy-rd=0.8,0.2', 'subme=5:psy-rd=0,0.2'),
+    ('trellis=0:psy-rd=1,0.2', 'trellis=0'),
+    ('no-psy:psy-rd=0.5', 'no-psy'),
+    ('preset=slow:deblock=0\\:0', 'preset=slow:deblock=0,0'),
+))
+def test_equivalent(a, b):
+    assert canonical(a) == canonical(b)
+
+@pytest.mark.parametrize('a, b', (
+    ('preset=slow:subme=7', 'preset=slow'),
+    ('tune=grain:deblock=0,0', 'tune=grain'),
+    ('preset=veryslow:ref=3', 'preset=veryslow'),
+    ('preset=ultrafast:cabac', 'preset=ultrafast'),
+    ('profile=high:bframes=3', 'profile=high'),
+    ('tune=film:psy-rd=1', 'tune=film'),
+    ('preset=veryslow:merange=32', 'preset=veryslow:merange=16'),
+    ('keyint=1234567', 'keyint=1234568'),
+    ('crf=18.0000001', 'crf=18'),
+    ('qcomp=0.6000001', 'qcomp=0.6'),
+    ('bframes=2:b-adapt=2', 'bframes=2'),
+    ('me=umh:merange=32', 'me=umh'),
+    ('no-cabac', ''),
+))
+def test_different(a, b):
+    assert canonical(a) != canonical(b)
+
+def test_normalized_values():
+    assert canonical('deblock=-1\\:-1.50:qcomp=0.700') == utils.Settings((('deblock', '-1,-1.5'),
+                                                                       ('qcomp', '0.7')))
+    assert canonical('chroma-qp-offset=-0.0') == utils.Settings(())
@@ -11,18 +11,30 @@ local o = {
    border_size = 1.0,
    border_color = "101010",
    estimates_file = './estimates',
+   rescan_interval = 2,
+   scheduler = 'default',
+   seed_by = 'size',
+   swiss_rounds = 0,
+   proxies = false,
 }
 options.read_options(o, 'txs')
 
 local video_file_extensions = {'mkv', 'mp4', 'ts', 'avi'}
+local proxies_dir = '.proxies'    -- Subdirectory with intra-only copies of samples
 local samples = {}                -- List of all samples
+local known_samples = {}          -- Set of all samples that were ever found
 local samples_to_revisit = {}     -- List of samples that were marked as "equal"
 local settings = {}               -- Map file paths to list of encoding settings
 local est_times = {}              -- Map file paths to estimated encoding time
 local est_sizes = {}              -- Map file paths to estimated final size
+local est_times_norm = {}         -- Map file paths to normalized encoding time
+local est_values = {}             -- Map file paths to numeric estimates and metrics
+local est_keys = {}               -- Map settings in sample file names to estimates keys
 local original = nil              -- Source video
 local current_playback_position = nil
 local longest_settings_string = nil
+local estimates_stamp = nil       -- Size and mtime of estimates file and journal
+local tournament = nil            -- State of the current tournament, if any
 
 
 function dbg(...)
@@ -46,9 +58,11 @@ function fill_playlist(args)
          local function callback(success, result, error)
             fill_playlist(args)
          end
+         -- Start playing if the playlist was empty because there were no
+         -- samples yet
          mp.command_native_async({name='loadfile',
-                                  url=next_sample,
-                                  flags='append'}, callback)
+                                  url=media_path(next_sample),
+                                  flags='append-play'}, callback)
       elseif #samples == 1 then
          info('###############################################################')
          info('# Best settings:', table.concat(get_all_settings(samples[1]), ':'))
@@ -89,8 +103,10 @@ end
 -- Remove all samples except for the current, then fill the playlist with more
 -- samples.
 function declare_better()
-   if #samples > 1 then
-      local filepath = mp.get_property('path')
+   if tournament ~= nil then
+      decide_match(1)
+   elseif #samples > 1 then
+      local filepath = current_path()
       dbg('Declaring better:', filepath)
       for _,filepath_ in playlist_iter() do
          if filepath_ ~= filepath then
@@ -105,8 +121,10 @@ end
 -- Remove current video from playlist and `samples`.  Fill the playlist with
 -- more samples if there's only one sample left.
 function declare_worse(quiet)
-   if #samples > 1 then
-      local filepath = mp.get_property('path')
+   if tournament ~= nil then
+      decide_match(0)
+   elseif #samples > 1 then
+      local filepath = current_path()
       dbg('Declaring worse:', filepath)
       if filepath ~= nil and filepath ~= original then
          remove_sample({filepath=filepath, refill=true})
@@ -118,8 +136,10 @@ end
 -- Same as declare_worse(), but also remove sample from file system and
 -- estimates file.
 function declare_garbage()
-   if #samples > 1 then
-      local filepath = mp.get_property('path')
+   if tournament ~= nil then
+      decide_match(0, {delete_file=true})
+   elseif #samples > 1 then
+      local filepath = current_path()
       dbg('Declaring garbage:', filepath)
       if filepath ~= nil and filepath ~= original then
          remove_sample({filepath=filepath, refill=true, delete_file=true})
@@ -131,7 +151,9 @@ end
 -- Remove all playlist items and add them to `samples_to_revisit`.
 -- fill_playlist() will reload them when `samples` is empty.
 function declare_equal()
-   if #samples > 1 then
+   if tournament ~= nil then
+      decide_match(0.5)
+   elseif #samples > 1 then
       -- Store current playlist
       local equals = {}
       info('Equals:')
@@ -186,26 +208,7 @@ function remove_sample(args)
          end
 
          if delete_file == true then
-            if o.debug then
-               dbg('Not deleting sample file while debugging:', filepath)
-            else
-               -- Remove sample file and its log file
-               os.remove(filepath)
-               os.remove(path_without_extension(filepath) .. '.log')
-
-               -- Remove estimates for this sample from estimates file
-               local diff_settings = table.concat(get_diff_settings(filepath), ':')
-               local tmp_est_file = o.estimates_file .. '.tmp'
-               local f = io.open(tmp_est_file, 'w')
-               for line in io.lines(o.estimates_file) do
-                  local parts = split_string(line, '/')
-                  if strip_string(parts[1]) ~= diff_settings then
-                     f:write(line..'\n')
-                  end
-               end
-               f:close()
-               os.rename(tmp_est_file, o.estimates_file)
-            end
+            delete_sample_file(filepath)
          end
 
          if refill == true then
@@ -221,6 +224,28 @@ function remove_sample(args)
    end
 end
 
+-- Remove sample and log file from file system and mark its estimates as
+-- deleted.
+function delete_sample_file(filepath)
+   if o.debug then
+      dbg('Not deleting sample file while debugging:', filepath)
+   else
+      -- Remove sample file and its log file
+      os.remove(filepath)
+      os.remove(path_without_extension(filepath) .. '.log')
+      local dir, filename = utils.split_path(filepath)
+      os.remove(utils.join_path(utils.join_path(dir, proxies_dir), filename))
+
+      -- Only append to the journal; we can't lock it, but txs keeps records
+      -- that are appended while it compacts the journal
+      local f = io.open(o.estimates_file .. '.journal', 'a')
+      if f then
+         f:write(utils.format_json({settings=estimates_key(filepath), deleted=true}) .. '\n')
+         f:close()
+      end
+   end
+end
+
 function prevent_empty_window(args)
    local args = args or {}
    -- Before removing the last sample or all samples from the playlist, we must
@@ -236,7 +261,7 @@ function prevent_empty_window(args)
       if next_sample ~= nil then
          dbg('loading next sample preemptively:', next_sample)
          mp.command_native({name='loadfile',
-                            url=next_sample,
+                            url=media_path(next_sample),
                             flags='append'})
       else
          dbg('setting playlist-pos-1 to', 1)
@@ -253,7 +278,7 @@ local tmp_playlist_file = os.tmpname()
 local toggle_original_playlist_pos = nil
 function toggle_original()
    if original ~= nil then
-      if mp.get_property('path') ~= original then
+      if current_path() ~= original then
          -- Save current playlist
          tmp_playlist = {}
          for _,filepath in playlist_iter() do
@@ -262,7 +287,7 @@ function toggle_original()
          -- Save playlist position
          toggle_original_playlist_pos = mp.get_property_number('playlist-pos')
          -- Load original and remove all other playlist items
-         mp.commandv('loadfile', original)
+         mp.commandv('loadfile', media_path(original))
          mp.commandv('playlist-clear')
       else
          -- Restore previous playlist and position
@@ -271,7 +296,7 @@ function toggle_original()
          -- playlist position.
          f = io.open(tmp_playlist_file, 'w')
          for _,filepath in ipairs(tmp_playlist) do
-            f:write(filepath..'\n')
+            f:write(media_path(filepath)..'\n')
          end
          f:close()
          mp.commandv('loadlist', tmp_playlist_file)
@@ -318,6 +343,385 @@ function playlist_prev()
 end
 
 
+-- Tournaments
+--
+-- With scheduler=knockout or scheduler=swiss, samples are compared in pairs
+-- instead of the default king of the hill: "b" means the current sample wins
+-- the match, "w" that it loses, "e" is a draw and shift+w also deletes the
+-- current sample and withdraws it from the tournament.  Samples are seeded by
+-- the estimate or metric named by seed_by (e.g. size, time or ssim).
+--
+-- The state is saved in the samples directory after every match, so quitting
+-- and running "txs compare" again resumes the tournament.  The ranking is
+-- written there when mpv quits.
+--
+-- A scheduler is a table with these functions:
+--   next_round(t)   Put the matches of the next round into t.matches and
+--                   return true or return false if the tournament is over
+--   record(t, winner, loser)
+--                   Called after each match that wasn't a draw
+--   ranking(t)      Return names of all players, best first
+
+local tournament_file = 'tournament'
+local schedulers = {}
+
+-- Names of players that are still in the tournament
+function active_players(t)
+   local names = {}
+   for name,player in pairs(t.players) do
+      if not player.withdrawn then
+         table.insert(names, name)
+      end
+   end
+   return names
+end
+
+function seed_value(name)
+   local filepath = utils.join_path(mp.get_property('working-directory'), name)
+   local values = est_values[estimates_key(filepath)]
+   if values ~= nil then
+      return values[o.seed_by]
+   end
+end
+
+-- Sort names by seed, best first.  Players without seed value are last.
+function sort_by_seed(names)
+   local lower_is_better = ({size=true, time=true, time_norm=true})[o.seed_by]
+   local values = {}
+   for _,name in ipairs(names) do
+      values[name] = seed_value(name)
+   end
+   table.sort(names, function(a, b)
+      local va, vb = values[a], values[b]
+      if va ~= nil and vb ~= nil and va ~= vb then
+         if lower_is_better then
+            return va < vb
+         else
+            return va > vb
+         end
+      elseif (va == nil) ~= (vb == nil) then
+         return va ~= nil
+      end
+      return a < b
+   end)
+   return names
+end
+
+-- Map names to their position in sort_by_seed()
+function seed_ranks(names)
+   local ranks = {}
+   for i,name in ipairs(sort_by_seed(names)) do
+      ranks[name] = i
+   end
+   return ranks
+end
+
+-- Each round, the best remaining seed plays the worst, the second best plays
+-- the second worst and so on.  Losers are out; the best seed gets a bye if
+-- there is an odd number of players.  Both players of a draw stay in.
+schedulers.knockout = {
+   next_round = function(t)
+      local names = {}
+      for _,name in ipairs(active_players(t)) do
+         if not t.players[name].eliminated then
+            table.insert(names, name)
+         end
+      end
+      -- Stop if there is a winner or if nobody lost or joined in the last
+      -- round because all matches were draws
+      local eliminated = false
+      for _,player in pairs(t.players) do
+         eliminated = eliminated or player.eliminated == t.round
+      end
+      if #names <= 1 or (t.round > 0 and not eliminated and not t.joined) then
+         return false
+      end
+      t.joined = false
+      sort_by_seed(names)
+      if #names % 2 == 1 then
+         dbg('Bye:', names[1])
+         table.remove(names, 1)
+      end
+      for i=1,#names/2 do
+         table.insert(t.matches, {names[i], names[#names + 1 - i]})
+      end
+      return true
+   end,
+   record = function(t, winner, loser)
+      t.players[loser].eliminated = t.round
+   end,
+   ranking = function(t)
+      local names = {}
+      for name,_ in pairs(t.players) do
+         table.insert(names, name)
+      end
+      local ranks = seed_ranks(names)
+      local function survived(name)
+         local player = t.players[name]
+         if player.withdrawn then
+            return -1
+         end
+         return player.eliminated or math.huge
+      end
+      table.sort(names, function(a, b)
+         if survived(a) ~= survived(b) then
+            return survived(a) > survived(b)
+         elseif t.players[a].points ~= t.players[b].points then
+            return t.players[a].points > t.players[b].points
+         end
+         return ranks[a] < ranks[b]
+      end)
+      return names
+   end,
+}
+
+-- Every round, players with the same number of points play each other if they
+-- haven't already.  The lowest ranked player without a bye gets one if there
+-- is an odd number of players.  The number of rounds is swiss_rounds or
+-- enough to find a single winner.
+schedulers.swiss = {
+   next_round = function(t)
+      local names = active_players(t)
+      local rounds = o.swiss_rounds
+      if rounds <= 0 then
+         rounds = math.ceil(math.log(math.max(#names, 2)) / math.log(2))
+      end
+      if t.joined then
+         -- Players that joined late get at least one more round
+         rounds = math.max(rounds, t.round + 1)
+      end
+      if #names <= 1 or t.round >= rounds then
+         return false
+      end
+      t.joined = false
+      names = schedulers.swiss.ranking(t, names)
+      if #names % 2 == 1 then
+         for i=#names,1,-1 do
+            local player = t.players[names[i]]
+            if not player.bye or i == 1 then
+               dbg('Bye:', names[i])
+               player.bye = true
+               player.points = player.points + 1
+               table.remove(names, i)
+               break
+            end
+         end
+      end
+      while #names > 0 do
+         local name = table.remove(names, 1)
+         local opponents = t.players[name].opponents
+         local pick = 1
+         for i,other in ipairs(names) do
+            if not opponents[other] then
+               pick = i
+               break
+            end
+         end
+         table.insert(t.matches, {name, table.remove(names, pick)})
+      end
+      return true
+   end,
+   record = function(t, winner, loser) end,
+   ranking = function(t, names)
+      if names == nil then
+         names = {}
+         for name,_ in pairs(t.players) do
+            table.insert(names, name)
+         end
+      end
+      local ranks = seed_ranks(names)
+      -- Buchholz score: Sum of opponents' points breaks ties
+      local buchholz = {}
+      for _,name in ipairs(names) do
+         buchholz[name] = 0
+         for other,_ in pairs(t.players[name].opponents) do
+            buchholz[name] = buchholz[name] + t.players[other].points
+         end
+      end
+      table.sort(names, function(a, b)
+         local pa, pb = t.players[a], t.players[b]
+         if (pa.withdrawn or false) ~= (pb.withdrawn or false) then
+            return not pa.withdrawn
+         elseif pa.points ~= pb.points then
+            return pa.points > pb.points
+         elseif buchholz[a] ~= buchholz[b] then
+            return buchholz[a] > buchholz[b]
+         end
+         return ranks[a] < ranks[b]
+      end)
+      return names
+   end,
+}
+
+function new_player()
+   return {points=0, opponents={}}
+end
+
+function save_tournament()
+   local filepath = utils.join_path(mp.get_property('working-directory'), tournament_file)
+   local tmp_filepath = filepath .. '.tmp'
+   local f = io.open(tmp_filepath, 'w')
+   if f then
+      f:write(utils.format_json(tournament) .. '\n')
+      f:close()
+      os.rename(tmp_filepath, filepath)
+   end
+end
+
+-- Resume tournament from the samples directory or start a new one.
+function start_tournament()
+   local scheduler = schedulers[o.scheduler]
+   if scheduler == nil then
+      info('Unknown scheduler:', o.scheduler)
+      return
+   end
+   local dir = mp.get_property('working-directory')
+   local filepath = utils.join_path(dir, tournament_file)
+   if file_exists(filepath) then
+      local f = io.open(filepath, 'r')
+      local state = utils.parse_json(f:read('*a'))
+      f:close()
+      if state ~= nil and state.scheduler == o.scheduler then
+         info('Resuming', o.scheduler, 'tournament in round', state.round)
+         tournament = state
+      end
+   end
+   if tournament == nil then
+      tournament = {scheduler=o.scheduler, round=0, players={}, matches={}, finished=false}
+   end
+   -- Empty tables are restored from JSON as empty lists
+   for _,player in pairs(tournament.players) do
+      player.opponents = player.opponents or {}
+      if next(player.opponents) == nil then
+         player.opponents = {}
+      end
+   end
+   -- Samples that were deleted since the last session are out
+   for name,player in pairs(tournament.players) do
+      if not file_exists(utils.join_path(dir, name)) then
+         player.withdrawn = true
+      end
+   end
+   for _,filepath in ipairs(samples) do
+      add_player(filepath)
+   end
+   next_match()
+end
+
+-- Add sample to the tournament, e.g. after it was encoded.  It joins in the
+-- next round.
+function add_player(filepath)
+   local _, name = utils.split_path(filepath)
+   if tournament.players[name] == nil then
+      dbg('New player:', name)
+      tournament.players[name] = new_player()
+      tournament.finished = false
+      tournament.joined = true
+   end
+end
+
+-- Load the next match into the playlist.  Start a new round if the current
+-- one is over.
+function next_match()
+   local t = tournament
+   -- Skip matches with players that were withdrawn in the meantime
+   while #t.matches > 0 and (t.players[t.matches[1][1]].withdrawn or
+                             t.players[t.matches[1][2]].withdrawn) do
+      table.remove(t.matches, 1)
+   end
+   if #t.matches == 0 and not t.finished then
+      if schedulers[t.scheduler].next_round(t) then
+         t.round = t.round + 1
+         info('Round', t.round .. ':', #t.matches, 'matches')
+      else
+         t.finished = true
+         info('Tournament is over')
+      end
+   end
+   save_tournament()
+   local dir = mp.get_property('working-directory')
+   if t.finished then
+      local ranking = schedulers[t.scheduler].ranking(t)
+      if #ranking > 0 then
+         mp.commandv('loadfile', media_path(utils.join_path(dir, ranking[1])), 'replace')
+         info('Best settings:', table.concat(get_all_settings(ranking[1]) or {}, ':'))
+      end
+   elseif #t.matches > 0 then
+      local match = t.matches[1]
+      mp.commandv('loadfile', media_path(utils.join_path(dir, match[1])), 'replace')
+      mp.commandv('loadfile', media_path(utils.join_path(dir, match[2])), 'append')
+   end
+   if info_is_visible() then
+      show_info()
+   end
+end
+
+-- Decide current match.  `score` is 1 if the current sample won, 0 if it lost
+-- and 0.5 for a draw.
+function decide_match(score, args)
+   local args = args or {}
+   local t = tournament
+   local match = t.matches[1]
+   local filepath = current_path()
+   if match == nil or filepath == nil then
+      return
+   end
+   local _, name = utils.split_path(filepath)
+   local other = nil
+   if name == match[1] then
+      other = match[2]
+   elseif name == match[2] then
+      other = match[1]
+   else
+      -- Original is shown
+      return
+   end
+   local player, other_player = t.players[name], t.players[other]
+   player.points = player.points + score
+   other_player.points = other_player.points + 1 - score
+   player.opponents[other] = true
+   other_player.opponents[name] = true
+   if score == 1 then
+      schedulers[t.scheduler].record(t, name, other)
+      info('Winner:', name)
+   elseif score == 0 then
+      schedulers[t.scheduler].record(t, other, name)
+      info('Winner:', other)
+   else
+      info('Draw:', name, other)
+   end
+   if args.delete_file then
+      player.withdrawn = true
+      delete_sample_file(filepath)
+      info('Deleted:', filepath)
+   end
+   table.remove(t.matches, 1)
+   next_match()
+end
+
+-- Store ranking with settings in the tournament file and log it.
+function finish_tournament()
+   local t = tournament
+   local dir = mp.get_property('working-directory')
+   t.ranking = {}
+   info('Ranking:')
+   for i,name in ipairs(schedulers[t.scheduler].ranking(t)) do
+      local entry = {sample=name, settings=estimates_key(utils.join_path(dir, name)),
+                     points=t.players[name].points, withdrawn=t.players[name].withdrawn}
+      table.insert(t.ranking, entry)
+      info(string.format('%3d. %s (%s points)', i, entry.settings, entry.points))
+   end
+   save_tournament()
+end
+
+function on_shutdown()
+   if tournament ~= nil then
+      finish_tournament()
+   end
+end
+mp.register_event('shutdown', on_shutdown)
+
+
 -- Event handlers
 
 function store_current_playback_position(event, time_pos)
@@ -328,7 +732,7 @@ end
 mp.observe_property('time-pos', 'native', store_current_playback_position)
 
 function on_file_loaded(event)
-   local filepath = mp.get_property('path')
+   local filepath = current_path()
    if filepath ~= nil then
       maybe_seek_to_current_playback_position()
       if info_is_visible() then
@@ -393,37 +797,25 @@ end
 
 -- Show permanent message
 function show_info()
-   local filepath = mp.get_property('path')
+   local filepath = current_path()
    local msg = ''
    if filepath == original then
       msg = '→Original\n\n'
    end
    if filepath ~= nil then
-      local diff_settings = get_diff_settings(filepath)
-      if diff_settings ~= nil then
-         local id = table.concat(diff_settings, ':')
-         if #samples > 1 then
+      if settings[filepath] ~= nil then
+         local id = estimates_key(filepath)
+         if tournament ~= nil and not tournament.finished then
+            msg = string.format('\n%s%s round %d: %d matches left\n\nCurrent samples:', msg,
+                                tournament.scheduler, tournament.round, #tournament.matches)
+            msg = playlist_info(msg, id)
+         elseif #samples > 1 and tournament == nil then
             msg = string.format('%s%s samples left', msg, #samples + #samples_to_revisit)
             if #samples_to_revisit > 0 then
                msg = string.format('%s (%s of equal quality)', msg, #samples_to_revisit)
             end
             msg = string.format('\n%s\n\nCurrent samples:', msg)
-            for i=0,mp.get_property_number('playlist-count')-1 do
-               local filepath_ = mp.get_property('playlist/' .. i .. '/filename')
-               local filepath_id = table.concat(get_diff_settings(filepath_), ':')
-               local filepath_id_len = get_longest_settings()
-               local est_time = est_times[filepath_id] or 'unknown'
-               local est_size = est_sizes[filepath_id] or 'unknown'
-               if filepath_id == id then
-                  msg = string.format('%s\n  →%s / %s / %s', msg,
-                                      rpad_string(filepath_id, filepath_id_len),
-                                      est_time, est_size)
-               else
-                  msg = string.format('%s\n   %s / %s / %s', msg,
-                                      rpad_string(filepath_id, filepath_id_len),
-                                      est_time, est_size)
-               end
-            end
+            msg = playlist_info(msg, id)
          else
             msg = string.format('%s\nBest settings: %s', msg, id)
          end
@@ -432,6 +824,31 @@ function show_info()
    show_overlay(msg)
 end
 
+-- Append estimates of each playlist item to `msg` and mark the current sample
+-- with ID `id`.
+function playlist_info(msg, id)
+   for i=0,mp.get_property_number('playlist-count')-1 do
+      local filepath_ = playlist_path(i)
+      local filepath_id = estimates_key(filepath_)
+      local filepath_id_len = get_longest_settings()
+      local est_time = est_times[filepath_id] or 'unknown'
+      if est_times_norm[filepath_id] ~= nil then
+         est_time = string.format('%s (%s)', est_time, est_times_norm[filepath_id])
+      end
+      local est_size = est_sizes[filepath_id] or 'unknown'
+      if filepath_id == id then
+         msg = string.format('%s\n  →%s / %s / %s', msg,
+                             rpad_string(filepath_id, filepath_id_len),
+                             est_time, est_size)
+      else
+         msg = string.format('%s\n   %s / %s / %s', msg,
+                             rpad_string(filepath_id, filepath_id_len),
+                             est_time, est_size)
+      end
+   end
+   return msg
+end
+
 function toggle_info()
    if redraw_timer == nil then
       show_info()
@@ -452,9 +869,7 @@ function get_longest_settings()
    if longest_settings_string == nil then
       longest_settings_string = 0
       for _,filepath in pairs(samples) do
-         local settings = get_diff_settings(filepath)
-         local settings_str = table.concat(settings, ':')
-         local len = string.len(settings_str)
+         local len = string.len(estimates_key(filepath))
          if len > longest_settings_string then
             longest_settings_string = len
          end
@@ -471,7 +886,7 @@ function is_sample(filepath)
    if filepath ~= nil then
       local dir, filename = utils.split_path(filepath)
       -- Example.sample@5:00-30.me=umh:deblock=-2,-2:trellis=2.mkv
-      if string.find(filename, '%.sample@[%d:-]+%-[%d:]+%.') then
+      if string.find(filename, '%.sample@[%d:%+xr%-]+%.') then
          return true
       end
    end
@@ -482,7 +897,9 @@ function is_original(filepath)
    if filepath ~= nil then
       local dir, filename = utils.split_path(filepath)
       -- Example.original@5:00-10.mkv
-      if string.find(filename, '%.original@[%d:-]+%-[%d:]+%.mkv$') then
+      -- Example.original@5:00-10+30:00-10.mkv
+      -- Example.original@8x10r.mkv
+      if string.find(filename, '%.original@[%d:%+xr%-]+%.mkv$') then
          return true
       end
    end
@@ -502,11 +919,11 @@ end
 function playlist_iter()
    local filepaths = {}
    local i = 0
-   local filepath = mp.get_property('playlist/' .. i .. '/filename')
+   local filepath = playlist_path(i)
    while filepath ~= nil do
       table.insert(filepaths, filepath)
       i = i + 1
-      filepath = mp.get_property('playlist/' .. i .. '/filename')
+      filepath = playlist_path(i)
    end
    i = -1
    return function()
@@ -519,6 +936,62 @@ function playlist_iter()
    end
 end
 
+-- Preview proxies
+--
+-- With proxies=yes, samples and the original are played from an intra-only
+-- copy in proxies_dir (see "txs compare --proxies") once it exists, so
+-- switching samples shows the exact frame instantly.  All other code uses the
+-- paths of the real files.
+
+-- Return path that plays `filepath`: its proxy if it is up to date or
+-- `filepath` itself
+function media_path(filepath)
+   if o.proxies and filepath ~= nil then
+      local dir, filename = utils.split_path(filepath)
+      local proxy = utils.join_path(utils.join_path(dir, proxies_dir), filename)
+      local proxy_info, file_info = utils.file_info(proxy), utils.file_info(filepath)
+      if proxy_info ~= nil and file_info ~= nil and proxy_info.mtime >= file_info.mtime then
+         return proxy
+      end
+   end
+   return filepath
+end
+
+-- Return path of the sample or original that `path` plays
+function sample_path(path)
+   if path ~= nil then
+      local dir, filename = utils.split_path(path)
+      local parent, name = utils.split_path((dir:gsub('/+$', '')))
+      if name == proxies_dir then
+         return utils.join_path(parent, filename)
+      end
+   end
+   return path
+end
+
+function current_path()
+   return sample_path(mp.get_property('path'))
+end
+
+function playlist_path(i)
+   return sample_path(mp.get_property('playlist/' .. i .. '/filename'))
+end
+
+-- Replace playlist items that aren't playing with proxies that were built
+-- after they were added
+function use_new_proxies()
+   local current = mp.get_property_number('playlist-pos')
+   for i,filepath in playlist_iter() do
+      local path = media_path(filepath)
+      if i ~= current and path ~= mp.get_property('playlist/' .. i .. '/filename') then
+         dbg('Using proxy:', path)
+         mp.commandv('loadfile', path, 'append')
+         mp.commandv('playlist-move', mp.get_property_number('playlist-count') - 1, i)
+         mp.commandv('playlist-remove', i + 1)
+      end
+   end
+end
+
 -- Find settings that are not the identical in any other sample.
 function get_diff_settings(filepath)
    local s = settings[filepath]
@@ -536,11 +1009,24 @@ function get_diff_settings(filepath)
    end
 end
 
+-- Return the key of the estimates of a sample, which are stored with the
+-- settings that "txs samples" was called with. Settings that differ between
+-- the samples found so far are only a guess until the estimates arrive.
+function estimates_key(filepath)
+   local all_settings = table.concat(settings[filepath] or {}, ':')
+   return est_keys[all_settings] or table.concat(get_diff_settings(filepath) or {}, ':')
+end
+
+-- Settings in the estimates are escaped, those in file names are not.
+function unescape_settings(str)
+   return (str:gsub('\\([=:])', '%1'))
+end
+
 function get_all_settings(filename)
    -- Example.sample@5:00-30.me=umh:deblock=-2,-2:trellis=2.mkv
       if is_sample(filename) then
       local s = string.gsub(filename, '%.([%a%d]+)$', '')     -- Remove file extension
-      s = string.gsub(s, '^.*%.sample@([%d:]+)%-[%d:]+%.', '') -- Remove title
+      s = string.gsub(s, '^.*%.sample@[%d:%+xr%-]+%.', '') -- Remove title
       return split_string(s, ':')
    end
 end
@@ -572,6 +1058,15 @@ function path_without_extension(path)
   return path:match("^(.+)%.%w-$") or path
 end
 
+function file_exists(path)
+   local f = io.open(path, 'r')
+   if f then
+      f:close()
+      return true
+   end
+   return false
+end
+
 
 
 --- Initialization
@@ -588,22 +1083,27 @@ function find_original()
    end
 end
 
--- Find sample files.
+-- Find sample files that weren't found before, add them to `samples` and
+-- return them.  Samples that were removed from `samples` are not added again.
 function find_samples()
    local dir = mp.get_property('working-directory')
-   for _,filename in ipairs(utils.readdir(dir)) do
+   local new_samples = {}
+   for _,filename in ipairs(utils.readdir(dir) or {}) do
       local ext = filename:match('%.([%a%d]+)$')
       for _,ext_ in ipairs(video_file_extensions) do
-         if ext_ == ext and is_sample(filename) then
-            table.insert(samples, utils.join_path(dir, filename))
+         local filepath = utils.join_path(dir, filename)
+         if ext_ == ext and is_sample(filename) and not known_samples[filepath] then
+            known_samples[filepath] = true
+            table.insert(new_samples, filepath)
          end
       end
    end
-   table.sort(samples)
-   info('Found', #samples, 'samples')
-   -- for k,v in pairs(samples) do
-   --    dbg(k, v)
-   -- end
+   table.sort(new_samples)
+   for _,filepath in ipairs(new_samples) do
+      dbg('New sample:', filepath)
+      table.insert(samples, filepath)
+   end
+   return new_samples
 end
 
 -- Read encoding settings from sample filenames.
@@ -613,21 +1113,86 @@ function find_settings()
    end
 end
 
+-- Return whether the estimates file or its journal changed since the last
+-- call.
+function estimates_changed()
+   local dir = mp.get_property('working-directory')
+   local filepath = utils.join_path(dir, o.estimates_file)
+   local stamp = ''
+   for _,path in ipairs({filepath, filepath .. '.journal'}) do
+      local file_info = utils.file_info(path)
+      if file_info ~= nil then
+         stamp = string.format('%s%d:%f;', stamp, file_info.size, file_info.mtime)
+      else
+         stamp = stamp .. '-;'
+      end
+   end
+   local changed = stamp ~= estimates_stamp
+   estimates_stamp = stamp
+   return changed
+end
+
 -- Read time and size estimates from estimates file.
 function read_estimates()
    local dir = mp.get_property('working-directory')
    local filepath = utils.join_path(dir, o.estimates_file)
-   -- Check if filepath exists first
-   local f = io.open(filepath, "r")
-   if f then
-      -- io.lines() wants a file path, not a handle
-      f:close()
+   est_times = {}
+   est_sizes = {}
+   est_times_norm = {}
+   est_values = {}
+   est_keys = {}
+   -- io.lines() fails if the file doesn't exist
+   if file_exists(filepath) then
       for line in io.lines(filepath) do
          local parts = split_string(line, '/')
          if #parts >= 4 then
             local s = parts[1]:gsub("^%s*(.-)%s*$", "%1")
             est_times[s] = parts[2]:gsub("^%s*(.-)%s*$", "%1")
             est_sizes[s] = parts[4]:gsub("^%s*(.-)%s*$", "%1")
+            est_values[s] = {time=tonumber(parts[3]), size=tonumber(parts[5])}
+            if #parts >= 6 then
+               est_keys[unescape_settings(strip_string(parts[6]))] = s
+            end
+            -- Optional fields are "<field>=<JSON value>"
+            for i=7,#parts do
+               local value = parts[i]:match('^%s*time_norm_str="(.*)"%s*$')
+               if value ~= nil then
+                  est_times_norm[s] = value
+               end
+               local field, number = parts[i]:match('^%s*([%w_]+)=(.-)%s*$')
+               if field ~= nil and tonumber(number) ~= nil then
+                  est_values[s][field] = tonumber(number)
+               end
+            end
+         end
+      end
+   end
+   -- Estimates that weren't merged into the estimates file yet
+   local journal = filepath .. '.journal'
+   if file_exists(journal) then
+      for line in io.lines(journal) do
+         local record = utils.parse_json(line)
+         if record ~= nil and record.settings ~= nil then
+            if record.deleted then
+               est_times[record.settings] = nil
+               est_sizes[record.settings] = nil
+               est_times_norm[record.settings] = nil
+               est_values[record.settings] = nil
+            else
+               if record.all_settings ~= nil then
+                  est_keys[unescape_settings(record.all_settings)] = record.settings
+               end
+               est_times[record.settings] = record.time_str or est_times[record.settings]
+               est_sizes[record.settings] = record.size_str or est_sizes[record.settings]
+               est_times_norm[record.settings] = record.time_norm_str or est_times_norm[record.settings]
+               local values = est_values[record.settings] or {}
+               for field,value in pairs(record) do
+                  if type(value) == 'number' then
+                     values[field] = value
+                  end
+               end
+               est_values[record.settings] = values
+            end
          end
       end
    end
@@ -654,8 +1219,55 @@ mp.set_property('loop-file', 'yes')
 mp.set_property('osd-fractions', 'yes')
 mp.set_property('osd-level', 2)
 
+-- Pick up samples and estimates that appeared since the last scan, e.g. while
+-- txs is still encoding.
+function rescan()
+   if original == nil then
+      find_original()
+   end
+   local new_samples = find_samples()
+   if #new_samples > 0 then
+      info('Found', #new_samples, 'new samples')
+      find_settings()
+      longest_settings_string = nil
+   end
+   local changed = estimates_changed()
+   if changed then
+      read_estimates()
+   end
+   if #new_samples > 0 then
+      if tournament ~= nil then
+         local finished = tournament.finished
+         for _,filepath in ipairs(new_samples) do
+            add_player(filepath)
+         end
+         -- New players start another round if the tournament was over
+         if finished then
+            next_match()
+         end
+      else
+         fill_playlist()
+      end
+   end
+   if o.proxies then
+      use_new_proxies()
+   end
+   if (changed or #new_samples > 0) and info_is_visible() then
+      show_info()
+   end
+end
+
 find_original()
 find_samples()
+info('Found', #samples, 'samples')
 find_settings()
+estimates_changed()
 read_estimates()
-fill_playlist()
+if o.scheduler ~= 'default' then
+   start_tournament()
+else
+   fill_playlist()
+end
+if o.rescan_interval > 0 then
+   mp.add_periodic_timer(o.rescan_interval, rescan)
+end
@@ -0,0 +1,159 @@
+import os
+import json
+import hashlib
+import threading
+import shutil
+
+from . import utils
+from . import __name__
+
+def cache_dir(*subdirs):
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(base, __name__, *subdirs)
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError as e:
+        utils.croak(f'Unable to create {path}: {os.strerror(e.errno)}')
+    return path
+
+def file_key(path):
+    # Identify a file by its path, size and modification time so that changed
+    # files are not found in the cache. Returns None for anything that isn't a
+    # local file or directory (e.g. URLs).
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [os.path.realpath(path), st.st_size, st.st_mtime_ns]
+
+def key2name(key):
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _tmp_path(path):
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+def get(subdir, key):
+    path = os.path.join(cache_dir(subdir), key2name(key) + '.json')
+    try:
+        with open(path, 'r') as f:
+            value = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Most recently used entries are evicted last
+    touch(path)
+    return value
+
+def put(subdir, key, value, max_size):
+    directory = cache_dir(subdir)
+    path = os.path.join(directory, key2name(key) + '.json')
+    tmp_path = _tmp_path(path)
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        utils.error(f'Unable to write {path}: {os.strerror(e.errno)}')
+    else:
+        _added(directory, path, max_size)
+
+def touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(_size(os.path.join(path, name)) for name in os.listdir(path))
+    else:
+        return os.path.getsize(path)
+
+# Size of each cache directory in bytes as of the last evict() plus everything
+# that was added since, so directories are only scanned when they might be too
+# large. Entries from other processes are counted by the next scan.
+_sizes = {}
+_sizes_lock = threading.Lock()
+
+def _added(directory, path, max_size):
+    try:
+        size = _size(path)
+    except OSError:
+        # Evicted by another process
+        size = 0
+    with _sizes_lock:
+        total = _sizes.get(directory)
+        if total is not None and total + size <= max_size:
+            _sizes[directory] = total + size
+            return
+    evict(directory, max_size)
+
+def evict(directory, max_size):
+    # Remove least recently used entries (files or directories) until all
+    # entries in `directory` are smaller than `max_size` bytes.
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            entries.append((os.stat(path).st_mtime, _size(path), path))
+        except OSError:
+            # Removed by another process
+            continue
+    total = sum(size for _,size,_ in entries)
+    for _,size,path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError:
+            pass
+        total -= size
+    with _sizes_lock:
+        _sizes[directory] = total
+
+def link(src, dst):
+    # Hard link `src` to `dst` or copy it if that isn't possible (e.g. on
+    # different file systems)
+    tmp_path = _tmp_path(dst)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+def get_dir(subdir, key):
+    # Return path of cached directory and the value stored with it or None
+    path = os.path.join(cache_dir(subdir), key2name(key))
+    try:
+        with open(os.path.join(path, 'value.json'), 'r') as f:
+            value = json.load(f)
+    except (OSError, ValueError):
+        return None
+    touch(path)
+    return path, value
+
+def put_dir(subdir, key, files, value, max_size, copy=()):
+    # Store `files` ({name: path}) in a directory in the cache. Files are hard
+    # linked unless their name is in `copy` because they are changed in place.
+    # An existing directory is kept.
+    directory = cache_dir(subdir)
+    path = os.path.join(directory, key2name(key))
+    tmp_path = _tmp_path(path)
+    try:
+        os.mkdir(tmp_path)
+        for name,src in files.items():
+            if name in copy:
+                shutil.copyfile(src, os.path.join(tmp_path, name))
+            else:
+                link(src, os.path.join(tmp_path, name))
+        with open(os.path.join(tmp_path, 'value.json'), 'w') as f:
+            json.dump(value, f)
+        os.rename(tmp_path, path)
+    except OSError as e:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.isdir(path):
+            utils.error(f'Unable to write {path}: {os.strerror(e.errno)}')
+    else:
+        _added(directory, path, max_size)
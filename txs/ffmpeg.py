@@ -1,9 +1,23 @@
+import sys
 import subprocess
 import json
 import os
 import re
 import pprint
+import threading
+import selectors
+import codecs
+import collections
+import time
+import tempfile
+import shutil
+import functools
+import platform
+import contextlib
+import signal
 from . import utils
+from . import cache
+from . import __name__
 
 if os.name == 'posix':
     FFPROBE = 'ffprobe'
@@ -14,40 +28,150 @@ elif os.name == 'nt':
 else:
     raise RuntimeError('Unsupported os: {os.name!r}')
 
-def _run(*args, stdout_callback=None, stderr_callback=None, **kwargs):
-    kwargs.update(stdout=subprocess.PIPE,
-                  stderr=subprocess.PIPE,
-                  bufsize=64,
-                  encoding='utf-8')
-    try:
-        proc = subprocess.Popen(args, **kwargs)
-    except OSError as e:
-        utils.croak(f'{args[0]}: {os.strerror(e.errno)}')
-    stderr = []
-    while proc.returncode is None:
-        proc.poll()
-        while True:
-            stderr_line = proc.stderr.readline().rstrip('\n')
-            if stderr_line:
-                stderr.append(stderr_line)
-                if stderr_callback is not None:
-                    stderr_callback(stderr_line)
-
-            stdout_line = ''
-            if stdout_callback is not None:
-                stdout_line = proc.stdout.readline().rstrip('\n')
-                if stdout_line:
-                    stdout_callback(stdout_line)
-
-            if not stderr_line and not stdout_line:
-                break
+# Children that are currently running in any thread
+_running = set()
+_running_lock = threading.Lock()
+_terminated = threading.Event()
+
+# Number of stderr lines to keep for error messages
+STDERR_LINES = 50
+
+# Maximum size of all cached ffprobe results in bytes
+PROBE_CACHE_SIZE = 8 * 2**20
+
+# Maximum size of all cached calibrations in bytes
+CALIBRATION_CACHE_SIZE = 2**20
+
+# Maximum size of all cached throughput measurements in bytes
+THROUGHPUT_CACHE_SIZE = 2**20
+
+def terminate():
+    # Kill all running children (e.g. after Ctrl-c) and make every thread that
+    # is waiting for one of them raise KeyboardInterrupt.
+    _terminated.set()
+    with _running_lock:
+        for proc in _running:
+            proc.kill()
+
+class _Process:
+    # Child process that passes each line on stdout and stderr to a callback.
+    # Lines are terminated by "\n" or "\r" (ffmpeg uses "\r" for its status
+    # line). If there is no stdout callback, stdout is collected in `stdout`.
+    # Only the last STDERR_LINES lines of stderr are kept in `stderr`.
+    def __init__(self, args, stdout_callback=None, stderr_callback=None, **kwargs):
+        kwargs.update(stdin=subprocess.DEVNULL,
+                      stdout=subprocess.PIPE,
+                      stderr=subprocess.PIPE,
+                      # Don't pass Ctrl-c on to children; we kill them
+                      # ourselves so we can clean up after all of them.
+                      start_new_session=True)
+        with _running_lock:
+            if _terminated.is_set():
+                raise KeyboardInterrupt()
+            try:
+                self.popen = subprocess.Popen(args, **kwargs)
+            except OSError as e:
+                utils.croak(f'{args[0]}: {os.strerror(e.errno)}')
+            _running.add(self)
+        self.args = self.popen.args
+        self.rusage = None
+        self.stdout = ''
+        self.stderr = collections.deque(maxlen=STDERR_LINES)
+        def collect_stdout(line):
+            self.stdout += line + '\n'
+        def collect_stderr(line):
+            self.stderr.append(line)
+            if stderr_callback is not None:
+                stderr_callback(line)
+        self._callbacks = {self.popen.stdout: stdout_callback or collect_stdout,
+                           self.popen.stderr: collect_stderr}
+        self._decoders = {f: codecs.getincrementaldecoder('utf-8')(errors='replace')
+                          for f in self._callbacks}
+        self._buffers = {f: '' for f in self._callbacks}
+
+    @property
+    def pipes(self):
+        return tuple(self._callbacks)
+
+    @property
+    def returncode(self):
+        return self.popen.returncode
+
+    def feed(self, pipe, data):
+        final = not data
+        buffer = self._buffers[pipe] + self._decoders[pipe].decode(data, final=final)
+        lines = re.split(r'\r\n|\r|\n', buffer)
+        self._buffers[pipe] = lines.pop()
+        if final and self._buffers[pipe]:
+            lines.append(self._buffers[pipe])
+        callback = self._callbacks[pipe]
+        for line in lines:
+            if line:
+                callback(line)
+
+    def kill(self):
+        # Popen.kill() may reap the child, which loses its resource usage
+        with _running_lock:
+            if self.popen.returncode is None:
+                os.kill(self.popen.pid, signal.SIGKILL)
+
+    def wait(self):
+        # Use wait4() instead of Popen.wait() to get the child's resource
+        # usage. The child is reaped while holding `_running_lock` so kill()
+        # never signals a reused PID.
+        if self.popen.returncode is None:
+            os.waitid(os.P_PID, self.popen.pid, os.WEXITED | os.WNOWAIT)
+            with _running_lock:
+                _, status, self.rusage = os.wait4(self.popen.pid, 0)
+                if os.WIFSIGNALED(status):
+                    self.popen.returncode = -os.WTERMSIG(status)
+                else:
+                    self.popen.returncode = os.WEXITSTATUS(status)
+                _running.discard(self)
+        return self.popen.returncode
+
+def _start(*args, stdout_callback=None, stderr_callback=None, **kwargs):
+    return _Process(args, stdout_callback=stdout_callback,
+                    stderr_callback=stderr_callback, **kwargs)
+
+def _wait(*procs):
+    # Read from the pipes of all `procs` as data arrives and return when all of
+    # them have terminated. We sleep in select() in the meantime.
+    with selectors.DefaultSelector() as selector:
+        for proc in procs:
+            for pipe in proc.pipes:
+                selector.register(pipe, selectors.EVENT_READ, proc)
+        try:
+            while selector.get_map():
+                for key,_ in selector.select():
+                    data = os.read(key.fd, 65536)
+                    if not data:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                    key.data.feed(key.fileobj, data)
+        except BaseException:
+            for proc in procs:
+                proc.kill()
+            raise
+        finally:
+            for proc in procs:
+                proc.wait()
+    if _terminated.is_set():
+        raise KeyboardInterrupt()
+
+def _check(proc):
     if proc.returncode:
         utils.error(f'Command failed: {utils.cmd2str(proc.args)}')
-        for line in stderr:
+        for line in proc.stderr:
             utils.error(f'{proc.args[0]}: {line}')
         utils.croak()
-    else:
-        return proc
+
+def _run(*args, stdout_callback=None, stderr_callback=None, **kwargs):
+    proc = _start(*args, stdout_callback=stdout_callback,
+                  stderr_callback=stderr_callback, **kwargs)
+    _wait(proc)
+    _check(proc)
+    return proc
 
 def _as_json(string):
     try:
@@ -66,70 +190,712 @@ def _get_source(path):
     return path
 
 def _get_video_info(filepath):
+    # Probing can take seconds (e.g. BluRay directories), so the result is
+    # cached until the file changes
+    key = cache.file_key(filepath)
+    if key is not None:
+        info = cache.get('probe', key)
+        if info is not None:
+            return info
     proc = _run(FFPROBE, '-hide_banner',
                 '-show_format', '-show_streams',
                 '-of', 'json', _get_source(filepath))
-    return _as_json(proc.stdout.read())
+    info = _as_json(proc.stdout)
+    if key is not None:
+        cache.put('probe', key, info, max_size=PROBE_CACHE_SIZE)
+    return info
 
 def duration(filepath):
     info = _get_video_info(filepath)
     return float(info['format']['duration'])
 
-def encode(source, dest, settings=None, vf=None, start=None, stop=None, topic=None, create_logfile=True):
+def video_codec(filepath):
+    info = _get_video_info(filepath)
+    for stream in info.get('streams', ()):
+        if stream.get('codec_type') == 'video':
+            return stream.get('codec_name')
+
+def resolution(filepath):
+    info = _get_video_info(filepath)
+    for stream in info.get('streams', ()):
+        if stream.get('codec_type') == 'video':
+            return stream.get('width'), stream.get('height')
+
+# Lossless, intra-only codec for excerpts that are quick to decode and can be
+# cut at any frame
+LOSSLESS_CODEC = 'ffv1'
+
+def is_lossless(filepath):
+    return video_codec(filepath) == LOSSLESS_CODEC
+
+def _report_env(dest):
+    # Tell ffmpeg to write a log file next to `dest`
     env = os.environ.copy()
-    cmd = [FFMPEG, '-hide_banner', '-nostdin', '-sn', '-y']
+    env['FFREPORT'] = 'file=%s:level=40' % (utils.logfile(dest).replace(':', '\\:'),)
+    return env
+
+def _x264_args(settings, threads=None):
+    if threads is not None and 'threads' not in settings:
+        # Don't add "threads" to the caller's settings because it shouldn't
+        # end up in file names or the estimates file.
+        settings = utils.combine_dicts(settings, {'threads': str(threads)})
+    return ('-c:v', 'libx264',
+            '-x264opts', utils.settings2str(settings, escape=True))
+
+# Outputs are written to a temporary file that is renamed when ffmpeg is done,
+# so a process that is killed or crashes can't leave a truncated file with the
+# final name behind
+def _partial(dest):
+    return dest + '.part'
+
+def _output_args(dest):
+    # The format can't be guessed from the temporary file name
+    return ('-f', 'matroska', f'file:{_partial(dest)}')
+
+@contextlib.contextmanager
+def _atomic(*dests):
+    try:
+        yield
+    except BaseException:
+        for dest in dests:
+            try:
+                os.remove(_partial(dest))
+            except FileNotFoundError:
+                pass
+        raise
+    for dest in dests:
+        os.replace(_partial(dest), dest)
+
+# Encoding excerpts often results in "Too many packets buffered for output
+# stream" errors and increasing the muxing queue prevents them.
+_MUXING_ARGS = ('-max_muxing_queue_size', '1024')
+
+# Report progress as "key=value" lines on stdout instead of a status line on
+# stderr, which then only contains log messages
+_PROGRESS_ARGS = ('-nostats', '-progress', 'pipe:1')
+
+def _float(string):
+    try:
+        return float(string)
+    except (TypeError, ValueError):
+        return None
+
+def _running_cpu_time(pid):
+    # CPU time of a running process so far or None if it's unknown; only Linux
+    # has /proc/<pid>/stat, where utime and stime are the 14th and 15th field
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return None
+
+def _progress_handler(result, callback):
+    # Return stdout callback that parses ffmpeg's progress reports, stores the
+    # duration and number of frames of the output in `result` and passes a
+    # status string to `callback`. Every report is also appended to
+    # result['progress'] as [seconds since start, frame, fps, speed] and the
+    # size of the output so far is stored in result['size']. If result['pid']
+    # is the process's ID, its CPU time so far is stored in result['cpu_time'],
+    # and the CPU time of result['decoder_pid'] (see encode_many()) in
+    # result['decoder_cpu_time'].
+    #
+    # Example report (the last line ends each report):
+    # frame=49
+    # fps=12.00
+    # total_size=102400
+    # out_time=00:00:02.080000
+    # speed=0.527x
+    # progress=continue
+    report = {}
+    start_time = time.monotonic()
+    result.setdefault('progress', [])
+    def handle_stdout(line):
+        key, _, value = line.partition('=')
+        report[key.strip()] = value.strip()
+        if key.strip() != 'progress':
+            return
+        frame, fps, speed = (_float(report.get('frame')), _float(report.get('fps')),
+                             _float(report.get('speed', '').rstrip('x')))
+        if frame is not None:
+            frame = result['frames'] = int(frame)
+        size = _float(report.get('total_size'))
+        if size is not None:
+            result['size'] = int(size)
+        if 'pid' in result:
+            cpu_time = _running_cpu_time(result['pid'])
+            if cpu_time is not None:
+                result['cpu_time'] = cpu_time
+        if 'decoder_pid' in result:
+            cpu_time = _running_cpu_time(result['decoder_pid'])
+            if cpu_time is not None:
+                result['decoder_cpu_time'] = cpu_time
+        out_time = report.get('out_time', '')
+        report.clear()
+        result['progress'].append([round(time.monotonic() - start_time, 3), frame, fps, speed])
+        try:
+            # The last reported time is the duration of the output
+            result['duration'] = _timestamp2secs(out_time)
+        except ValueError:
+            return
+        parts = (f'fps={fps or 0:.1f}'.ljust(10),
+                 f'time={out_time[:-4]}'.ljust(16),
+                 f'speed={speed or 0:.3f}x'.ljust(13))
+        callback(' '.join(parts))
+    return handle_stdout
+
+class OverBudget(Exception):
+    # Raised when an encode is killed because its `budget` callback rejected
+    # it; `results` contains what was reported for each output until then
+    def __init__(self, reason, results):
+        super().__init__(reason)
+        self.reason = reason
+        self.results = results
+
+def _budget_callback(results, budget, callback):
+    # Return progress callback that passes the status on to `callback` and
+    # raises OverBudget if budget(results) returns a reason. The exception
+    # kills all processes of the encode in _wait().
+    if budget is None:
+        return callback
+    def check(status):
+        if callback is not None:
+            callback(status)
+        reason = budget(results)
+        if reason is not None:
+            raise OverBudget(reason, results)
+    return check
+
+def _cpu_time(proc):
+    return proc.rusage.ru_utime + proc.rusage.ru_stime
+
+def _resources(proc):
+    # CPU time in seconds and peak memory use in bytes of a terminated process
+    maxrss = proc.rusage.ru_maxrss
+    if sys.platform != 'darwin':
+        # Linux and BSDs report kilobytes
+        maxrss *= 1024
+    return {'cpu_time': _cpu_time(proc),
+            'user_time': proc.rusage.ru_utime,
+            'system_time': proc.rusage.ru_stime,
+            'maxrss': maxrss}
+
+def _encode_cmd(source, dest, settings=None, vf=None, start=None, stop=None, create_logfile=True,
+                threads=None, lossless=False):
+    env = os.environ.copy()
+    cmd = [FFMPEG, '-hide_banner', '-nostdin', '-sn', '-y', *_PROGRESS_ARGS]
     if create_logfile:
         cmd.extend(('-report',))
-        env['FFREPORT'] = 'file=%s:level=40' % (utils.logfile(dest).replace(':', '\\:'),)
+        env = _report_env(dest)
     if start is not None:
         cmd.extend(('-ss', start))
     cmd.extend(('-i', _get_source(source)))
     if stop is not None:
         cmd.extend(('-t', stop))
     if settings is not None:
-        cmd.extend(('-c:v', 'libx264',
-                    '-x264opts', utils.settings2str(settings, escape=True)))
+        cmd.extend(_x264_args(settings, threads))
+        if vf:
+            cmd.extend(('-filter:v', vf))
+    elif lossless:
+        cmd.extend(('-c:v', LOSSLESS_CODEC, '-level', '3', '-g', '1'))
         if vf:
             cmd.extend(('-filter:v', vf))
     else:
         cmd.extend(('-c:v', 'copy'))
     cmd.extend(('-c:a', 'copy'))
-    cmd.extend((
-        # Encoding excerpts often results in "Too many packets buffered for
-        # output stream" errors and increasing the muxing queue prevents
-        # them.
-        '-max_muxing_queue_size', '1024',
-        f'file:{dest}'))
-
-    # Example ffmpeg output:
-    # frame=   49 fps= 12 q=24.0 size=     482kB time=00:00:02.08 bitrate=1895.5kbits/s speed=0.527x
-    regex = re.compile(r'fps\s*=\s*([\d.]+).*?time\s*=\s*([\d:\.]+).*?speed=([\d\.]+)')
+    cmd.extend(_MUXING_ARGS)
+    cmd.extend(_output_args(dest))
+    return cmd, env
+
+def encode(source, dest, settings=None, vf=None, start=None, stop=None, topic=None, create_logfile=True,
+           threads=None, progress=None, lossless=False, budget=None):
+    # Without `settings`, the video stream is copied or, if `lossless` is
+    # true, encoded losslessly with `vf` applied. Seeking is frame-accurate
+    # unless the video stream is copied.
+    #
+    # `budget` is called with a list of the result (see _progress_handler())
+    # after every progress report and may abort the encode by returning a
+    # reason, which raises OverBudget.
+    cmd, env = _encode_cmd(source, dest, settings, vf=vf, start=start, stop=stop,
+                           create_logfile=create_logfile, threads=threads, lossless=lossless)
+
+    def print_status(status):
+        print(status, end='', flush=True)
+        print('\b'*len(status), end='')
+
+    result = {'duration': None}
+    if progress is None and topic is not None:
+        print(f'{topic}: ', end='')
+    start_time = time.monotonic()
+    with _atomic(dest):
+        callback = _budget_callback([result], budget, progress or print_status)
+        proc = _start(*cmd, env=env, stdout_callback=_progress_handler(result, callback))
+        result['pid'] = proc.popen.pid
+        _wait(proc)
+        _check(proc)
+    result['time'] = time.monotonic() - start_time
+    result.update(_resources(proc))
+    if progress is None:
+        print()
+    return result
+
+def proxy(source, dest):
+    # Encode `source` losslessly with only keyframes, so a player can show any
+    # frame without decoding the frames before it
+    cmd, env = _encode_cmd(source, dest, create_logfile=False, lossless=True)
+    with _atomic(dest):
+        _run(*cmd, env=env)
+
+def _slowest_status(results, progress):
+    # Return one stderr callback for each result that passes the status of the
+    # process that is furthest behind to `progress`
+    statuses = [''] * len(results)
+    def status_callback(i):
+        def callback(status):
+            statuses[i] = status
+            if progress is not None:
+                reported = [i for i in range(len(results)) if statuses[i]]
+                slowest = min(reported, key=lambda i: results[i]['duration'])
+                progress(statuses[slowest])
+        return callback
+    return [_progress_handler(result, status_callback(i)) for i,result in enumerate(results)]
+
+def _start_all(cmds):
+    # Start (cmd, kwargs) tuples; if any of them can't be started, kill the
+    # others because they might wait forever for the missing ones
+    procs = []
+    try:
+        for cmd,kwargs in cmds:
+            procs.append(_start(*cmd, **kwargs))
+    except BaseException:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+        raise
+    return procs
+
+def _attribute_time(results, wall_time, procs, shared_cpu_time=0):
+    # Processes that ran concurrently can't be timed individually. Split their
+    # `wall_time` between them in proportion to the CPU time each of them
+    # used. `shared_cpu_time` is added to each process:
+    #
+    #   time[i] = wall_time * (cpu[i] + shared_cpu) / (sum(cpu) + shared_cpu)
+    #
+    # With a single process this is simply the wall clock time. This assumes
+    # that the processes keep all CPU cores busy, which is the case with x264's
+    # default number of threads.
+    #
+    # All other resources are the process's own.
+    cpu_times = [_cpu_time(proc) for proc in procs]
+    shares = time_shares(cpu_times, shared_cpu_time)
+    for result,proc,cpu_time,share in zip(results, procs, cpu_times, shares):
+        result.update(_resources(proc))
+        result['cpu_time'] = cpu_time + shared_cpu_time
+        result['time'] = wall_time * share
+
+def time_shares(cpu_times, shared_cpu_time=0):
+    # Part of the wall clock time of concurrent processes that is attributed to
+    # each of them (see _attribute_time())
+    total_cpu_time = sum(cpu_times) + shared_cpu_time
+    if total_cpu_time > 0:
+        return [(cpu_time + shared_cpu_time) / total_cpu_time for cpu_time in cpu_times]
+    return [1 / len(cpu_times)] * len(cpu_times)
+
+def encode_many(source, dests, settings_list, vf=None, start=None, stop=None, threads=None,
+                progress=None, budget=None):
+    # Decode and filter `source` once and encode the frames with each settings
+    # in `settings_list`. One ffmpeg process decodes, applies `vf` and splits
+    # the frames into one FIFO per encoder. Each encoder is a separate ffmpeg
+    # process that reads raw frames from its FIFO and copies audio from
+    # `source`.
+    #
+    # All encoders run at the pace of the slowest one, so the wall clock time
+    # can't be measured for each sample. It is attributed with
+    # _attribute_time(), and the decoder's CPU time is added to each encoder
+    # because every sample would need its own decoder in a normal encode.
+    #
+    # Encoders can't be killed individually because the decoder would fail to
+    # write to their FIFOs, so `budget` (see encode()) gets the results of all
+    # of them and can only abort all of them.
+    tmpdir = tempfile.mkdtemp(prefix=f'{__name__}.')
+    try:
+        fifos = [os.path.join(tmpdir, f'{i}.nut') for i in range(len(dests))]
+        for fifo in fifos:
+            os.mkfifo(fifo)
+        labels = ''.join(f'[v{i}]' for i in range(len(dests)))
+        graph = f'[0:v]{vf + "," if vf else ""}split={len(dests)}{labels}'
+        # Seeking isn't frame-accurate with copied audio, so audio and video
+        # may start at slightly different times
+        seek_args = ('-ss', start) if start is not None else ()
+        duration_args = ('-t', stop) if stop is not None else ()
+        decoder_cmd = [FFMPEG, '-hide_banner', '-nostdin', '-y',
+                       *seek_args, '-i', _get_source(source), *duration_args,
+                       '-filter_complex', graph]
+        for i,fifo in enumerate(fifos):
+            decoder_cmd.extend(('-map', f'[v{i}]', '-c:v', 'rawvideo', '-f', 'nut', f'file:{fifo}'))
+
+        results = [{'duration': None} for _ in dests]
+        callbacks = _slowest_status(results, _budget_callback(results, budget, progress))
+        cmds = [(decoder_cmd, {})]
+        for i,(dest,settings,callback) in enumerate(zip(dests, settings_list, callbacks)):
+            cmd = [FFMPEG, '-hide_banner', '-nostdin', '-sn', '-y', '-report', *_PROGRESS_ARGS,
+                   '-f', 'nut', '-i', f'file:{fifos[i]}',
+                   *seek_args, '-i', _get_source(source), *duration_args,
+                   '-map', '0:v', '-map', '1:a?']
+            cmd.extend(_x264_args(settings, threads))
+            cmd.extend(('-c:a', 'copy'))
+            cmd.extend(_MUXING_ARGS)
+            cmd.extend(_output_args(dest))
+            cmds.append((cmd, {'env': _report_env(dest), 'stdout_callback': callback}))
+
+        with _atomic(*dests):
+            start_time = time.monotonic()
+            procs = _start_all(cmds)
+            for result,proc in zip(results, procs[1:]):
+                result['pid'] = proc.popen.pid
+                result['decoder_pid'] = procs[0].popen.pid
+            _wait(*procs)
+            wall_time = time.monotonic() - start_time
+            for proc in procs:
+                _check(proc)
+    finally:
+        shutil.rmtree(tmpdir)
+    _attribute_time(results, wall_time, procs[1:], shared_cpu_time=_cpu_time(procs[0]))
+    return results
+
+def encode_ranges(sources, dests, settings, vf=None, threads=None, progress=None, budget=None):
+    # Encode each file in `sources` to the corresponding file in `dests` with
+    # the same settings in parallel; see _attribute_time() for how their
+    # encoding time is measured and encode() for `budget`, which gets the
+    # results of all ranges
+    results = [{'duration': None} for _ in dests]
+    callbacks = _slowest_status(results, _budget_callback(results, budget, progress))
+    cmds = []
+    for source,dest,callback in zip(sources, dests, callbacks):
+        cmd, env = _encode_cmd(source, dest, settings, vf=vf, threads=threads)
+        cmds.append((cmd, {'env': env, 'stdout_callback': callback}))
+    with _atomic(*dests):
+        start_time = time.monotonic()
+        procs = _start_all(cmds)
+        for result,proc in zip(results, procs):
+            result['pid'] = proc.popen.pid
+        _wait(*procs)
+        wall_time = time.monotonic() - start_time
+        for proc in procs:
+            _check(proc)
+    _attribute_time(results, wall_time, procs)
+    return results
+
+def concat(sources, dest):
+    # Join files with identical streams without re-encoding them
+    fd, list_file = tempfile.mkstemp(prefix=f'{__name__}.', suffix='.txt')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for source in sources:
+                escaped = os.path.abspath(source).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        with _atomic(dest):
+            _run(FFMPEG, '-hide_banner', '-nostdin', '-y',
+                 '-f', 'concat', '-safe', '0', '-i', f'file:{list_file}',
+                 '-map', '0', '-c', 'copy', *_MUXING_ARGS, *_output_args(dest))
+    finally:
+        os.remove(list_file)
+
+def split(source, dest_dir, parts):
+    # Cut `source` into up to `parts` files of similar duration in `dest_dir`
+    # without re-encoding it and return their paths in order. Each file starts
+    # with a keyframe, so there are fewer files if `source` has fewer
+    # keyframes (a lossless excerpt can be cut at any frame).
+    secs = duration(source)
+    times = ','.join(f'{secs * i / parts:.3f}' for i in range(1, parts))
+    tmp_dir = _partial(dest_dir)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.mkdir(tmp_dir)
+    try:
+        _run(FFMPEG, '-hide_banner', '-nostdin', '-y', '-i', _get_source(source),
+             '-map', '0', '-c', 'copy', *_MUXING_ARGS,
+             '-f', 'segment', '-segment_times', times, '-segment_format', 'matroska',
+             '-reset_timestamps', '1', os.path.join(tmp_dir, '%d.mkv'))
+        os.rename(tmp_dir, dest_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return split_parts(dest_dir)
+
+def split_parts(dest_dir):
+    # Paths of the files that split() created in `dest_dir`
+    names = [name for name in os.listdir(dest_dir) if re.search(r'^\d+\.mkv$', name)]
+    return [os.path.join(dest_dir, name) for name in sorted(names, key=lambda name: int(name[:-4]))]
+
+@functools.lru_cache()
+def has_filter(name):
+    proc = _run(FFMPEG, '-hide_banner', '-filters')
+    # Example line: " ... ssim              VV->V      Calculate the SSIM between two video streams."
+    return any(line.split()[1:2] == [name] for line in proc.stdout.splitlines())
+
+METRICS = ('ssim', 'psnr', 'vmaf')
+
+# Example ffmpeg output:
+# [Parsed_ssim_4 @ 0x55d0] SSIM Y:0.986470 (18.687049) U:0.990947 (20.431127) V:0.990303 (20.134047) All:0.987895 (19.170862)
+# [Parsed_psnr_5 @ 0x55d0] PSNR y:42.013711 u:45.631101 v:45.377546 average:42.944167 min:39.872520 max:46.982611
+# [Parsed_libvmaf_6 @ 0x55d0] VMAF score: 95.438021
+_METRIC_REGEXES = {'ssim': re.compile(r'\bSSIM\b.*\bAll:\s*([\d.]+)'),
+                   'psnr': re.compile(r'\bPSNR\b.*\baverage:\s*([\d.]+)'),
+                   'vmaf': re.compile(r'\bVMAF score:\s*([\d.]+)')}
+
+def metrics(sample, reference, vf=None, vmaf=None, progress=None):
+    # Compare `sample` to `reference` with `vf` applied and return a dictionary
+    # with SSIM, PSNR and, if `vmaf` is true or if `vmaf` is None and ffmpeg
+    # supports it, VMAF
+    names = ['ssim', 'psnr']
+    if vmaf or (vmaf is None and has_filter('libvmaf')):
+        names.append('vmaf')
+    n = len(names)
+    graph = [f'[0:v]setpts=PTS-STARTPTS,split={n}' + ''.join(f'[d{i}]' for i in range(n)),
+             (f'[1:v]{vf + "," if vf else ""}setpts=PTS-STARTPTS,split={n}' +
+              ''.join(f'[r{i}]' for i in range(n)))]
+    for i,name in enumerate(names):
+        # The distorted video must be the first input for libvmaf
+        graph.append(f'[d{i}][r{i}]{"libvmaf" if name == "vmaf" else name}')
+    cmd = (FFMPEG, '-hide_banner', '-nostdin', *_PROGRESS_ARGS,
+           '-i', _get_source(sample), '-i', _get_source(reference),
+           '-filter_complex', ';'.join(graph), '-f', 'null', '-')
+
+    result = {}
+    status = {}
     def handle_stderr(line):
-        match = regex.search(line)
-        if match:
-            fps, time, speed = match.group(1, 2, 3)
-            parts = (f'fps={float(fps):.1f}'.ljust(10),
-                     f'time={time}'.ljust(16),
-                     f'speed={float(speed):.3f}x'.ljust(13))
-            status = ' '.join(parts)
-            print(' '.join(parts), end='', flush=True)
-            print('\b'*len(status), end='')
+        for name,regex in _METRIC_REGEXES.items():
+            match = regex.search(line)
+            if match:
+                result[name] = float(match.group(1))
+    _run(*cmd, stdout_callback=_progress_handler(status, progress or (lambda status: None)),
+         stderr_callback=handle_stderr)
+    for name in names:
+        if name not in result:
+            utils.croak(f'Unable to find {name.upper()} score for {sample}')
+    return result
+
+@functools.lru_cache()
+def version():
+    proc = _run(FFMPEG, '-hide_banner', '-version')
+    return proc.stdout.split('\n', 1)[0]
+
+# Synthetic video for calibration encodes
+CALIBRATION_SOURCE = 'testsrc2=size=1280x720:rate=24:duration=4'
+CALIBRATION_RUNS = 3
 
+def _calibration_encode(threads):
+    cmd = [FFMPEG, '-hide_banner', '-nostdin', *_PROGRESS_ARGS,
+           '-f', 'lavfi', '-i', CALIBRATION_SOURCE, '-c:v', 'libx264']
+    if threads is not None:
+        cmd.extend(('-x264opts', f'threads={threads}'))
+    cmd.extend(('-f', 'null', '-'))
+    start_time = time.monotonic()
+    proc = _run(*cmd)
+    return {'time': time.monotonic() - start_time, **_resources(proc)}
+
+def calibration(threads=None, topic=None):
+    # Measure how many CPU seconds x264 turns into one second of wall clock
+    # time with `threads` threads on this host if nothing else is running. The
+    # best of CALIBRATION_RUNS encodes is used because other processes can
+    # only make it worse. The result is cached for each host, number of cores
+    # and ffmpeg version.
+    cores = utils.cpu_count()
+    key = ['calibration', platform.node(), cores, version(), CALIBRATION_SOURCE, threads]
+    result = cache.get('calibration', key)
+    if result is not None:
+        return result
     if topic is not None:
-        print(f'{topic}: ', end='')
-    _run(*cmd, env=env, stderr_callback=handle_stderr)
-    print()
+        print(f'{topic} ...')
+    runs = [_calibration_encode(threads) for _ in range(CALIBRATION_RUNS)]
+    best = max(runs, key=lambda run: run['cpu_time'] / run['time'])
+    result = {'cores': cores,
+              'parallelism': best['cpu_time'] / best['time'],
+              'load': os.getloadavg()[0]}
+    cache.put('calibration', key, result, max_size=CALIBRATION_CACHE_SIZE)
+    return result
+
+# Seconds that throughput() encodes with each number of processes
+THROUGHPUT_TIME = 10
+
+class _Measured(Exception):
+    pass
+
+def throughput(source, settings, processes, threads=None, vf=None, topic=None):
+    # Measure how many frames per second `processes` encodes of `source` with
+    # `threads` threads each produce together. The encodes are killed after
+    # THROUGHPUT_TIME seconds and frames before the first progress report
+    # don't count, so x264's startup (e.g. filling the lookahead) doesn't
+    # favor fewer processes. The result is cached for each host, number of
+    # cores, ffmpeg version, resolution and codec of `source`, `vf` and
+    # `settings`.
+    cores = utils.cpu_count()
+    key = ['throughput', platform.node(), cores, version(), resolution(source),
+           video_codec(source), vf, utils.settings2str(settings), processes, threads]
+    result = cache.get('throughput', key)
+    if result is not None:
+        return result
+    if topic is not None:
+        print(f'{topic} ...')
+    cmd = [FFMPEG, '-hide_banner', '-nostdin', '-sn', *_PROGRESS_ARGS,
+           '-i', _get_source(source), *_x264_args(settings, threads)]
+    if vf:
+        cmd.extend(('-filter:v', vf))
+    cmd.extend(('-an', '-f', 'null', '-'))
+
+    start_time = time.monotonic()
+    def check_time(status):
+        if time.monotonic() - start_time > THROUGHPUT_TIME:
+            raise _Measured()
+    results = [{} for _ in range(processes)]
+    procs = _start_all((cmd, {'stdout_callback': _progress_handler(result, check_time)})
+                       for result in results)
+    try:
+        _wait(*procs)
+    except _Measured:
+        pass
+    else:
+        for proc in procs:
+            _check(proc)
+    wall_time = time.monotonic() - start_time
+
+    fps = 0
+    for result in results:
+        reports = [report for report in result['progress'] if report[1] is not None]
+        if len(reports) > 1 and reports[-1][0] > reports[0][0]:
+            fps += (reports[-1][1] - reports[0][1]) / (reports[-1][0] - reports[0][0])
+        else:
+            fps += result.get('frames', 0) / wall_time
+    result = {'fps': fps, 'load': os.getloadavg()[0]}
+    cache.put('throughput', key, result, max_size=THROUGHPUT_CACHE_SIZE)
+    return result
+
+def _timestamp2secs(timestamp):
+    secs = 0
+    for part in timestamp.split(':'):
+        secs = secs * 60 + float(part)
+    return secs
+
+# Example x264 log lines:
+# [libx264 @ 0x55d0] frame I:2     Avg QP:18.00  size: 50000
+# [libx264 @ 0x55d0] consecutive B-frames:  1.2%  2.5%  6.0% 90.3%
+_FRAME_TYPE_REGEX = re.compile(r'\bframe [IPB]:\s*(\d+)')
+_BFRAMES_REGEX = re.compile(r'consecutive B-frames:\s*((?:\d+\.\d+\s*%\s*)+)')
 
 def bframes(logfile):
+    # Return consecutive B-frames percentages and the number of frames from
+    # x264 log
     values = []
-    regex = re.compile(r'consecutive B-frames:\s*((?:\d+\.\d+\s*%\s*)+)')
-    with open(logfile, 'r') as f:
-        for line in f.readlines():
-            match = regex.search(line)
+    frames = 0
+    with open(logfile, 'r', errors='replace') as f:
+        for line in f:
+            match = _FRAME_TYPE_REGEX.search(line)
+            if match:
+                frames += int(match.group(1))
+                continue
+            match = _BFRAMES_REGEX.search(line)
             if match:
                 for perc in re.split(r'\s+', match.group(1)):
                     if perc:
                         values.append(float(perc[:-1]))
     if not values:
         utils.croak(f'Unable to find consecutive B-frames in {logfile}')
-    return values
+    return values, frames
+
+# x264 prints a summary at the end of each encode. Example log lines:
+# [libx264 @ 0x55d0] frame I:2     Avg QP:18.00  size: 50000
+# [libx264 @ 0x55d0] frame P:60    Avg QP:21.00  size: 10000
+# [libx264 @ 0x55d0] mb P  I16..4:  1.2%  3.4%  0.5%  P16..4: 40.1% 10.2%  5.3%  0.0%  0.0%    skip:39.3%
+# [libx264 @ 0x55d0] ref P L0: 60.1% 20.2% 19.7%
+# [libx264 @ 0x55d0] SSIM Mean Y:0.9876543 (19.087db)
+# [libx264 @ 0x55d0] kb/s:1234.56
+_X264_LINE_REGEX = re.compile(r'^\[libx264 @ [^\]]*\]\s*(.*?)\s*$')
+_X264_FRAME_REGEX = re.compile(r'^frame ([IPB]):\s*(\d+)\s+Avg QP:\s*([\d.]+)\s+size:\s*([\d.]+)')
+_X264_PAIR_REGEX = re.compile(r'([\w./-]+):\s*((?:[\d.]+%?\s+)*[\d.]+%?)')
+
+def _x264_pairs(string):
+    # "intra:45.2% inter:60.1%" -> {'intra': [45.2], 'inter': [60.1]}
+    return {name.lower().replace('..', '_'): [float(v) for v in re.findall(r'[\d.]+', values)]
+            for name,values in _X264_PAIR_REGEX.findall(string)}
+
+def x264_stats(logfile):
+    # Return x264's summary from ffmpeg log as a flat dictionary. Logs can
+    # contain multiple summaries (e.g. samples from multiple ranges). Frame
+    # counts are added and everything else is averaged, weighted by the number
+    # of frames it refers to. Percentages that come in groups (e.g. reference
+    # frames) are lists.
+    sums = {}
+    weights = collections.defaultdict(float)
+    counts = {}
+    def add(field, values, frame_type=None):
+        weight = counts.get(frame_type, 0) if frame_type else sum(counts.values())
+        if not weight:
+            return
+        if len(values) == 1:
+            sums[field] = sums.get(field, 0) + values[0] * weight
+        else:
+            field_sums = sums.setdefault(field, [])
+            field_sums.extend([0] * (len(values) - len(field_sums)))
+            for i,value in enumerate(values):
+                field_sums[i] += value * weight
+        weights[field] += weight
+
+    frames = collections.Counter()
+    with open(logfile, 'r', errors='replace') as f:
+        for line in f:
+            match = _X264_LINE_REGEX.match(line)
+            if not match:
+                continue
+            text = match.group(1)
+            match = _X264_FRAME_REGEX.match(text)
+            if match:
+                frame_type, count = match.group(1), int(match.group(2))
+                if frame_type == 'I':
+                    # Every summary starts with I-frames
+                    counts.clear()
+                counts[frame_type] = count
+                frames[frame_type] += count
+                add(f'qp_{frame_type}', [float(match.group(3))], frame_type)
+                add(f'size_{frame_type}', [float(match.group(4))], frame_type)
+                add('qp', [float(match.group(3))], frame_type)
+            elif text.startswith('consecutive B-frames:'):
+                add('bframes', [float(v) for v in re.findall(r'([\d.]+)%', text)])
+            elif re.match(r'mb [IPB]\b', text):
+                frame_type = text[3]
+                for name,values in _x264_pairs(text[4:]).items():
+                    add(f'mb_{frame_type}_{name}', values, frame_type)
+            elif re.match(r'ref [PB] L[01]:', text):
+                add(f'ref_{text[4]}_{text[6:8].lower()}', [float(v) for v in re.findall(r'([\d.]+)%', text)],
+                    text[4])
+            elif text.startswith('8x8 transform'):
+                for name,values in _x264_pairs(text).items():
+                    add(f'transform_8x8_{name}', values)
+            elif text.startswith('coded y,uvDC,uvAC'):
+                for name,values in _x264_pairs(text).items():
+                    add(f'coded_{name}', values)
+            elif text.startswith('direct mvs'):
+                for name,values in _x264_pairs(text).items():
+                    add(f'direct_{name}', values, 'B')
+            elif text.startswith('Weighted P-Frames:'):
+                for name,values in _x264_pairs(text).items():
+                    add(f'weightp_{name}', values, 'P')
+            elif text.startswith('SSIM Mean'):
+                match = re.search(r'Y:([\d.]+)\s*\(\s*([\d.]+)db\)', text)
+                if match:
+                    add('ssim', [float(match.group(1))])
+                    add('ssim_db', [float(match.group(2))])
+            elif text.startswith('PSNR Mean'):
+                for name,values in _x264_pairs(text).items():
+                    add('kbps' if name == 'kb/s' else f'psnr_{name}', values)
+            elif text.startswith('kb/s:'):
+                add('kbps', [float(text[5:])])
+
+    stats = {f'frames_{frame_type}': count for frame_type,count in sorted(frames.items())}
+    if frames:
+        stats['frames'] = sum(frames.values())
+    for field,value in sums.items():
+        if isinstance(value, list):
+            stats[field] = [round(v / weights[field], 6) for v in value]
+        else:
+            stats[field] = round(value / weights[field], 6)
+    return stats
@@ -1,10 +1,21 @@
 import os
-import time
+import re
 import argparse
 import sys
+import concurrent.futures
+import random
+import statistics
+import math
+import shutil
+import threading
 from collections import abc
 from . import utils
 from . import ffmpeg
+from . import search
+from . import cache
+from . import x264
+from . import server
+from . import spool
 from . import __name__, __version__
 
 class MyHelpFormatter(argparse.HelpFormatter):
@@ -12,7 +23,7 @@ class MyHelpFormatter(argparse.HelpFormatter):
         def as_str(thing):
             if isinstance(thing, abc.Iterable) and not isinstance(thing, str):
                 string = ' '.join(as_str(x) for x in thing)
-            elif not isinstance(thing, bool):
+            elif thing is not None and not isinstance(thing, bool):
                 string = str(thing)
             else:
                 string = None
@@ -104,19 +115,68 @@ Some final notes you might find useful:
   time, but there is a small delay when mpv seeks.
 
 - You can seek forward and backward by single frames with "." and ",".
+
+- x264 doesn't use many cores efficiently at sample resolutions. Use "-j" to
+  encode several samples in parallel and "--fan-out" to decode and filter the
+  excerpt only once for multiple samples. Long ranges can be cut into parts at
+  keyframes that are encoded in parallel with "--split N".
+
+- "{__name__} compare" picks up new samples while "samples" is still running, so
+  you can start comparing right away. "--order spread" encodes the most
+  different settings first. "compare --proxies" switches between samples at the
+  exact frame without delay by playing lossless, intra-only copies of them.
+
+- Comparing dozens of samples by eye takes a long time. Run
+  "{__name__} metrics SAMPLES" (or pass "-m" to "samples") to score all samples
+  with SSIM, PSNR and VMAF and "--prune" to delete every sample that is worse,
+  bigger and slower than another one.
+
+- Large grids quickly need thousands of encodes. "--search N" tries one setting
+  at a time and stops after N samples, keeping the values with the best
+  "--objective" (e.g. SSIM per byte) within "--max-size" and "--max-time".
+  These budgets also kill encodes that are clearly going to exceed them, which
+  saves a lot of time on hopeless combinations.
+
+- A single range is rarely representative of the whole video. Pass "-r"
+  multiple times or use "--chunks K" to spread K ranges over the video. Each
+  range is encoded in parallel and the estimates show their standard error
+  (e.g. "01:02 ±00:04:05" is 1 hour 2 minutes ±4 minutes 5 seconds).
+
+- Several runs on the same machine fight over its cores. Start "{__name__} serve"
+  once and queue "samples", "metrics" and "bframes" runs with "{__name__} submit";
+  they share one budget of cores and memory. "{__name__} status" lists them.
+
+- One machine is slow for a large grid. "--spool DIR" puts the samples into a
+  directory on a shared file system (e.g. NFS) instead of encoding them and
+  "{__name__} worker DIR" encodes them on any number of machines.
+
+- The fastest number of parallel jobs depends on the resolution, "-vf" and
+  settings like "me=tesa". "-j auto" measures a few of them on the excerpt
+  for a few seconds and uses the one with the most frames per second.
 '''.strip()
 
 
-def run():
+# Maximum size of all cached encodes in bytes; samples and cached encodes are
+# hard links of the same file if possible
+ENCODE_CACHE_SIZE = 20 * 2**30
+
+def _argparser():
     argparser = argparse.ArgumentParser(
         prog=__name__,
         formatter_class=MyHelpFormatter,
         description='Generate and compare x264 test encodings with different settings')
     argparser.add_argument('-s', '--source',
                            help='Path to original video')
-    argparser.add_argument('-r', '--range', nargs=2, default=['5:00', '10'], metavar=('START', 'DURATION'),
+    argparser.add_argument('-r', '--range', nargs=2, action='append', default=None, metavar=('START', 'DURATION'),
                            help=('Time range in original video; '
-                                 'e.g. "10:00 60" means "from 10 minutes to 11 minutes"'))
+                                 'e.g. "10:00 60" means "from 10 minutes to 11 minutes"; '
+                                 'may be given multiple times (Default: 5:00 10)'))
+    argparser.add_argument('--chunks', type=_positive_int, default=None, metavar='K',
+                           help=('Use K evenly spaced ranges of DURATION from the whole video '
+                                 'instead of START'))
+    argparser.add_argument('--stratify', action='store_true',
+                           help=('Pick a random range in each of the K sections of the video '
+                                 'instead of its center'))
     argparser.add_argument('-x', '--x264-settings', default='',
                            help=('Colon-separated x264 settings (colons in values must be escaped);'
                                  'subcommands may override these'))
@@ -145,8 +205,79 @@ def run():
         description='Generate samples with different settings')
     argparser_samples.add_argument('-xs', '--sample-settings', nargs='+', default=[], metavar='SETTINGS',
                                    help='x264 settings to test; values are separated with "/"')
+    argparser_samples.add_argument('-j', '--jobs', type=_jobs, default=1,
+                                   help=('Number of samples to encode in parallel or "auto" to measure '
+                                         'which number encodes the most frames per second; '
+                                         'available CPU cores are split evenly between jobs and, with more '
+                                         'than one job, encoding time is estimated from CPU time, '
+                                         'see --normalize-time'))
+    argparser_samples.add_argument('--fan-out', type=_positive_int, default=1, metavar='N',
+                                   help=('Decode and filter the excerpt once for every N samples '
+                                         'and encode them simultaneously'))
+    argparser_samples.add_argument('--split', type=_positive_int, default=1, metavar='N',
+                                   help=('Cut the excerpt into N parts at keyframes, encode them in parallel '
+                                         'and join them; encoding time is estimated from CPU time, '
+                                         'see --normalize-time'))
+    argparser_samples.add_argument('--lossless-excerpt', action='store_true',
+                                   help=('Extract the range as lossless, intra-only video with -vf applied '
+                                         'so samples start on the same frame and are quick to decode'))
+    argparser_samples.add_argument('-m', '--metrics', action='store_true',
+                                   help=('Compare each sample to the original with SSIM, PSNR and, '
+                                         'if available, VMAF after encoding it'))
+    argparser_samples.add_argument('--order', choices=search.ORDERS, default='grid',
+                                   help=('Encode samples in the order of the grid, most different settings '
+                                         'first (spread) or in random order; useful for comparing samples '
+                                         'while the rest is still encoding'))
+    argparser_samples.add_argument('--search', type=_positive_int, default=None, metavar='N',
+                                   help=('Instead of encoding all combinations, search for the best '
+                                         'settings by changing one setting at a time and stop after N samples'))
+    argparser_samples.add_argument('--objective', choices=search.OBJECTIVES, default='quality-per-byte',
+                                   help=('What --search optimizes: quality metric per byte, quality metric '
+                                         'or estimated final size'))
+    argparser_samples.add_argument('--metric', choices=ffmpeg.METRICS, default='ssim',
+                                   help='Quality metric for --objective')
+    argparser_samples.add_argument('--max-size', type=_size, default=None, metavar='SIZE',
+                                   help=('Reject samples with a larger estimated final size (e.g. "8GiB"); '
+                                         'encodes are aborted as soon as they are clearly too large'))
+    argparser_samples.add_argument('--max-time', type=_duration, default=None, metavar='DURATION',
+                                   help=('Reject samples with a longer estimated encoding time (e.g. "10:00:00"); '
+                                         'encodes are aborted as soon as they are clearly too slow'))
+    argparser_samples.add_argument('--normalize-time', action='store_true',
+                                   help=('Also estimate encoding time from CPU time as if all cores were '
+                                         'available, which isn\'t affected by other processes; '
+                                         'calibration for this host is cached'))
+    argparser_samples.add_argument('--cache-size', type=_size, default=ENCODE_CACHE_SIZE, metavar='SIZE',
+                                   help=('Maximum size of the cache that shares encodes between samples '
+                                         'directories; 0 disables it '
+                                         f'(Default: {utils.bytes2str(ENCODE_CACHE_SIZE).strip()})'))
+    argparser_samples.add_argument('--spool', default=None, metavar='DIR',
+                                   help=('Write a job for each sample to DIR instead of encoding it; '
+                                         f'"{__name__} worker DIR" encodes them on any machine that shares DIR '
+                                         'and the samples directory at the same path'))
     argparser_samples.set_defaults(func=_samples)
 
+    argparser_worker = subparsers.add_parser(
+        'worker',
+        formatter_class=MyHelpFormatter,
+        help='Encode samples from a spool directory',
+        description=('Encode samples that "samples --spool DIR" wrote to DIR\n\n'
+                     'Any number of workers on any number of machines can share DIR (e.g. on NFS).\n'
+                     'Each sample is encoded by one worker and its estimates are stored in the\n'
+                     'samples directory. Samples of workers that die are encoded again by other\n'
+                     'workers after the lease expires.'))
+    argparser_worker.add_argument('spool',
+                                  help='Spool directory')
+    argparser_worker.add_argument('-j', '--jobs', type=_positive_int, default=1,
+                                  help=('Number of samples to encode in parallel; '
+                                        'available CPU cores are split evenly between jobs and, with more '
+                                        'than one job, encoding time is estimated from CPU time'))
+    argparser_worker.add_argument('--lease', type=_positive_int, default=spool.LEASE, metavar='SECS',
+                                  help=('Seconds until a sample of a dead worker is encoded again; '
+                                        'must be the same for all workers'))
+    argparser_worker.add_argument('--wait', action='store_true',
+                                  help='Wait for more samples instead of exiting when all samples are done')
+    argparser_worker.set_defaults(func=_worker)
+
     argparser_compare = subparsers.add_parser(
         'compare',
         formatter_class=MyHelpFormatter,
@@ -165,6 +296,10 @@ def run():
                 '  o        Show/Hide original source\n'
                 '  `        Show/Hide current playlist\n'
                 '\n'
+                '  In tournaments (--scheduler), "b" means the current sample wins its\n'
+                '  match, "w" that it loses and "e" that it is a draw; shift+w also\n'
+                '  withdraws the sample from the tournament.\n'
+                '\n'
                 '  You can change them by putting these lines in ~/.config/mpv/input.conf:\n'
                 '    j       script-binding txs/playlist-next\n'
                 '    k       script-binding txs/playlist-prev\n'
@@ -185,6 +320,16 @@ def run():
                 '     border_size=1.0\n'
                 '     border_color=101010\n'
                 '     estimates_file=./estimates\n'
+                '     rescan_interval=2\n'
+                '     scheduler=default\n'
+                '     seed_by=size\n'
+                '     swiss_rounds=0\n'
+                '     proxies=no\n'
+                '\n'
+                '  New samples and estimates are picked up every rescan_interval seconds\n'
+                '  (0 disables this), so samples can be compared while they are encoded.\n'
+                '  With proxies=yes (--proxies), samples are played from the intra-only\n'
+                '  copies in .proxies as soon as they are built.\n'
         ))
 
     argparser_compare.add_argument('samples',
@@ -193,10 +338,75 @@ def run():
                                    help='Maximum number of sample samples to compare')
     argparser_compare.add_argument('-f', '--font-size', default=None,
                                    help='Font size for playlist')
+    argparser_compare.add_argument('-t', '--scheduler', choices=utils.SCHEDULERS, default=None,
+                                   help=('Compare samples in pairs in a knockout or swiss tournament '
+                                         'instead of keeping the best sample until a better one comes along; '
+                                         'tournaments are resumed and print a ranking at the end'))
+    argparser_compare.add_argument('--seed-by', default=None, metavar='FIELD',
+                                   help='Estimate or metric that seeds tournaments, e.g. size, time or ssim')
+    argparser_compare.add_argument('--proxies', action='store_true',
+                                   help=('Build lossless, intra-only copies of the samples in the background '
+                                         'and play them to switch between samples at the exact frame instantly; '
+                                         'they are large and kept in the samples directory'))
+    argparser_compare.add_argument('-j', '--jobs', type=_positive_int,
+                                   default=max(1, utils.cpu_count() // 2),
+                                   help='Number of proxies to build in parallel')
     argparser_compare.add_argument('--debug', action='store_true',
                                    help='Print debugging messages in Lua print')
     argparser_compare.set_defaults(func=_compare)
 
+    argparser_metrics = subparsers.add_parser(
+        'metrics',
+        help='Compare samples to the original with objective quality metrics',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=('Compare samples to the original with objective quality metrics\n\n'
+                     'SSIM, PSNR and, if ffmpeg supports it, VMAF are stored in the estimates\n'
+                     'file. Samples are listed by quality; samples on the Pareto front of\n'
+                     'quality, size and encoding time are marked with "*". Pass the same -vf\n'
+                     'that was used to create the samples unless the excerpt is lossless.'))
+    argparser_metrics.add_argument('samples',
+                                   help='Directory that contains the samples')
+    argparser_metrics.add_argument('-j', '--jobs', type=_positive_int, default=utils.cpu_count(),
+                                   help='Number of samples to compare in parallel')
+    argparser_metrics.add_argument('-m', '--metric', choices=ffmpeg.METRICS, default='ssim',
+                                   help='Quality metric for sorting and finding the Pareto front')
+    argparser_metrics.add_argument('--prune', action='store_true',
+                                   help=('Delete samples that are not on the Pareto front; '
+                                         '"samples" skips them unless --overwrite is given'))
+    argparser_metrics.set_defaults(func=_metrics)
+
+    argparser_estimates = subparsers.add_parser(
+        'estimates',
+        help='Show estimates of previously generated samples',
+        description=('Show estimates of previously generated samples\n\n'
+                     'New estimates are appended to a journal next to the estimates file.\n'
+                     'This merges the journal into the estimates file first.'),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser_estimates.add_argument('samples',
+                                     help='Directory that contains the samples')
+    argparser_estimates.set_defaults(func=_estimates)
+
+    argparser_report = subparsers.add_parser(
+        'report',
+        help="Tabulate samples with x264's statistics",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=("Tabulate samples with x264's statistics\n\n"
+                     'x264 prints statistics (e.g. average QP, bitrate and macroblock types)\n'
+                     'at the end of each encode, which are stored in the estimates file.\n'
+                     'Fields that are lists (e.g. ref_P_l0) are compared element-wise.'))
+    argparser_report.add_argument('samples',
+                                  help='Directory that contains the samples')
+    argparser_report.add_argument('-s', '--sort', default='size', metavar='FIELD',
+                                  help='Sort samples by FIELD (Default: size)')
+    argparser_report.add_argument('--reverse', action='store_true',
+                                  help='Sort in descending order')
+    argparser_report.add_argument('-f', '--fields', default=','.join(REPORT_FIELDS),
+                                  help=('Comma-separated list of fields to show '
+                                        f'(Default: {",".join(REPORT_FIELDS)})'))
+    argparser_report.add_argument('-l', '--list', action='store_true',
+                                  help='List all available fields')
+    argparser_report.set_defaults(func=_report)
+
     argparser_bframes = subparsers.add_parser(
         'bframes',
         help='Generate test encode and show consecutive B-frames percentages',
@@ -205,144 +415,1277 @@ def run():
                      'The settings given by --x264-settings are used but are optimized\n'
                      'for speed, e.g. crf=51.'))
     argparser_bframes.add_argument('-b', '--bframes', default='16',
-                                   help='Maximum number of consecutive B-frames in test encode')
+                                   help=('Maximum number of consecutive B-frames in test encode; '
+                                         'multiple values are separated with "/"'))
     argparser_bframes.add_argument('-a', '--b-adapt', default='2',
-                                   help='Adaptive B-frame decision method')
+                                   help=('Adaptive B-frame decision method; '
+                                         'multiple values are separated with "/"'))
+    argparser_bframes.add_argument('-j', '--jobs', type=_positive_int, default=1,
+                                   help='Number of ranges to analyze in parallel')
+    argparser_bframes.add_argument('-w', '--whole', action='store_true',
+                                   help='Analyze the whole video instead of --range')
+    argparser_bframes.add_argument('--chunk-duration', default='5:00', metavar='DURATION',
+                                   help='Length of ranges with --whole')
     argparser_bframes.set_defaults(func=_bframes)
 
+    argparser_serve = subparsers.add_parser(
+        'serve',
+        formatter_class=MyHelpFormatter,
+        help='Run queued samples, metrics and bframes jobs within one budget of cores and memory',
+        description=('Run jobs from "submit" on this machine within one budget of cores and memory\n\n'
+                     'Jobs start in the order they were submitted as soon as their cores and memory\n'
+                     'are free. Each job is pinned to its own cores, which it splits evenly between\n'
+                     'its encoders, and runs in the working directory of "submit".'),
+        epilog=('example:\n'
+                f'  $ {__name__} serve --cores 16 --memory 24G &\n'
+                f'  $ {__name__} submit --cores 8 -- -s source.mkv samples -xs crf=18/19/20\n'
+                f'  $ {__name__} submit --cores 8 --detach -- metrics samples.dir\n'
+                f'  $ {__name__} status'))
+    argparser_serve.add_argument('-c', '--cores', type=_positive_int, default=utils.cpu_count(),
+                                 help='Number of cores that all jobs may use together')
+    argparser_serve.add_argument('-m', '--memory', type=_size, default=None, metavar='SIZE',
+                                 help='Memory that all jobs may reserve together; physical memory if not given')
+    argparser_serve.add_argument('--socket', default=None, metavar='PATH',
+                                 help=f'Unix socket to listen on; $XDG_RUNTIME_DIR/{__name__}.sock if not given')
+    argparser_serve.set_defaults(func=_serve)
+
+    argparser_submit = subparsers.add_parser(
+        'submit',
+        formatter_class=MyHelpFormatter,
+        help='Queue a samples, metrics or bframes job on the server',
+        description=('Queue a samples, metrics or bframes job on the server and show its output\n\n'
+                     'Ctrl-c detaches from the job without stopping it.'))
+    argparser_submit.add_argument('-c', '--cores', type=_positive_int, default=None,
+                                  help='Number of cores the job needs; all cores of the server if not given')
+    argparser_submit.add_argument('-m', '--memory', type=_size, default=0, metavar='SIZE',
+                                  help='Memory the job needs')
+    argparser_submit.add_argument('--detach', action='store_true',
+                                  help='Print the job ID instead of the output of the job')
+    argparser_submit.add_argument('--socket', default=None, metavar='PATH',
+                                  help='Unix socket of the server')
+    argparser_submit.add_argument('command', nargs=argparse.REMAINDER,
+                                  help=f'Arguments of {__name__}, e.g. "-s source.mkv samples -xs crf=18/20"')
+    argparser_submit.set_defaults(func=_submit)
+
+    argparser_status = subparsers.add_parser(
+        'status',
+        formatter_class=MyHelpFormatter,
+        help='List jobs on the server',
+        description='List jobs on the server or show the output of one of them')
+    argparser_status.add_argument('-a', '--attach', type=int, default=None, metavar='JOB',
+                                  help='Show output of JOB from the beginning until it is finished')
+    argparser_status.add_argument('--cancel', type=int, default=None, metavar='JOB',
+                                  help='Stop JOB or remove it from the queue')
+    argparser_status.add_argument('--socket', default=None, metavar='PATH',
+                                  help='Unix socket of the server')
+    argparser_status.set_defaults(func=_status)
+
+    return argparser
+
+def run():
+    server.pin()
+    argparser = _argparser()
     args = argparser.parse_args()
+    if args.range is None:
+        args.range = [['5:00', '10']]
     if hasattr(args, 'func'):
         args.func(args)
     else:
         argparser.print_help()
 
+def _jobs(string):
+    if string == 'auto':
+        return string
+    return _positive_int(string)
+
+def _positive_int(string):
+    try:
+        number = int(string)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Not an integer: {string}')
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'Must be 1 or larger: {string}')
+    return number
+
+def _size(string):
+    try:
+        return utils.str2bytes(string)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(e)
+
+def _duration(string):
+    try:
+        return utils.str2duration(string)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(e)
+
+def _ranges(args):
+    # Return list of (START, DURATION) tuples and a string that identifies them
+    # in file names
+    if args.chunks:
+        duration_str = args.range[0][1]
+        duration = utils.str2duration(duration_str)
+        slot = ffmpeg.duration(args.source) / args.chunks
+        if duration > slot:
+            utils.croak(f'{args.chunks} chunks of {duration_str} seconds are longer than the video')
+        # The same arguments must always produce the same ranges
+        rng = random.Random(f'{utils.title(args.source)}:{args.chunks}:{duration_str}')
+        ranges = []
+        for i in range(args.chunks):
+            if args.stratify:
+                offset = rng.uniform(0, slot - duration)
+            else:
+                offset = (slot - duration) / 2
+            ranges.append((utils.timestamp(i * slot + offset), duration_str))
+        return ranges, f'{args.chunks}x{duration_str}{"r" if args.stratify else ""}'
+    else:
+        ranges = [tuple(r) for r in args.range]
+        return ranges, '+'.join('-'.join(r) for r in ranges)
+
+def _whole_ranges(total_secs, chunk_duration):
+    # Return list of consecutive (START, DURATION) tuples that cover the whole
+    # video
+    try:
+        chunk_secs = utils.str2duration(chunk_duration)
+    except ValueError as e:
+        utils.croak(e)
+    if chunk_secs <= 0:
+        utils.croak(f'Invalid duration: {chunk_duration}')
+    ranges = []
+    start = 0
+    while total_secs - start >= chunk_secs * 1.5:
+        ranges.append((utils.timestamp(start, exact=True), chunk_duration))
+        start = len(ranges) * chunk_secs
+    # The last range also covers the rest of the video instead of leaving a
+    # short range (maybe only a fraction of a frame)
+    duration = math.ceil((total_secs - start) * 1000) / 1000
+    ranges.append((utils.timestamp(start, exact=True), utils.timestamp(duration, exact=True)))
+    return ranges
+
+def _extrapolate(chunks, field, total_secs):
+    # Extrapolate `field` (e.g. encoding time or size) of the final encode from
+    # the same field of each encoded range. Return it with its standard error,
+    # which is None for a single range.
+    rates = [chunk[field] / chunk['duration'] for chunk in chunks]
+    if len(rates) > 1:
+        err = statistics.stdev(rates) / math.sqrt(len(rates)) * total_secs
+    else:
+        err = None
+    return statistics.mean(rates) * total_secs, err
+
+# Encodes that exceed --max-size or --max-time are killed early, but only
+# after this fraction of the excerpt is encoded and only if they are projected
+# to exceed it by this factor; e.g. the first frame is a large I-frame and
+# ffmpeg needs a moment to start
+ABORT_MIN_PROGRESS = 0.2
+ABORT_MARGIN = 1.1
+
+def _project(results, excerpt_secs, total_secs, share=1, parallelism=None, shared_cpu_time=0):
+    # Project encoding time and size of the final encode from the progress
+    # reports of the processes that encode one sample (see
+    # ffmpeg._progress_handler()). `share` is the part of the wall clock time
+    # that is attributed to this sample. With `parallelism`, encoding time is
+    # estimated from CPU time like in _store_result(), including
+    # `shared_cpu_time` of a decoder. Return None if it's too early to tell.
+    secs = sum(result['duration'] or 0 for result in results)
+    if secs < excerpt_secs * ABORT_MIN_PROGRESS:
+        return None
+    if parallelism is not None and all('cpu_time' in result for result in results):
+        elapsed = (sum(result['cpu_time'] for result in results) + shared_cpu_time) / parallelism
+    else:
+        elapsed = max(result['progress'][-1][0] for result in results if result['progress']) * share
+    size = sum(result.get('size', 0) for result in results)
+    return elapsed / secs * total_secs, size / secs * total_secs
+
+def _exceeds_budget(est_time, est_size, max_size=None, max_time=None, margin=1):
+    # Return why estimates exceed the budget or None
+    if max_size is not None and est_size > max_size * margin:
+        return f'Estimated final size exceeds {utils.bytes2str(max_size).strip()}'
+    elif max_time is not None and est_time > max_time * margin:
+        return f'Estimated encoding time exceeds {utils.duration2str(max_time)}'
+
+def _estimate_lines(record):
+    time_str = record['time_str']
+    if 'time_norm_str' in record:
+        time_str += f' (normalized: {record["time_norm_str"]})'
+    lines = [f'  Estimated encoding time: {time_str}',
+             f'     Estimated final size: {record["size_str"]}']
+    if record.get('rejected'):
+        lines.append(f'                 Rejected: {record["rejected"]}')
+    return lines
+
+def _telemetry(result, **fields):
+    # Return what we know about how an encode used the available resources
+    telemetry = dict(fields)
+    for field in ('duration', 'frames', 'time', 'cpu_time', 'user_time', 'system_time',
+                  'maxrss', 'load', 'progress'):
+        if field in result:
+            telemetry[field] = result[field]
+    if result.get('time'):
+        telemetry['speed'] = result['duration'] / result['time']
+        if 'frames' in result:
+            telemetry['fps'] = result['frames'] / result['time']
+    if 'chunks' in result:
+        telemetry['chunks'] = [_telemetry(chunk) for chunk in result['chunks']]
+    return telemetry
+
+def _encode_ranges(excerpts, chunks_dir, dest, settings, unfinished, vf=None, threads=None,
+                   progress=None, budget=None):
+    # Encode all excerpts in parallel and join them. Incomplete files are in
+    # the set `unfinished` until they are done.
+    utils.mkdir(chunks_dir)
+    chunk_dests = [os.path.join(chunks_dir, f'{os.path.basename(dest)}.{i}.mkv')
+                   for i in range(len(excerpts))]
+    unfinished.update(chunk_dests)
+    try:
+        chunks = ffmpeg.encode_ranges(excerpts, chunk_dests, settings, vf=vf,
+                                      threads=threads, progress=progress, budget=budget)
+    except ffmpeg.OverBudget:
+        for chunk_dest in chunk_dests:
+            _remove(utils.logfile(chunk_dest))
+            unfinished.discard(chunk_dest)
+        raise
+    ffmpeg.concat(chunk_dests, dest)
+    with open(utils.logfile(dest), 'w') as log:
+        for chunk,chunk_dest in zip(chunks, chunk_dests):
+            if chunk['duration'] is None:
+                chunk['duration'] = ffmpeg.duration(chunk_dest)
+            chunk['size'] = os.path.getsize(chunk_dest)
+            with open(utils.logfile(chunk_dest), 'r') as chunk_log:
+                shutil.copyfileobj(chunk_log, log)
+            for f in (chunk_dest, utils.logfile(chunk_dest)):
+                os.remove(f)
+            unfinished.discard(chunk_dest)
+    result = {field: sum(chunk[field] for chunk in chunks)
+              for field in ('duration', 'time', 'cpu_time', 'user_time', 'system_time')}
+    result['frames'] = sum(chunk.get('frames', 0) for chunk in chunks)
+    result['maxrss'] = max(chunk['maxrss'] for chunk in chunks)
+    result['chunks'] = chunks
+    return result
+
+def _uses_cpu_time(split, jobs):
+    # Parts of the excerpt finish much sooner in parallel than the final
+    # encode would and parallel jobs compete for the cores, so their encoding
+    # time is estimated from their CPU time spread over the cores like in a
+    # single x264 process that runs alone (see ffmpeg.calibration())
+    return split > 1 or jobs > 1
+
+def _store_result(result, samples_dir, estimates_file, diff_settings, settings, dest, hash,
+                  total_secs, calibration=None, split=1, jobs=1, normalize_time=False, **telemetry):
+    # Store estimates, telemetry and manifest entry of an encoded sample and
+    # return its estimates record and the result in the manifest. `telemetry`
+    # is stored with the resource usage of the encode.
+    if split > 1:
+        # Parts of the excerpt aren't ranges of their own
+        chunks = [{'duration': result['duration'],
+                   'time': result['time'],
+                   'cpu_time': result['cpu_time'],
+                   'size': os.path.getsize(dest)}]
+    else:
+        chunks = result.get('chunks') or [{'duration': result['duration'],
+                                             'time': result['time'],
+                                             'cpu_time': result['cpu_time'],
+                                             'size': os.path.getsize(dest)}]
+    # Nothing can be extrapolated from empty encodes
+    if not all(chunk['duration'] for chunk in chunks):
+        utils.croak(f'Unable to determine duration of {dest}')
+    if _uses_cpu_time(split, jobs):
+        chunks = [dict(chunk, time=chunk['cpu_time'] / calibration['parallelism'])
+                  for chunk in chunks]
+    est_time, time_err = _extrapolate(chunks, 'time', total_secs)
+    est_size, size_err = _extrapolate(chunks, 'size', total_secs)
+    fields = dict(result['metrics'], x264=ffmpeg.x264_stats(utils.logfile(dest)))
+    if normalize_time:
+        # CPU time spread over all cores as well as x264 manages when nothing
+        # else is running
+        est_cpu_time, cpu_time_err = _extrapolate(chunks, 'cpu_time', total_secs)
+        parallelism = calibration['parallelism']
+        fields.update(time_norm=est_cpu_time / parallelism,
+                      time_norm_err=(cpu_time_err / parallelism
+                                     if cpu_time_err is not None else None),
+                      load=round(result['load'], 2))
+    record = utils.update_estimates(estimates_file, diff_settings,
+                                    est_time, est_size, settings,
+                                    time_err=time_err, size_err=size_err,
+                                    **fields)
+    utils.append_telemetry(samples_dir, _telemetry(result, settings=record['settings'], jobs=jobs,
+                                                   **telemetry))
+    job_result = {'duration': result['duration'],
+                  'time': result['time'],
+                  'cpu_time': result['cpu_time'],
+                  'size': os.path.getsize(dest),
+                  'metrics': result['metrics']}
+    utils.update_manifest(samples_dir, record['settings'], hash, 'done', result=job_result)
+    return record, job_result
+
+def _restore_estimates(estimates_file, record, replace=False):
+    # Store estimates of a sample that was copied from the encode cache. With
+    # `replace`, they aren't merged with the sample's earlier estimates
+    # (e.g. of an encode that was rejected before the budget grew).
+    if replace:
+        utils.delete_estimates(estimates_file, record['settings'])
+    utils.append_estimates(estimates_file, record)
+
+def _unique_sample_settings(base_settings, sample_settings):
+    # Return `sample_settings` without combinations that x264 encodes exactly
+    # like an earlier one. Only the strings of the canonical settings are kept.
+    seen = set()
+    unique = []
+    for diff_settings in sample_settings:
+        settings = str(x264.canonical(utils.combine_dicts(base_settings, diff_settings)))
+        if settings not in seen:
+            seen.add(settings)
+            unique.append(diff_settings)
+    return unique
+
+def _tune_jobs(excerpt, settings, vf, encoders, sample_count):
+    # Return the number of parallel jobs with the most frames per second in
+    # total. Each job runs `encoders` encodes and the cores are split evenly
+    # between all of them like in _samples().
+    max_jobs = max(1, min(utils.cpu_count() // encoders, sample_count))
+    candidates = [2**i for i in range(max_jobs.bit_length()) if 2**i < max_jobs] + [max_jobs]
+    if len(candidates) == 1:
+        return max_jobs
+    measurements = []
+    for jobs in candidates:
+        processes = jobs * encoders
+        threads = max(1, utils.cpu_count() // processes) if processes > 1 else None
+        result = ffmpeg.throughput(excerpt, settings, processes, threads=threads, vf=vf,
+                                   topic=f'  Measuring throughput of {jobs} parallel jobs')
+        measurements.append((jobs, threads, result['fps']))
+    best = max(measurements, key=lambda measurement: measurement[2])
+    for i,(jobs, threads, fps) in enumerate(measurements):
+        label = 'Throughput:' if i == 0 else ''
+        print(f'{label:>17s} {fps:.1f} fps with {jobs} jobs and '
+              f'{threads or "default"} threads per encoder{" (best)" if jobs == best[0] else ""}')
+    return best[0]
+
 def _samples(args):
     base_settings = utils.parse_settings(args.x264_settings)
-    sample_settings = utils.generate_sample_settings(*args.sample_settings)
+    # Grids can have many thousands of samples, so they are generated only once
+    sample_count = utils.count_sample_settings(*args.sample_settings)
+    unique = _unique_sample_settings(base_settings,
+                                     utils.iter_sample_settings(*args.sample_settings))
+    unique_count = len(unique)
+    if args.search:
+        if len(args.sample_settings) != 1:
+            utils.croak('--search needs exactly one set of sample settings')
+        if args.order != 'grid':
+            utils.croak('--order is not supported with --search')
+        space = utils.parse_sample_settings(args.sample_settings[0])
+        if args.objective != 'size':
+            # Quality objectives need metrics for each sample
+            args.metrics = True
     title = utils.title(args.source)
-    samples_dir = os.path.join('.', (f'samples.{title}@{"-".join(args.range)}.' +
-                                     ':'.join(utils.sample_keys(sample_settings))))
-    if not sample_settings:
+    ranges, range_str = _ranges(args)
+    keys = utils.sample_keys(utils.parse_sample_settings(string) for string in args.sample_settings)
+    samples_dir = os.path.join('.', f'samples.{title}@{range_str}.' + ':'.join(keys))
+    if not sample_count:
         utils.croak('Missing argument: --sample-settings')
+    if len(ranges) > 1 and args.fan_out > 1:
+        utils.croak('--fan-out is not supported with multiple ranges')
+    if args.split > 1 and (len(ranges) > 1 or args.fan_out > 1):
+        utils.croak('--split is not supported with multiple ranges or --fan-out')
+    if args.spool and (args.search or args.fan_out > 1 or
+                       args.max_size is not None or args.max_time is not None):
+        utils.croak('--spool is not supported with --search, --fan-out, --max-size or --max-time')
 
     print(f'    Base settings: {utils.settings2str(base_settings, escape=False)}')
-    print(f'{len(sample_settings):9d} samples: '
-          f'{utils.settings2str(sample_settings, escape=False)}')
+    print(f'{sample_count:9d} samples: '
+          f'{utils.settings2str(unique, escape=False)}')
+    if unique_count < sample_count:
+        print(f'{sample_count - unique_count:9d} samples are skipped because x264 would encode them '
+              f'like other samples')
     print(f'Samples directory: {samples_dir}')
     if not args.dry_run:
         utils.mkdir(samples_dir)
-        # Extract range from original into separate file
-        excerpt_path = os.path.join(samples_dir, f'{title}.original@{"-".join(args.range)}.mkv')
+        # Extract each range from original into separate file. Multiple ranges
+        # are joined into one file for comparing.
+        excerpt_path = os.path.join(samples_dir, utils.original_filename(title, range_str))
+        if len(ranges) > 1:
+            excerpts = [os.path.join(samples_dir, f'{title}.excerpt@{"-".join(r)}.mkv')
+                        for r in ranges]
+        else:
+            excerpts = [excerpt_path]
+        for (start, stop),excerpt in zip(ranges, excerpts):
+            if not os.path.exists(excerpt):
+                try:
+                    ffmpeg.encode(args.source, dest=excerpt, vf=args.vf,
+                                  start=start, stop=stop,
+                                  topic=f'  Extracting range {start} - {stop}',
+                                  create_logfile=False, lossless=args.lossless_excerpt)
+                except KeyboardInterrupt:
+                    print('\n')
+                    utils.cleanup(excerpt)
+                    utils.croak('Aborted')
+            elif ffmpeg.is_lossless(excerpt) != args.lossless_excerpt:
+                utils.croak(f'Existing excerpt was extracted '
+                            f'{"with" if not args.lossless_excerpt else "without"} '
+                            f'--lossless-excerpt: {excerpt}')
         if not os.path.exists(excerpt_path):
+            ffmpeg.concat(excerpts, excerpt_path)
+        chunks_dir = os.path.join(samples_dir, '.chunks')
+        if args.split > 1:
+            # Parts of the excerpt are encoded like multiple ranges
+            split_dir = os.path.join(samples_dir, f'.split{args.split}')
+            if os.path.isdir(split_dir):
+                excerpts = ffmpeg.split_parts(split_dir)
+            else:
+                excerpts = ffmpeg.split(excerpt_path, split_dir, args.split)
+            if len(excerpts) < args.split:
+                print(f'    Excerpt split: {len(excerpts)} parts because there are not enough keyframes')
+        if args.max_size is not None or args.max_time is not None:
+            excerpt_secs = sum(ffmpeg.duration(excerpt) for excerpt in excerpts)
+
+    # Filters are already applied to a lossless excerpt
+    vf = None if args.lossless_excerpt else args.vf
+
+    total_secs = ffmpeg.duration(args.source)
+    estimates_file = os.path.join(samples_dir, args.estimates_file)
+
+    # Ranges or parts of the excerpt that are encoded in parallel for each
+    # sample; there may be fewer parts than --split
+    parts = len(ranges) * args.split if args.dry_run else len(excerpts)
+
+    if args.jobs == 'auto':
+        if args.dry_run or args.spool:
+            # Nothing is encoded here
+            args.jobs = 1
+        else:
+            settings = utils.combine_dicts(base_settings, unique[0])
             try:
-                ffmpeg.encode(args.source, dest=excerpt_path, vf=args.vf,
-                              start=args.range[0], stop=args.range[1],
-                              topic=f'  Extracting range {args.range[0]} - {args.range[1]}',
-                              create_logfile=False)
+                args.jobs = _tune_jobs(excerpts[0], settings, vf, args.fan_out * parts,
+                                       unique_count)
             except KeyboardInterrupt:
-                print('\n')
-                utils.cleanup(excerpt_path)
+                print()
                 utils.croak('Aborted')
 
-    total_secs = ffmpeg.duration(args.source)
-    estimates_file = os.path.join(samples_dir, args.estimates_file)
-    try:
-        for i,diff_settings in enumerate(sample_settings, start=1):
-            settings = utils.combine_dicts(base_settings, diff_settings)
-            dest = os.path.join(samples_dir,
-                                (f'{title}.sample@'
-                                 f'{"-".join(args.range)}.'
-                                 f'{utils.settings2str(settings, escape=False)}'
-                                 f'.mkv'))
-            print(f'Sample {i}/{len(sample_settings)}: '
-                  f'{utils.settings2str(diff_settings, escape=False)}')
-            if not args.dry_run and (args.overwrite or not os.path.exists(dest)):
-                start_time = time.monotonic()
-                ffmpeg.encode(excerpt_path, dest, settings, vf=args.vf, topic='  Encoding')
-                enc_time = time.monotonic() - start_time
-                sample_secs = ffmpeg.duration(dest)
-                est_time = enc_time * total_secs / sample_secs
-                est_size = os.path.getsize(dest) * total_secs / sample_secs
-                utils.update_estimates(estimates_file, diff_settings,
-                                       est_time, est_size, settings)
-                est = utils.read_estimates(estimates_file)
-                key = utils.settings2str(diff_settings, escape=False)
-                print(f'  Estimated encoding time: {est[key]["time_str"]}')
-                print(f'     Estimated final size: {est[key]["size_str"]}')
-            elif os.path.exists(dest):
-                print(f'  Already encoded')
-                est = utils.read_estimates(estimates_file)
-                key = utils.settings2str(diff_settings, escape=False)
+    threads = None
+    encoders = args.jobs * args.fan_out * parts
+    if encoders > 1:
+        # x264 doesn't scale linearly with the number of threads, especially
+        # for small resolutions, so it's more efficient to run multiple
+        # encodes with fewer threads each.
+        threads = max(1, utils.cpu_count() // encoders)
+        print(f'    Parallel jobs: {args.jobs} with {encoders // args.jobs} encoders '
+              f'and {threads} threads per encoder')
+
+    calibration = None
+    if ((args.normalize_time or _uses_cpu_time(args.split, args.jobs))
+            and not args.dry_run and not args.spool):
+        calibration = ffmpeg.calibration(topic='Calibrating CPU time')
+        print(f'  Normalized time: {calibration["cores"]} dedicated cores; '
+              f'x264 keeps {calibration["parallelism"]:.1f} of them busy')
+
+    def over_budget(results):
+        # Return (projection, reason) for each sample that is encoded by the
+        # processes that reported `results` where `projection` is (est_time,
+        # est_size) and `reason` is None if the sample is within the budget or
+        # it's too early to tell
+        decoder_cpu_time = 0
+        if len(excerpts) > 1:
+            samples, shares = [results], [1]
+        elif all('cpu_time' in result for result in results):
+            # Encoders that share a decoder also share the wall clock time and
+            # the decoder's CPU time like in ffmpeg._attribute_time()
+            decoder_cpu_time = max(result.get('decoder_cpu_time', 0) for result in results)
+            samples = [[result] for result in results]
+            shares = ffmpeg.time_shares([result['cpu_time'] for result in results],
+                                        decoder_cpu_time)
+        else:
+            samples = [[result] for result in results]
+            shares = [1 / len(results)] * len(results)
+        parallelism = calibration['parallelism'] if _uses_cpu_time(args.split, args.jobs) else None
+        verdicts = []
+        for sample,share in zip(samples, shares):
+            projection = _project(sample, excerpt_secs, total_secs, share, parallelism,
+                                  decoder_cpu_time)
+            if projection is None:
+                verdicts.append((None, None))
+            else:
+                verdicts.append((projection, _exceeds_budget(*projection, max_size=args.max_size,
+                                                             max_time=args.max_time,
+                                                             margin=ABORT_MARGIN)))
+        return verdicts
+
+    def check_budget(results):
+        # Kill encodes when all of their samples are over budget
+        reasons = [reason for _,reason in over_budget(results)]
+        if all(reasons):
+            return reasons[0]
+    budget = check_budget if args.max_size is not None or args.max_time is not None else None
+
+    status = utils.StatusLine()
+    unfinished = set()
+
+    # Splitting the excerpt changes the sample, but samples that were encoded
+    # before --split existed are still the same
+    split_key = [args.split] if args.split > 1 else []
+    def job_hash(settings):
+        return utils.job_hash(settings.escaped, range_str, vf, args.lossless_excerpt, *split_key)
+
+    # Encodes are cached in a global cache, so they can be shared between
+    # samples directories. x264's output depends on its version and number of
+    # threads (the default depends on the number of cores) and the encoding
+    # time also depends on how many encoders run in parallel.
+    source_key = cache.file_key(args.source)
+    use_cache = source_key is not None and args.cache_size > 0
+    def cache_key(settings):
+        return ['encode', source_key, ranges, args.vf, args.lossless_excerpt,
+                list(x264.canonical(settings).items()), *split_key,
+                ffmpeg.version(), threads, utils.cpu_count(), encoders]
+
+    def from_cache(key, settings, dest):
+        # Link sample from the cache and return its estimates
+        hit = cache.get_dir('encodes', cache_key(settings)) if use_cache else None
+        if hit is None:
+            return None
+        path, value = hit
+        try:
+            cache.link(os.path.join(path, 'sample.mkv'), dest)
+            shutil.copyfile(os.path.join(path, 'sample.log'), utils.logfile(dest))
+        except OSError:
+            # Evicted by another process
+            return None
+        record = {**value['estimates'], 'settings': key, 'all_settings': settings.escaped}
+        _restore_estimates(estimates_file, record,
+                           replace=bool(est.get(key, {}).get('rejected')))
+        utils.update_manifest(samples_dir, key, job_hash(settings), 'done', result=value['result'])
+        return record
+
+    def to_cache(record, settings, dest, result):
+        if use_cache:
+            estimates = {k: v for k,v in record.items() if k not in ('settings', 'all_settings')}
+            cache.put_dir('encodes', cache_key(settings),
+                          {'sample.mkv': dest, 'sample.log': utils.logfile(dest)},
+                          {'estimates': estimates, 'result': result},
+                          max_size=args.cache_size,
+                          # ffmpeg overwrites logs of samples that are encoded again
+                          copy=('sample.log',))
+
+    def encode_samples(samples):
+        # Encode multiple samples from the same decoded frames
+        topic = 'Sample ' + ','.join(str(i) for i,*_ in samples)
+        dests = [dest for *_,dest in samples]
+        unfinished.update(dests)
+        for _, _, diff_settings, settings, _ in samples:
+            utils.update_manifest(samples_dir, str(diff_settings), job_hash(settings), 'running')
+        status.update(topic, 'Starting')
+        def progress(string):
+            status.update(topic, string)
+        load = os.getloadavg()[0]
+        try:
+            if len(excerpts) > 1:
+                _, _, _, settings, dest = samples[0]
+                results = [_encode_ranges(excerpts, chunks_dir, dest, settings, unfinished, vf=vf,
+                                          threads=threads, progress=progress, budget=budget)]
+            elif len(samples) == 1:
+                _, _, _, settings, dest = samples[0]
+                results = [ffmpeg.encode(excerpt_path, dest, settings, vf=vf,
+                                         threads=threads, progress=progress, budget=budget)]
+            else:
+                results = ffmpeg.encode_many(excerpt_path, dests,
+                                             [settings for _,_,_,settings,_ in samples],
+                                             vf=vf, threads=threads, progress=progress,
+                                             budget=budget)
+        except ffmpeg.OverBudget as e:
+            # Nothing is left of the killed encodes but their logs and any
+            # sample that is overwritten
+            for dest in dests:
+                for f in (dest, utils.logfile(dest)):
+                    _remove(f)
+            unfinished.difference_update(dests)
+            return [{'rejected': reason, 'projection': projection}
+                    for projection,reason in over_budget(e.results)]
+        except BaseException:
+            for _, _, diff_settings, settings, _ in samples:
+                utils.update_manifest(samples_dir, str(diff_settings), job_hash(settings), 'failed')
+            raise
+        finally:
+            status.remove(topic)
+        unfinished.difference_update(dests)
+        # Average number of processes that competed for CPU cores
+        load = (load + os.getloadavg()[0]) / 2
+        for result,dest in zip(results, dests):
+            result['load'] = load
+            # Only probe the sample if ffmpeg didn't report its duration
+            if result['duration'] is None:
+                result['duration'] = ffmpeg.duration(dest)
+            result['metrics'] = {}
+            if args.metrics:
+                topic_ = f'Metrics {os.path.basename(dest)}'
+                try:
+                    result['metrics'] = ffmpeg.metrics(dest, excerpt_path, vf=vf,
+                                                       progress=lambda s: status.update(topic_, s))
+                finally:
+                    status.remove(topic_)
+        return results
+
+    est = utils.read_estimates(estimates_file)
+    manifest = utils.read_manifest(samples_dir)
+    spooled = spool.spooled(args.spool) if args.spool and not args.dry_run else set()
+    def spool_sample(i, diff_settings, settings, dest):
+        # Write job for "worker" and return whether it was queued already
+        id = utils.job_hash(os.path.abspath(dest), job_hash(settings))[:16]
+        if id in spooled:
+            return False
+        job = {'samples_dir': os.path.abspath(samples_dir),
+               'estimates_file': os.path.abspath(estimates_file),
+               'excerpt': os.path.abspath(excerpt_path),
+               'excerpts': [os.path.abspath(excerpt) for excerpt in excerpts],
+               'chunks_dir': os.path.abspath(chunks_dir),
+               'dest': os.path.abspath(dest),
+               'diff_settings': list(diff_settings.items()),
+               'settings': list(settings.items()),
+               'vf': vf,
+               'hash': job_hash(settings),
+               'total_secs': total_secs,
+               'split': args.split,
+               'metrics': args.metrics,
+               'normalize_time': args.normalize_time,
+               # Don't merge new estimates with those of a rejected sample
+               'replace': bool(est.get(str(diff_settings), {}).get('rejected'))}
+        spool.put(args.spool, i, id, job)
+        spooled.add(id)
+        return True
+
+    def measure_sample(dest):
+        # Compute metrics of a sample that was encoded earlier
+        topic = f'Metrics {os.path.basename(dest)}'
+        try:
+            return ffmpeg.metrics(dest, excerpt_path, vf=vf,
+                                  progress=lambda s: status.update(topic, s))
+        finally:
+            status.remove(topic)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs)
+    futures = {}
+    measuring = {}
+    def encode_batch(batch, total):
+        # Encode samples for each (number, diff_settings) in `batch` and return
+        # their estimates
+        futures.clear()
+        measuring.clear()
+        records = {}
+        samples = []
+        for i,diff_settings in batch:
+            diff_settings = utils.Settings(diff_settings)
+            settings = utils.Settings(utils.combine_dicts(base_settings, diff_settings))
+            dest = os.path.join(samples_dir, utils.sample_filename(title, range_str, settings))
+            key = str(diff_settings)
+            header = f'Sample {i}/{total}: {key}'
+            job = manifest.get(key)
+            if job is None:
+                # Sample from before there was a manifest
+                done = os.path.exists(dest)
+            else:
+                done = (job['state'] == 'done' and job['hash'] == job_hash(settings)
+                        and os.path.exists(dest))
+            # Samples that were rejected stay rejected unless the budget grew
+            rejected = (job is not None and job['state'] == 'rejected'
+                        and job['hash'] == job_hash(settings) and not args.overwrite
+                        and _exceeds_budget(job['time'], job['size'], max_size=args.max_size,
+                                            max_time=args.max_time, margin=ABORT_MARGIN))
+            if rejected:
+                lines = [header, '  Rejected earlier']
                 if key in est:
-                    print(f'  Estimated encoding time: {est[key]["time_str"]}')
-                    print(f'     Estimated final size: {est[key]["size_str"]}')
-    except KeyboardInterrupt:
-        print('\n')
-        utils.cleanup(dest)
-        utils.croak('Aborted')
+                    lines.extend(_estimate_lines(est[key]))
+                    records[key] = est[key]
+                status.print(*lines)
+                continue
+            # Samples that were deleted by "metrics --prune" aren't encoded again
+            if (job is not None and job['state'] == 'pruned'
+                and job['hash'] == job_hash(settings) and not args.overwrite):
+                status.print(header, '  Pruned earlier')
+                continue
+            cached = False
+            if not done and not args.dry_run and not args.overwrite:
+                record = from_cache(key, settings, dest)
+                if record is not None:
+                    est[key] = record
+                    done = cached = True
+            if args.spool and not args.dry_run and (args.overwrite or not done):
+                if spool_sample(i, diff_settings, settings, dest):
+                    status.print(header, '  Spooled')
+                else:
+                    status.print(header, '  Spooled earlier')
+            elif not args.dry_run and (args.overwrite or not done):
+                samples.append((i, header, diff_settings, settings, dest))
+                if len(samples) >= args.fan_out:
+                    futures[executor.submit(encode_samples, samples)] = samples
+                    samples = []
+            elif done:
+                lines = [header, '  Copied from encode cache' if cached else '  Already encoded']
+                if key in est:
+                    records[key] = est[key]
+                    if args.metrics and not all(m in est[key] for m in ('ssim', 'psnr')):
+                        # Print estimates with metrics when they are computed
+                        measuring[executor.submit(measure_sample, dest)] = (key, lines)
+                        continue
+                    lines.extend(_estimate_lines(est[key]))
+                status.print(*lines)
+            else:
+                status.print(header)
+        if samples:
+            futures[executor.submit(encode_samples, samples)] = samples
+
+        for future in concurrent.futures.as_completed([*futures, *measuring]):
+            if future in measuring:
+                key, lines = measuring[future]
+                metrics = future.result()
+                utils.append_estimates(estimates_file, {'settings': key, **metrics})
+                est[key].update(metrics)
+                status.print(*lines, *_estimate_lines(est[key]))
+                continue
+            for result,(_, header, diff_settings, settings, dest) in zip(future.result(), futures[future]):
+                key = str(diff_settings)
+                if est.get(key, {}).get('rejected'):
+                    # Don't merge new estimates with the old ones
+                    utils.delete_estimates(estimates_file, key)
+                if 'rejected' in result:
+                    est_time, est_size = result['projection']
+                    record = utils.update_estimates(estimates_file, diff_settings,
+                                                    est_time, est_size, settings,
+                                                    rejected=result['rejected'])
+                    records[key] = est[key] = record
+                    utils.update_manifest(samples_dir, key, job_hash(settings), 'rejected',
+                                          time=est_time, size=est_size)
+                    status.print(header, *_estimate_lines(record))
+                    continue
+                record, job_result = _store_result(result, samples_dir, estimates_file,
+                                                   diff_settings, settings, dest,
+                                                   job_hash(settings), total_secs,
+                                                   calibration=calibration, split=args.split,
+                                                   normalize_time=args.normalize_time,
+                                                   threads=threads, jobs=args.jobs,
+                                                   fan_out=args.fan_out)
+                records[record['settings']] = est[record['settings']] = record
+                to_cache(record, settings, dest, job_result)
+                lines = [header, *_estimate_lines(record)]
+                if result['metrics']:
+                    lines.append('                  Metrics: ' +
+                                 ' '.join(f'{k}={v}' for k,v in result['metrics'].items()))
+                status.print(*lines)
+        return records
+
+    try:
+        if args.search:
+            optimizer = search.CoordinateDescent(space, budget=args.search)
+            batch = optimizer.next_batch()
+            while batch:
+                records = encode_batch(enumerate(batch, start=optimizer.tried + 1), args.search)
+                for diff_settings in batch:
+                    record = records.get(utils.settings2str(diff_settings, escape=False))
+                    optimizer.report(diff_settings, search.score(record, args.objective, args.metric,
+                                                                 max_size=args.max_size,
+                                                                 max_time=args.max_time))
+                batch = optimizer.next_batch()
+        else:
+            if args.order == 'spread':
+                ordered = search.spread(unique)
+            elif args.order == 'random':
+                # The same samples directory always gets the same order
+                ordered = list(unique)
+                random.Random(samples_dir).shuffle(ordered)
+            else:
+                ordered = unique
+            encode_batch(enumerate(ordered, start=1), unique_count)
+    except BaseException as e:
+        # Stop all encodes and remove their incomplete output
+        for future in [*futures, *measuring]:
+            future.cancel()
+        ffmpeg.terminate()
+        executor.shutdown(wait=True)
+        status.close()
+        print()
+        utils.cleanup(*unfinished)
+        if isinstance(e, KeyboardInterrupt):
+            utils.croak('Aborted')
+        raise
     else:
+        executor.shutdown(wait=True)
+        status.close()
+        if args.search and not args.dry_run:
+            if optimizer.best is None:
+                print(f'No sample met the requirements after {optimizer.tried} samples')
+            else:
+                print(f'Best settings after {optimizer.tried} samples: '
+                      f'{utils.settings2str(optimizer.best, escape=False)}')
+        if args.spool and not args.dry_run:
+            cmd = [__name__, 'worker', args.spool]
+            print(f'To encode spooled samples run this on any number of machines:\n{utils.cmd2str(cmd)}')
         if not args.dry_run:
+            utils.compact_estimates(estimates_file)
             cmd = [__name__, 'compare', samples_dir]
             print(f'To compare settings visually run:\n{utils.cmd2str(cmd)}')
             if utils.dialog_yesno('Do you want to compare samples now?'):
                 utils.compare_samples(samples_dir)
 
 
+# Seconds between looking for new samples in the spool directory
+SPOOL_POLL_INTERVAL = 5
+
+def _worker(args):
+    worker = spool.worker_id()
+    status = utils.StatusLine()
+    calibration_lock = threading.Lock()
+    stop = threading.Event()
+    print(f'Worker {worker} is encoding samples from {args.spool}')
+
+    def calibration():
+        with calibration_lock:
+            return ffmpeg.calibration(topic='Calibrating CPU time')
+
+    def encode(job):
+        # Encode sample and store its estimates; return whether that worked
+        samples_dir, dest, excerpts = job['samples_dir'], job['dest'], job['excerpts']
+        diff_settings = utils.Settings(job['diff_settings'])
+        settings = utils.Settings(job['settings'])
+        topic = f'{os.path.basename(samples_dir)}: {diff_settings}'
+        encoders = args.jobs * len(excerpts)
+        threads = max(1, utils.cpu_count() // encoders) if encoders > 1 else None
+        utils.update_manifest(samples_dir, str(diff_settings), job['hash'], 'running')
+        status.update(topic, 'Starting')
+        def progress(string):
+            status.update(topic, string)
+        load = os.getloadavg()[0]
+        unfinished = {dest}
+        try:
+            if len(excerpts) > 1:
+                result = _encode_ranges(excerpts, job['chunks_dir'], dest, settings, unfinished,
+                                        vf=job['vf'], threads=threads, progress=progress)
+            else:
+                result = ffmpeg.encode(excerpts[0], dest, settings, vf=job['vf'],
+                                       threads=threads, progress=progress)
+            unfinished.discard(dest)
+            result['load'] = (load + os.getloadavg()[0]) / 2
+            if result['duration'] is None:
+                result['duration'] = ffmpeg.duration(dest)
+            result['metrics'] = {}
+            if job['metrics']:
+                result['metrics'] = ffmpeg.metrics(dest, job['excerpt'], vf=job['vf'], progress=progress)
+        except BaseException as e:
+            utils.update_manifest(samples_dir, str(diff_settings), job['hash'], 'failed')
+            utils.cleanup(*unfinished)
+            if isinstance(e, SystemExit):
+                # ffmpeg failed and the reason was printed
+                status.print(f'{topic}: Failed')
+                return False
+            raise
+        finally:
+            status.remove(topic)
+
+        if job['replace']:
+            utils.delete_estimates(job['estimates_file'], str(diff_settings))
+        needs_calibration = job['normalize_time'] or _uses_cpu_time(job['split'], args.jobs)
+        record, _ = _store_result(result, samples_dir, job['estimates_file'], diff_settings,
+                                  settings, dest, job['hash'], job['total_secs'],
+                                  calibration=calibration() if needs_calibration else None,
+                                  split=job['split'], normalize_time=job['normalize_time'],
+                                  threads=threads, jobs=args.jobs, fan_out=1, worker=worker)
+        lines = [topic, *_estimate_lines(record)]
+        if result['metrics']:
+            lines.append('                  Metrics: ' +
+                         ' '.join(f'{k}={v}' for k,v in result['metrics'].items()))
+        status.print(*lines)
+        return True
+
+    def work():
+        # Encode samples until there are none left or, with --wait, forever
+        while not stop.is_set():
+            claim = spool.claim(args.spool, worker, args.lease)
+            if claim is None:
+                # Samples of other workers may come back if they die
+                if not args.wait and spool.is_empty(args.spool):
+                    break
+                stop.wait(SPOOL_POLL_INTERVAL)
+                continue
+            claimed, job = claim
+            try:
+                with spool.Lease(claimed, args.lease):
+                    ok = encode(job)
+            except BaseException:
+                # Let other workers have the sample
+                spool.release(args.spool, claimed)
+                raise
+            spool.finish(args.spool, claimed, spool.DONE if ok else spool.FAILED)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs)
+    futures = [executor.submit(work) for _ in range(args.jobs)]
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    except BaseException as e:
+        # Stop all encodes; they remove their incomplete output
+        stop.set()
+        ffmpeg.terminate()
+        executor.shutdown(wait=True)
+        status.close()
+        print()
+        if isinstance(e, KeyboardInterrupt):
+            utils.croak('Aborted')
+        raise
+    else:
+        executor.shutdown(wait=True)
+        status.close()
+        print('No samples left')
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _serve(args):
+    server.serve(args.socket, cores=args.cores, memory=args.memory)
+
+def _submit(args):
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        utils.croak('Missing command')
+    job_args = _argparser().parse_args(command)
+    if getattr(job_args, 'func', None) not in (_samples, _metrics, _bframes):
+        utils.croak(f'Only these commands can be submitted: {", ".join(server.COMMANDS)}')
+    source = os.path.abspath(job_args.source) if job_args.source else None
+    returncode = server.submit(command, args.socket, cores=args.cores, memory=args.memory,
+                               source=source, follow=not args.detach)
+    if returncode:
+        sys.exit(returncode)
+
+def _status(args):
+    if args.cancel is not None:
+        server.cancel(args.cancel, args.socket)
+    elif args.attach is not None:
+        returncode = server.attach(args.attach, args.socket)
+        if returncode:
+            sys.exit(returncode)
+    else:
+        server.status(args.socket)
+
+
 def _compare(args):
-    utils.compare_samples(args.samples,
-                          debug=args.debug,
-                          playlist_size=args.playlist_size,
-                          font_size=args.font_size,
-                          estimates_file=args.estimates_file)
+    if args.proxies:
+        stop = threading.Event()
+        builder = threading.Thread(target=_build_proxies, args=(args.samples, args.jobs, stop))
+        builder.start()
+    try:
+        utils.compare_samples(args.samples,
+                              debug=args.debug,
+                              playlist_size=args.playlist_size,
+                              font_size=args.font_size,
+                              estimates_file=args.estimates_file,
+                              scheduler=args.scheduler,
+                              seed_by=args.seed_by,
+                              proxies=args.proxies)
+    finally:
+        if args.proxies:
+            stop.set()
+            ffmpeg.terminate()
+            builder.join()
+
+# Seconds between looking for samples that need a proxy
+PROXY_RESCAN_INTERVAL = 2
+
+def _proxy_jobs(samples_dir):
+    # Return (source, proxy) pairs of the original and samples without an
+    # up-to-date proxy, original first because every sample is compared to
+    # it, and remove proxies of deleted samples. A lossless original is
+    # intra-only already.
+    proxies_dir = os.path.join(samples_dir, utils.PROXIES_DIR)
+    os.makedirs(proxies_dir, exist_ok=True)
+    names = [name for name in os.listdir(samples_dir)
+             if re.search(r'\.(?:sample|original)@.+\.mkv$', name)]
+    for name in os.listdir(proxies_dir):
+        if name not in names:
+            _remove(os.path.join(proxies_dir, name))
+    jobs = []
+    for name in sorted(names, key=lambda name: ('.original@' not in name, name)):
+        source = os.path.join(samples_dir, name)
+        dest = os.path.join(proxies_dir, name)
+        if '.original@' in name and ffmpeg.is_lossless(source):
+            continue
+        try:
+            if os.path.getmtime(dest) >= os.path.getmtime(source):
+                continue
+        except OSError:
+            pass
+        jobs.append((source, dest))
+    return jobs
+
+def _build_proxies(samples_dir, jobs, stop):
+    # Build proxies until `stop` is set, including proxies of samples that
+    # are added while they are compared. A failed proxy (e.g. of a sample that
+    # was deleted meanwhile) doesn't stop the others; its sample is skipped
+    # until it changes.
+    failed = set()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    try:
+        while not stop.is_set():
+            todo = [job for job in _proxy_jobs(samples_dir) if _proxy_key(job) not in failed]
+            if todo:
+                print(f'Building {len(todo)} preview proxies in the background')
+            futures = {executor.submit(ffmpeg.proxy, *job): job for job in todo}
+            for future in concurrent.futures.as_completed(futures):
+                job = futures[future]
+                try:
+                    future.result()
+                except KeyboardInterrupt:
+                    # ffmpeg.terminate() was called because mpv quit
+                    for future in futures:
+                        future.cancel()
+                    return
+                except (Exception, SystemExit) as e:
+                    # ffmpeg errors are reported before SystemExit is raised
+                    if not isinstance(e, SystemExit):
+                        utils.error(e)
+                    utils.error(f'Unable to build proxy of {job[0]}')
+                    failed.add(_proxy_key(job))
+            stop.wait(PROXY_RESCAN_INTERVAL)
+    finally:
+        executor.shutdown(wait=True)
+
+def _proxy_key(job):
+    # Identify a failed proxy job until its source changes
+    source, _ = job
+    try:
+        return source, os.path.getmtime(source)
+    except OSError:
+        return source, None
+
+
+def _parallel(jobs, func, items):
+    # Call `func` for each item in `jobs` threads and yield (item, result)
+    # tuples as they are available. If anything goes wrong, pending calls are
+    # cancelled and all running ffmpeg processes are killed.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    futures = {executor.submit(func, item): item for item in items}
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.result()
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        ffmpeg.terminate()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+
+def _metrics(args):
+    estimates_file = os.path.join(args.samples, args.estimates_file)
+    est = utils.read_estimates(estimates_file)
+    original = utils.find_original(args.samples)
+    if original is None:
+        utils.croak(f'Unable to find original in {args.samples}')
+    # Filters are already applied to a lossless excerpt
+    vf = None if ffmpeg.is_lossless(original) else args.vf
+    paths = utils.sample_paths(args.samples, est)
+    if not paths:
+        utils.croak(f'No samples with estimates found in {args.samples}')
+
+    todo = [key for key in paths
+            if args.overwrite or not all(m in est[key] for m in ('ssim', 'psnr'))]
+    if args.dry_run:
+        for key in todo:
+            print(f'Comparing {key}')
+        return
+    status = utils.StatusLine()
+    def compare(key):
+        try:
+            return ffmpeg.metrics(paths[key], original, vf=vf,
+                                  progress=lambda string: status.update(key, string))
+        finally:
+            status.remove(key)
+    try:
+        for i,(key,result) in enumerate(_parallel(args.jobs, compare, todo), start=1):
+            utils.append_estimates(estimates_file, {'settings': key, **result})
+            est[key].update(result)
+            status.print(f'Compared {i}/{len(todo)}: {key}: ' +
+                         ' '.join(f'{k}={v}' for k,v in result.items()))
+    except KeyboardInterrupt:
+        status.close()
+        utils.croak('\nAborted')
+    status.close()
+    utils.compact_estimates(estimates_file)
+
+    records = {key: est[key] for key in paths}
+    front = utils.pareto_front(records, maximize=(args.metric,), minimize=('size', 'time'))
+    key_width = max(len(key) for key in records)
+    ranked = sorted(records, key=lambda key: records[key].get(args.metric, 0), reverse=True)
+    for key in ranked:
+        record = records[key]
+        metrics = ' '.join(f'{m}={record[m]:.4f}' for m in ffmpeg.METRICS if m in record)
+        print(f'{"*" if key in front else " "} {key.ljust(key_width)}  '
+              f'{record["time_str"]}  {record["size_str"]}  {metrics}')
+
+    if args.prune:
+        # Samples without the metric aren't dominated by anything
+        dominated = [key for key in records
+                     if key not in front and args.metric in records[key]]
+        if not dominated:
+            print('All samples are on the Pareto front')
+        elif utils.dialog_yesno(f'Delete {len(dominated)} samples that are not on the Pareto front?'):
+            _prune(args.samples, estimates_file, {key: paths[key] for key in dominated})
+
 
+def _prune(samples_dir, estimates_file, paths):
+    # Delete samples in `paths` and their estimates and keep "samples" from
+    # encoding them again
+    manifest = utils.read_manifest(samples_dir)
+    utils.cleanup(*paths.values())
+    for key in paths:
+        # Samples from before there was a manifest have no hash
+        utils.update_manifest(samples_dir, key, manifest.get(key, {}).get('hash'), 'pruned')
+    utils.delete_estimates(estimates_file, *paths)
+    utils.compact_estimates(estimates_file)
+
+
+def _estimates(args):
+    estimates_file = os.path.join(args.samples, args.estimates_file)
+    est = utils.compact_estimates(estimates_file)
+    if not est:
+        utils.croak(f'No estimates found: {estimates_file}')
+    key_width = max(len(k) for k in est)
+    for key,record in sorted(est.items(), key=lambda item: item[1]['size']):
+        print(f'{key.ljust(key_width)}  {record["time_str"]}  {record["size_str"]}'
+              f'{"  (rejected)" if record.get("rejected") else ""}')
+
+
+REPORT_FIELDS = ('size', 'time', 'kbps', 'qp', 'frames_B', 'mb_P_skip', 'mb_B_skip', 'ssim')
+
+def _report(args):
+    estimates_file = os.path.join(args.samples, args.estimates_file)
+    est = utils.read_estimates(estimates_file)
+    paths = utils.sample_paths(args.samples, est)
+    if not paths:
+        utils.croak(f'No samples with estimates found in {args.samples}')
+    rows = {}
+    for key,path in paths.items():
+        log = utils.logfile(path)
+        if 'x264' not in est[key] and os.path.exists(log):
+            est[key]['x264'] = ffmpeg.x264_stats(log)
+            utils.append_estimates(estimates_file, {'settings': key, 'x264': est[key]['x264']})
+        # x264's SSIM and PSNR don't replace our own
+        rows[key] = {(f'x264_{field}' if field in est[key] else field): value
+                     for field,value in est[key].get('x264', {}).items()}
+        rows[key].update(est[key])
+    utils.compact_estimates(estimates_file)
+
+    if args.list:
+        for field in sorted(set().union(*rows.values()) - {'x264', 'settings', 'all_settings'}):
+            print(field)
+        return
+
+    def fmt(field, value):
+        if value is None:
+            return '-'
+        elif field == 'size':
+            return utils.bytes2str(value).strip()
+        elif field in ('time', 'time_norm'):
+            return utils.duration2str(value)
+        elif isinstance(value, list):
+            return ','.join(f'{v:g}' for v in value)
+        elif isinstance(value, float):
+            return f'{value:.6g}'
+        else:
+            return str(value)
+
+    fields = [field.strip() for field in args.fields.split(',') if field.strip()]
+    # Samples without the field are always last
+    ranked = sorted((key for key in rows if rows[key].get(args.sort) is not None),
+                    key=lambda key: rows[key][args.sort], reverse=args.reverse)
+    ranked.extend(key for key in rows if rows[key].get(args.sort) is None)
+    table = [['settings', *fields]]
+    for key in ranked:
+        table.append([key, *(fmt(field, rows[key].get(field)) for field in fields)])
+    widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+    for row in table:
+        print('  '.join([row[0].ljust(widths[0]),
+                         *(cell.rjust(width) for cell,width in zip(row[1:], widths[1:]))]))
 
 def _bframes(args):
     title = utils.title(args.source)
-    bframes_dir = os.path.join('.', f'bframes:{title}@{"-".join(args.range)}')
-    settings = {**utils.parse_settings(args.x264_settings),
-                **{# These settings shouldn't change the consecutive bframes
-                   # percentages, but they make the test encode faster.
-                    'crf': '51',
-                    'trellis': '0',
-                    'ref': '1',
-                    'aq-mode': '0',
-                    'partitions': 'none',
-                    'weightp': '0',
-                    'no-mixed-refs': None,
-                    'no-deblock': None,
-                    'no-cabac': None,
-                    'no-8x8dct': None,
-                    'no-scenecut': None},
-                **{'bframes': args.bframes, 'b-adapt': args.b_adapt}}
-    dest = os.path.join(bframes_dir,
-                        (f'{title}.bframes@{"-".join(args.range)}.'
-                         f'{utils.settings2str(settings, escape=False)}'
-                         f'.mkv'))
-    print(f'Finding consecutive B-frames with these settings:')
-    print(utils.settings2str(settings, escape=False))
+    if args.whole:
+        ranges = _whole_ranges(ffmpeg.duration(args.source), args.chunk_duration)
+        range_str = f'whole-{args.chunk_duration}'
+    else:
+        ranges, range_str = _ranges(args)
+    bframes_dir = os.path.join('.', f'bframes:{title}@{range_str}')
+    base_settings = {**utils.parse_settings(args.x264_settings),
+                     **{# These settings shouldn't change the consecutive bframes
+                        # percentages, but they make the test encode faster.
+                        'crf': '51',
+                        'trellis': '0',
+                        'ref': '1',
+                        'aq-mode': '0',
+                        'partitions': 'none',
+                        'weightp': '0',
+                        'no-mixed-refs': None,
+                        'no-deblock': None,
+                        'no-cabac': None,
+                        'no-8x8dct': None,
+                        'no-scenecut': None}}
+    # Each range is decoded once for all combinations of --bframes and --b-adapt
+    diff_settings_list = list(utils.iter_sample_settings(
+        f'bframes={args.bframes}:b-adapt={args.b_adapt}'))
+    settings_list = [utils.Settings(utils.combine_dicts(base_settings, diff_settings))
+                     for diff_settings in diff_settings_list]
+    def dest(settings, start, stop):
+        return os.path.join(bframes_dir, f'{title}.bframes@{start}-{stop}.{settings}.mkv')
+
+    print(f'Finding consecutive B-frames in {len(ranges)} ranges with these settings:')
+    print(utils.settings2str(base_settings, escape=False))
+    print(utils.settings2str(diff_settings_list, escape=False))
+    if args.dry_run:
+        return
+
+    utils.mkdir(bframes_dir)
+    threads = None
+    if args.jobs * len(settings_list) > 1:
+        threads = max(1, utils.cpu_count() // (args.jobs * len(settings_list)))
+    status = utils.StatusLine()
+    def encode(range_):
+        start, stop = range_
+        dests = [dest(settings, start, stop) for settings in settings_list]
+        if args.overwrite or not all(os.path.exists(d) for d in dests):
+            topic = f'Range {start} - {stop}'
+            try:
+                ffmpeg.encode_many(args.source, dests, settings_list, vf=args.vf,
+                                   start=start, stop=stop, threads=threads,
+                                   progress=lambda string: status.update(topic, string))
+            finally:
+                status.remove(topic)
+        # Every log was written completely if its encode was renamed
+        return [ffmpeg.bframes(utils.logfile(d)) for d in dests]
+
+    # Frame-weighted sum of percentages for each settings
+    totals = [([], 0) for _ in settings_list]
     try:
-        if not args.dry_run:
-            utils.mkdir(bframes_dir)
-            if args.overwrite or not os.path.exists(utils.logfile(dest)):
-                ffmpeg.encode(args.source, dest, settings, vf=args.vf,
-                              start=args.range[0], stop=args.range[1])
+        for i,(_,results) in enumerate(_parallel(args.jobs, encode, ranges), start=1):
+            status.print(f'Analyzed {i}/{len(ranges)} ranges')
+            for j,(percs,frames) in enumerate(results):
+                sums, total_frames = totals[j]
+                sums.extend([0] * (len(percs) - len(sums)))
+                for k,perc in enumerate(percs):
+                    sums[k] += perc * frames
+                totals[j] = (sums, total_frames + frames)
     except KeyboardInterrupt:
-        print('\n')
-        utils.cleanup(dest)
-        utils.croak('Aborted')
-    else:
-        if not args.dry_run:
-            bframes = ffmpeg.bframes(utils.logfile(dest))
-            lines = [' '.join(f' {i:2d}  ' for i in range(17))]
-            values = []
-            for perc in bframes:
-                values.append(f'{perc:4.1f}%')
-            lines.append(' '.join(values))
-            lines.append(utils.wrap('For each possible number of consecutive B-frames, '
-                                    'show how many frames (in percent) are in such a '
-                                    'sequence of B-frames.', width=100))
-            for line in lines:
-                print(line)
-            with open(os.path.join(bframes_dir, 'bframes'), 'w') as f:
-                for line in lines:
-                    print(line, file=f)
+        status.close()
+        utils.croak('\nAborted')
+    status.close()
+
+    lines = []
+    for diff_settings,(sums,frames) in zip(diff_settings_list, totals):
+        lines.append(f'{diff_settings}:')
+        lines.append(' '.join(f' {i:2d}  ' for i in range(len(sums))))
+        lines.append(' '.join(f'{perc / max(frames, 1):4.1f}%' for perc in sums))
+        lines.append('')
+    lines.append(utils.wrap('For each possible number of consecutive B-frames, '
+                            'show how many frames (in percent) are in such a '
+                            'sequence of B-frames.', width=100))
+    for line in lines:
+        print(line)
+    with open(os.path.join(bframes_dir, 'bframes'), 'w') as f:
+        for line in lines:
+            print(line, file=f)
@@ -0,0 +1,157 @@
+import random
+import operator
+
+OBJECTIVES = ('quality-per-byte', 'quality', 'size')
+
+def score(record, objective, metric, max_size=None, max_time=None):
+    # Return how good a sample is (higher is better) or None if it doesn't
+    # meet the budgets or the required metric is missing
+    if record is None or record.get('rejected'):
+        return None
+    elif max_size is not None and record['size'] > max_size:
+        return None
+    elif max_time is not None and record['time'] > max_time:
+        return None
+    elif objective == 'size':
+        return -record['size']
+    quality = record.get(metric)
+    if quality is None:
+        return None
+    elif objective == 'quality':
+        return quality
+    else:
+        return quality / max(record['size'], 1)
+
+# Value of a flag that is not set
+ABSENT = object()
+
+class CoordinateDescent:
+    # Search for good settings by changing one setting at a time: For each
+    # setting, all of its values are tried while all other settings keep their
+    # best known values. The search starts with the middle value of each
+    # setting and stops when no setting can be improved anymore or when
+    # `budget` combinations were tried.
+    #
+    # `space` maps each setting to a list of values as returned by
+    # utils.parse_sample_settings(). A flag (value list [None]) is tried with
+    # and without.
+    def __init__(self, space, budget):
+        self._space = {k: ([ABSENT, None] if values == [None] else list(values))
+                       for k,values in space.items()}
+        self._keys = list(self._space)
+        self._current = {k: values[len(values) // 2] for k,values in self._space.items()}
+        self._scores = {}
+        self._budget = budget
+        self._key_index = 0
+        self._unchanged = 0
+        self.best = None
+        self.best_score = None
+
+    def _id(self, combination):
+        return tuple(combination[k] for k in self._keys)
+
+    def _combination(self, settings):
+        return {k: (settings[k] if k in settings else ABSENT) for k in self._keys}
+
+    @staticmethod
+    def _settings(combination):
+        return {k: v for k,v in combination.items() if v is not ABSENT}
+
+    @staticmethod
+    def _is_better(score, other):
+        return score is not None and (other is None or score > other)
+
+    @property
+    def tried(self):
+        return len(self._scores)
+
+    def _candidates(self):
+        key = self._keys[self._key_index]
+        return [{**self._current, key: value} for value in self._space[key]]
+
+    def next_batch(self):
+        # Return list of settings to try next; an empty list means we are done
+        while self._unchanged < len(self._keys):
+            candidates = self._candidates()
+            todo = [c for c in candidates if self._id(c) not in self._scores]
+            remaining = self._budget - self.tried
+            if todo and remaining > 0:
+                return [self._settings(c) for c in todo[:remaining]]
+
+            # Move on with the best value for this setting
+            tried = [c for c in candidates if self._id(c) in self._scores]
+            best = None
+            for c in tried:
+                if best is None or self._is_better(self._scores[self._id(c)],
+                                                   self._scores[self._id(best)]):
+                    best = c
+            current_score = self._scores.get(self._id(self._current))
+            if best is not None and self._is_better(self._scores[self._id(best)], current_score):
+                self._current = best
+                self._unchanged = 0
+            else:
+                self._unchanged += 1
+            self._key_index = (self._key_index + 1) % len(self._keys)
+            if remaining <= 0:
+                break
+        return []
+
+    def report(self, settings, score):
+        combination = self._combination(settings)
+        self._scores[self._id(combination)] = score
+        if self._is_better(score, self.best_score):
+            self.best = self._settings(combination)
+            self.best_score = score
+
+
+ORDERS = ('grid', 'spread', 'random')
+
+# spread() compares this many random candidates for each of the first
+# SPREAD_SIZE settings; the rest keeps its order
+SPREAD_CANDIDATES = 64
+SPREAD_SIZE = 256
+
+def _distance(a, b):
+    return sum(map(operator.ne, a, b))
+
+def spread(settings_list):
+    # Return `settings_list` ordered so that each settings differ in as many
+    # values as possible from all settings before them (farthest-first
+    # traversal with Hamming distance), so the first few samples cover the
+    # whole grid. Large grids would take too long, so only some random
+    # candidates are considered for each position (Mitchell's best-candidate
+    # algorithm). The result is the same for the same `settings_list`.
+    settings_list = list(settings_list)
+    keys = sorted(set().union(*settings_list)) if settings_list else []
+    points = [tuple(settings.get(k, ABSENT) for k in keys) for settings in settings_list]
+    rng = random.Random(len(points))
+    remaining = list(range(len(points)))
+    chosen = []
+    # Distances only shrink, so a distance to the settings that were chosen
+    # when a candidate was last looked at is an upper bound: index -> (distance,
+    # number of chosen settings it was compared to)
+    bounds = {}
+    while remaining and len(chosen) < SPREAD_SIZE:
+        positions = rng.sample(range(len(remaining)), min(SPREAD_CANDIDATES, len(remaining)))
+        best = best_position = None
+        for position in sorted(positions, key=lambda position: remaining[position]):
+            i = remaining[position]
+            distance, compared = bounds.get(i, (len(keys), 0))
+            if best is not None and distance <= best:
+                continue
+            for j in chosen[compared:]:
+                distance = min(distance, _distance(points[i], points[j]))
+                compared += 1
+                if best is not None and distance <= best:
+                    # Can't be better than the best candidate
+                    break
+            bounds[i] = (distance, compared)
+            if best is None or distance > best:
+                best, best_position = distance, position
+        if chosen and best <= 1:
+            # Every settings differ from all others
+            break
+        chosen.append(remaining[best_position])
+        remaining[best_position] = remaining[-1]
+        remaining.pop()
+    return [settings_list[i] for i in chosen + sorted(remaining)]
@@ -0,0 +1,428 @@
+import os
+import sys
+import json
+import socket
+import socketserver
+import subprocess
+import threading
+import signal
+import codecs
+import collections
+import time
+
+from . import utils
+from . import cache
+from . import ffmpeg
+from . import __name__
+
+# Subcommands that can be submitted to the server
+COMMANDS = ('samples', 'metrics', 'bframes')
+
+# Bytes of output that are kept for each job and sent to clients that attach
+OUTPUT_SIZE = 2**20
+
+# Number of finished jobs that are still listed by "status"
+JOB_HISTORY = 100
+
+ACTIVE_STATES = ('queued', 'running')
+
+# Environment variable with the cores that a job is pinned to
+CPUS_ENV = f'{__name__.upper()}_CPUS'
+
+def socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, f'{__name__}.sock')
+    return os.path.join(cache.cache_dir(), f'{__name__}.sock')
+
+def total_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def _cpus():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+class _Job:
+    def __init__(self, id, argv, cwd, cores, memory):
+        self.id = id
+        self.argv = argv
+        self.cwd = cwd
+        self.cores = cores
+        self.memory = memory
+        self.state = 'queued'
+        self.cpus = ()
+        self.proc = None
+        self.cancelled = False
+        self.returncode = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # Only the last OUTPUT_SIZE bytes are kept; `output_start` is the
+        # number of chunks that were dropped
+        self.output = collections.deque()
+        self.output_start = 0
+        self.output_size = 0
+
+    def append_output(self, chunk):
+        self.output.append(chunk)
+        self.output_size += len(chunk)
+        while self.output_size > OUTPUT_SIZE and len(self.output) > 1:
+            self.output_size -= len(self.output.popleft())
+            self.output_start += 1
+
+    def status(self):
+        return {'id': self.id, 'state': self.state, 'argv': self.argv, 'cwd': self.cwd,
+                'cores': self.cores, 'memory': self.memory, 'returncode': self.returncode,
+                'submitted': self.submitted, 'started': self.started, 'finished': self.finished}
+
+
+class _Queue:
+    # Jobs run as child processes as soon as enough cores and memory are free.
+    # Jobs start in the order they were submitted, so a big job isn't
+    # overtaken forever by smaller ones. Each job is pinned to its own cores
+    # (if the OS supports it), which makes txs split them evenly between its
+    # encoders.
+    def __init__(self, cpus, memory):
+        self.cpus = tuple(cpus)
+        self.memory = memory
+        self._free_cpus = set(cpus)
+        self._free_memory = memory
+        self._jobs = collections.OrderedDict()
+        self._next_id = 1
+        self._stopping = False
+        self._cond = threading.Condition()
+
+    def _get(self, id):
+        try:
+            return self._jobs[id]
+        except KeyError:
+            raise ValueError(f'No such job: {id}')
+
+    def submit(self, argv, cwd, cores=None, memory=0, source=None):
+        if not any(arg in COMMANDS for arg in argv):
+            raise ValueError(f'Only these commands can be submitted: {", ".join(COMMANDS)}')
+        cores = min(cores or len(self.cpus), len(self.cpus))
+        if self.memory is not None and memory > self.memory:
+            raise ValueError(f'Job needs more memory than the server may use: '
+                             f'{utils.bytes2str(memory).strip()} > {utils.bytes2str(self.memory).strip()}')
+        if source is not None:
+            # Probe while the job is waiting for cores so it finds the result
+            # in the cache
+            threading.Thread(target=_probe, args=(source,), daemon=True).start()
+        with self._cond:
+            job = _Job(self._next_id, argv, cwd, cores, memory)
+            self._next_id += 1
+            self._jobs[job.id] = job
+            print(f'Job {job.id} queued: {utils.cmd2str(argv)}', flush=True)
+            self._start_jobs()
+            return job.id
+
+    def _start_jobs(self):
+        if self._stopping:
+            return
+        for job in list(self._jobs.values()):
+            if job.state != 'queued':
+                continue
+            elif job.cores > len(self._free_cpus):
+                break
+            elif self._free_memory is not None and job.memory > self._free_memory:
+                break
+            job.cpus = sorted(self._free_cpus)[:job.cores]
+            self._free_cpus.difference_update(job.cpus)
+            if self._free_memory is not None:
+                self._free_memory -= job.memory
+            job.state = 'running'
+            job.started = time.time()
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        self._forget_jobs()
+
+    def _forget_jobs(self):
+        finished = [job for job in self._jobs.values() if job.state not in ACTIVE_STATES]
+        for job in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del self._jobs[job.id]
+
+    def _run(self, job):
+        # preexec_fn isn't safe in a process with threads, so the job pins
+        # itself (see pin())
+        cmd = [sys.executable, '-m', __name__, *job.argv]
+        env = dict(os.environ, **{CPUS_ENV: ','.join(str(cpu) for cpu in job.cpus)})
+        print(f'Job {job.id} started on {len(job.cpus)} cores', flush=True)
+        try:
+            proc = subprocess.Popen(cmd, cwd=job.cwd, env=env,
+                                    stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    # Ctrl-c in the server's terminal is
+                                    # passed on by stop()
+                                    start_new_session=True)
+        except OSError as e:
+            with self._cond:
+                job.append_output(f'{cmd[0]}: {os.strerror(e.errno)}\n')
+            returncode = 1
+        else:
+            with self._cond:
+                job.proc = proc
+                if job.cancelled:
+                    proc.send_signal(signal.SIGINT)
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            while True:
+                chunk = os.read(job.proc.stdout.fileno(), 4096)
+                text = decoder.decode(chunk, final=not chunk)
+                with self._cond:
+                    if text:
+                        job.append_output(text)
+                    self._cond.notify_all()
+                if not chunk:
+                    break
+            job.proc.stdout.close()
+            returncode = job.proc.wait()
+
+        with self._cond:
+            job.returncode = returncode
+            job.finished = time.time()
+            if job.cancelled:
+                job.state = 'cancelled'
+            else:
+                job.state = 'finished' if returncode == 0 else 'failed'
+            self._free_cpus.update(job.cpus)
+            if self._free_memory is not None:
+                self._free_memory += job.memory
+            print(f'Job {job.id} {job.state} after {utils.timestamp(job.finished - job.started)}',
+                  flush=True)
+            self._start_jobs()
+            self._cond.notify_all()
+
+    def attach(self, id, send):
+        # Pass output of job `id` to `send` as it is produced and return its
+        # exit code
+        with self._cond:
+            job = self._get(id)
+            index = job.output_start
+        while True:
+            with self._cond:
+                while (index >= job.output_start + len(job.output) and
+                       job.state in ACTIVE_STATES):
+                    self._cond.wait()
+                index = max(index, job.output_start)
+                chunks = list(job.output)[index - job.output_start:]
+                index += len(chunks)
+                done = job.state not in ACTIVE_STATES
+            if chunks:
+                send({'output': ''.join(chunks)})
+            elif done:
+                return job.returncode
+
+    def cancel(self, id):
+        with self._cond:
+            job = self._get(id)
+            if job.state == 'queued':
+                job.state = 'cancelled'
+                job.finished = time.time()
+                print(f'Job {job.id} cancelled', flush=True)
+                self._start_jobs()
+                self._cond.notify_all()
+            elif job.state == 'running' and not job.cancelled:
+                # txs cleans up after Ctrl-c; if the process isn't started
+                # yet, _run() sends the signal
+                job.cancelled = True
+                if job.proc is not None:
+                    job.proc.send_signal(signal.SIGINT)
+
+    def status(self):
+        with self._cond:
+            return {'cores': len(self.cpus), 'free_cores': len(self._free_cpus),
+                    'memory': self.memory, 'free_memory': self._free_memory,
+                    'jobs': [job.status() for job in self._jobs.values()]}
+
+    def stop(self):
+        # Cancel all jobs and wait for running jobs to finish
+        with self._cond:
+            self._stopping = True
+            for job in list(self._jobs.values()):
+                if job.state in ACTIVE_STATES:
+                    self.cancel(job.id)
+            while any(job.state == 'running' for job in self._jobs.values()):
+                self._cond.wait()
+
+def _probe(source):
+    try:
+        ffmpeg.duration(source)
+    except (Exception, SystemExit):
+        # The job reports the error
+        pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # Each connection sends one JSON request and gets one or more JSON
+    # responses, one per line
+    def handle(self):
+        queue = self.server.queue
+
+        def send(response):
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+        line = self.rfile.readline()
+        if not line:
+            # Connected only to see if the server is running
+            return
+        try:
+            request = json.loads(line.decode('utf-8'))
+            if 'submit' in request:
+                id = queue.submit(**request['submit'])
+                send({'job': id})
+                if request.get('follow'):
+                    send({'exit': queue.attach(id, send)})
+            elif 'attach' in request:
+                send({'exit': queue.attach(request['attach'], send)})
+            elif 'cancel' in request:
+                queue.cancel(request['cancel'])
+                send({'job': request['cancel']})
+            elif 'status' in request:
+                send(queue.status())
+            else:
+                send({'error': f'Invalid request: {request}'})
+        except (ValueError, TypeError) as e:
+            try:
+                send({'error': str(e)})
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        except (BrokenPipeError, ConnectionResetError):
+            # Client detached
+            pass
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+def _is_running(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        return False
+    else:
+        return True
+    finally:
+        sock.close()
+
+def pin():
+    # Pin this process and its children to the cores that the server assigned
+    # to it
+    cpus = os.environ.pop(CPUS_ENV, None)
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, [int(cpu) for cpu in cpus.split(',')])
+
+def serve(path=None, cores=None, memory=None):
+    path = path or socket_path()
+    cpus = _cpus()[:cores]
+    if memory is None:
+        memory = total_memory()
+    if os.path.exists(path):
+        if _is_running(path):
+            utils.croak(f'Server is already listening on {path}')
+        os.remove(path)
+
+    # Anyone who can connect can run commands as us
+    umask = os.umask(0o177)
+    try:
+        server = _Server(path, _Handler)
+    except OSError as e:
+        utils.croak(f'Unable to listen on {path}: {os.strerror(e.errno)}')
+    finally:
+        os.umask(umask)
+    server.queue = _Queue(cpus, memory)
+    memory_str = utils.bytes2str(memory).strip() if memory is not None else 'unlimited'
+    print(f'Listening on {path} with {len(cpus)} cores and {memory_str} memory', flush=True)
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('Stopping all jobs', flush=True)
+        server.queue.stop()
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+def _request(path, request):
+    # Send `request` to the server and yield its responses
+    path = path or socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError as e:
+        utils.croak(f'Unable to connect to {path}: {os.strerror(e.errno)}\n'
+                    f'Is "{__name__} serve" running?')
+    with sock, sock.makefile('rwb') as f:
+        f.write(json.dumps(request).encode('utf-8') + b'\n')
+        f.flush()
+        for line in f:
+            response = json.loads(line.decode('utf-8'))
+            if 'error' in response:
+                utils.croak(response['error'])
+            yield response
+
+def _follow(id, responses):
+    # Print output of job `id` and return its exit code or None if the user
+    # detached with Ctrl-c
+    try:
+        for response in responses:
+            if 'output' in response:
+                sys.stdout.write(response['output'])
+                sys.stdout.flush()
+            elif 'exit' in response:
+                return response['exit']
+    except KeyboardInterrupt:
+        print(f'\nDetached from job {id}; it keeps running')
+
+def submit(argv, path=None, cores=None, memory=0, source=None, follow=True):
+    # Run txs with `argv` on the server and return its exit code if `follow`
+    # is true
+    request = {'submit': {'argv': argv, 'cwd': os.getcwd(), 'cores': cores,
+                          'memory': memory, 'source': source},
+               'follow': follow}
+    responses = _request(path, request)
+    id = next(responses)['job']
+    if follow:
+        return _follow(id, responses)
+    print(f'Submitted job {id}')
+
+def attach(id, path=None):
+    return _follow(id, _request(path, {'attach': id}))
+
+def cancel(id, path=None):
+    for response in _request(path, {'cancel': id}):
+        print(f'Cancelled job {response["job"]}')
+
+def status(path=None):
+    for response in _request(path, {'status': None}):
+        def memory_str(memory):
+            return utils.bytes2str(memory).strip() if memory is not None else 'unlimited'
+        print(f'Cores: {response["free_cores"]} of {response["cores"]} free')
+        print(f'Memory: {memory_str(response["free_memory"])} of '
+              f'{memory_str(response["memory"])} free')
+        jobs = response['jobs']
+        if jobs:
+            print()
+            print(f'{"ID":>4}  {"STATE":<9}  {"CORES":>5}  {"MEMORY":>10}  {"TIME":>8}  COMMAND')
+        now = time.time()
+        for job in jobs:
+            if job['started'] is None:
+                secs = (job['finished'] or now) - job['submitted']
+            else:
+                secs = (job['finished'] or now) - job['started']
+            state = job['state']
+            if state == 'failed':
+                state = f'failed:{job["returncode"]}'
+            print(f'{job["id"]:>4}  {state:<9}  {job["cores"]:>5}  '
+                  f'{utils.bytes2str(job["memory"]):>10}  {utils.timestamp(secs):>8}  '
+                  f'{utils.cmd2str(job["argv"])}')
@@ -0,0 +1,146 @@
+import os
+import json
+import socket
+import threading
+
+from . import utils
+
+# A spool directory on a shared file system (e.g. NFS) distributes samples to
+# workers on any number of machines. Each sample is a JSON job file that moves
+# through these subdirectories:
+#
+#   queue/<name>                  Waiting for a worker
+#   claimed/<name>@<worker>       Being encoded by <worker>
+#   done/<name>, failed/<name>    Finished
+#
+# <name> is "<order>.<id>.job" where <order> is the position in the grid, so
+# workers encode samples in the same order as "txs samples", and <id>
+# identifies the sample.
+#
+# Jobs are claimed by renaming them, which only one worker can do. Workers
+# touch their claimed jobs regularly and any worker puts jobs back into the
+# queue if they weren't touched for longer than the lease (e.g. because the
+# machine died). All workers must use the same lease.
+QUEUE, CLAIMED, DONE, FAILED = 'queue', 'claimed', 'done', 'failed'
+
+# Default lease in seconds; NFS clients may see modification times that are
+# up to a minute old
+LEASE = 300
+
+def worker_id():
+    return f'{socket.gethostname()}.{os.getpid()}'
+
+def _mkdirs(spool_dir):
+    utils.mkdir(spool_dir)
+    for subdir in (QUEUE, CLAIMED, DONE, FAILED):
+        utils.mkdir(os.path.join(spool_dir, subdir))
+
+def _job_name(claimed_path):
+    return os.path.basename(claimed_path).rsplit('@', 1)[0]
+
+def spooled(spool_dir):
+    # Return IDs of jobs that are queued or claimed
+    _mkdirs(spool_dir)
+    names = [name for name in os.listdir(os.path.join(spool_dir, QUEUE)) if name.endswith('.job')]
+    names.extend(_job_name(name) for name in os.listdir(os.path.join(spool_dir, CLAIMED)))
+    return set(name.split('.')[1] for name in names)
+
+def put(spool_dir, order, id, job):
+    # Add job atomically, so workers never see a partial job file
+    name = f'{order:06d}.{id}.job'
+    path = os.path.join(spool_dir, QUEUE, name)
+    tmp_path = os.path.join(spool_dir, QUEUE, f'.{name}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+    os.rename(tmp_path, path)
+
+def _now(spool_dir):
+    # Current time of the file server, so the clocks of all machines don't
+    # have to agree
+    path = os.path.join(spool_dir, 'clock')
+    with open(path, 'a'):
+        pass
+    os.utime(path)
+    return os.stat(path).st_mtime
+
+def recover(spool_dir, lease=LEASE):
+    # Put jobs of workers that stopped touching them back into the queue
+    claimed_dir = os.path.join(spool_dir, CLAIMED)
+    now = _now(spool_dir)
+    for name in os.listdir(claimed_dir):
+        path = os.path.join(claimed_dir, name)
+        try:
+            expired = now - os.stat(path).st_mtime > lease
+            if expired:
+                os.rename(path, os.path.join(spool_dir, QUEUE, _job_name(path)))
+        except FileNotFoundError:
+            # Finished or recovered by another worker
+            continue
+        if expired:
+            print(f'Requeued {_job_name(path)} from {name.rsplit("@", 1)[1]}')
+
+def claim(spool_dir, worker, lease=LEASE):
+    # Return path and content of the first job in the queue, which is now
+    # owned by `worker`, or None if the queue is empty
+    _mkdirs(spool_dir)
+    recover(spool_dir, lease)
+    queue_dir = os.path.join(spool_dir, QUEUE)
+    for name in sorted(os.listdir(queue_dir)):
+        if not name.endswith('.job'):
+            continue
+        path = os.path.join(queue_dir, name)
+        claimed = os.path.join(spool_dir, CLAIMED, f'{name}@{worker}')
+        try:
+            # Renaming keeps the modification time, so the lease must start
+            # before anyone can see the job in claimed/
+            os.utime(path)
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            # Claimed by another worker
+            continue
+        with open(claimed, 'r') as f:
+            return claimed, json.load(f)
+
+def is_empty(spool_dir):
+    # Whether no job is queued or claimed
+    return not spooled(spool_dir)
+
+def finish(spool_dir, claimed, state):
+    # Move claimed job to DONE or FAILED
+    try:
+        os.rename(claimed, os.path.join(spool_dir, state, _job_name(claimed)))
+    except FileNotFoundError:
+        # Our lease expired and another worker took over
+        pass
+
+def release(spool_dir, claimed):
+    # Put claimed job back into the queue
+    try:
+        os.rename(claimed, os.path.join(spool_dir, QUEUE, _job_name(claimed)))
+    except FileNotFoundError:
+        pass
+
+class Lease:
+    # Context manager that touches a claimed job regularly in a thread
+    def __init__(self, claimed, lease=LEASE):
+        self._claimed = claimed
+        self._interval = lease / 5
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew, daemon=True)
+
+    def _renew(self):
+        while not self._stop.wait(self._interval):
+            try:
+                os.utime(self._claimed)
+            except FileNotFoundError:
+                # Another worker took over; both encodes produce the same
+                # sample and estimates, so we can just finish
+                break
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
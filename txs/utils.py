@@ -3,12 +3,18 @@ import os
 import site
 import re
 import itertools
-from collections import abc, defaultdict
+from collections import abc
 import shlex
 import subprocess
 import textwrap
 import termios, tty
 import contextlib
+import threading
+import shutil
+import json
+import fcntl
+import hashlib
+import time
 
 from . import utils
 from . import __name__
@@ -31,6 +37,9 @@ def raw_mode_posix():
         termios.tcsetattr(sys.stdin.fileno(), termios.TCSADRAIN, attrs)
 
 def dialog_yesno(question):
+    if not sys.stdin.isatty():
+        # Nobody can answer (e.g. jobs of "txs serve")
+        return False
     answer = ''
     try:
         if os.name == 'posix':
@@ -55,11 +64,47 @@ def indent(amount, string):
 def cmd2str(cmd):
     return ' '.join(shlex.quote(arg) for arg in cmd)
 
-def duration2str(seconds):
+def duration2str(seconds, with_seconds=False):
     hours = int(seconds / 3600)
     mins = int((seconds - (hours * 3600)) / 60)
+    if with_seconds:
+        secs = int(seconds - (hours * 3600) - (mins * 60))
+        return f'{hours:02d}:{mins:02d}:{secs:02d}'
     return f'{hours:02d}:{mins:02d}'
 
+def cpu_count():
+    # Only count CPUs we are allowed to run on
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def timestamp(seconds, exact=False):
+    if exact:
+        # Keep milliseconds if there are any
+        secs, ms = divmod(round(seconds * 1000), 1000)
+        return f'{timestamp(secs)}.{ms:03d}' if ms else timestamp(secs)
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+def str2duration(string):
+    # "90", "1:30" and "0:01:30" are all 90 seconds
+    try:
+        secs = 0
+        for part in string.split(':'):
+            secs = secs * 60 + float(part)
+        return secs
+    except ValueError:
+        raise ValueError(f'Invalid duration: {string}')
+
+def str2bytes(string):
+    # "700M", "700 MiB" and "734003200" are all the same; prefixes are binary
+    match = re.search(r'^\s*([\d.]+)\s*([kmgt]?)i?b?\s*$', string, flags=re.IGNORECASE)
+    if not match:
+        raise ValueError(f'Invalid size: {string}')
+    number, prefix = match.groups()
+    return float(number) * 1024 ** ' kmgt'.index(prefix.lower() or ' ')
+
 def bytes2str(bytes):
     for size,unit in ((2**30, 'Gi'), (2**20, 'Mi'), (2**10, 'Ki')):
         if bytes >= size:
@@ -97,6 +142,94 @@ def mkdir(path):
     if not os.path.isdir(path):
         croak(f'Not a directory: {path}')
 
+class StatusLine:
+    # Single terminal line that shows the status of multiple concurrent jobs.
+    # Other output is printed above it.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._status = {}
+        self._width = 0
+
+    def _clear(self):
+        if self._width > 0:
+            print('\r' + ' '*self._width + '\r', end='')
+            self._width = 0
+
+    def _draw(self):
+        line = ' | '.join(f'{topic}: {status}' for topic,status in self._status.items())
+        max_width = shutil.get_terminal_size().columns - 1
+        if len(line) > max_width:
+            line = line[:max_width-1] + '…'
+        print('\r' + line.ljust(self._width), end='', flush=True)
+        self._width = len(line)
+
+    def update(self, topic, status):
+        with self._lock:
+            self._status[topic] = status
+            self._draw()
+
+    def remove(self, topic):
+        with self._lock:
+            self._status.pop(topic, None)
+            self._clear()
+            self._draw()
+
+    def print(self, *lines):
+        with self._lock:
+            self._clear()
+            for line in lines:
+                print(line)
+            self._draw()
+
+    def close(self):
+        with self._lock:
+            self._status.clear()
+            self._clear()
+
+def sample_filename(title, range_str, settings):
+    return f'{title}.sample@{range_str}.{settings2str(settings, escape=False)}.mkv'
+
+def original_filename(title, range_str):
+    return f'{title}.original@{range_str}.mkv'
+
+def find_original(samples_dir):
+    # Return path of the excerpt in `samples_dir` or None
+    for filename in sorted(os.listdir(samples_dir)):
+        if re.search(r'\.original@.+\.mkv$', filename):
+            return os.path.join(samples_dir, filename)
+
+def sample_paths(samples_dir, est):
+    # Map estimates keys to existing sample files
+    original = find_original(samples_dir)
+    if original is None:
+        return {}
+    title, range_str = re.search(r'^(.*)\.original@(.+)\.mkv$',
+                                 os.path.basename(original)).groups()
+    paths = {}
+    for key,record in est.items():
+        settings = parse_settings(record['all_settings'].replace('\\=', '='))
+        path = os.path.join(samples_dir, sample_filename(title, range_str, settings))
+        if os.path.exists(path):
+            paths[key] = path
+    return paths
+
+def pareto_front(records, maximize=(), minimize=()):
+    # Return keys of records that are not dominated by any other record, i.e.
+    # no other record is at least as good in every field and better in one
+    def better_or_equal(a, b):
+        return (all(a[f] >= b[f] for f in maximize) and
+                all(a[f] <= b[f] for f in minimize))
+    fields = tuple(maximize) + tuple(minimize)
+    candidates = {k: r for k,r in records.items() if all(f in r for f in fields)}
+    front = []
+    for key,record in candidates.items():
+        dominated = any(better_or_equal(other, record) and
+                        any(other[f] != record[f] for f in fields)
+                        for k,other in candidates.items() if k != key)
+        if not dominated:
+            front.append(key)
+    return front
+
 def cleanup(*filepaths):
     for filepath in filepaths:
         for f in (filepath, logfile(filepath)):
@@ -121,46 +254,112 @@ def parse_settings(*strings, default_value=None):
                 settings[key] = default_value
     return settings
 
-def generate_sample_settings(*strings):
-    # Parse each string as a list of settings
-    combinations = []
+def parse_sample_settings(string):
+    # Each setting can have multiple values separated by unescaped "/"
+    settings = parse_settings(string)
+    for k,v in settings.items():
+        if v is not None:
+            settings[k] = [v.replace('\\/', '/')
+                           for v in re.split(r'(?<!\\)/', v)]
+        else:
+            # Flags (e.g. no-deblock) have no value
+            settings[k] = [None]
+    return settings
+
+class Settings(abc.Mapping):
+    # Immutable, hashable settings that convert to strings only once. Samples
+    # need the same settings as a file name, an estimates key and for x264
+    # many times.
+    __slots__ = ('_dict', '_hash', '_str', '_escaped')
+
+    def __init__(self, settings=()):
+        self._dict = dict(settings)
+        self._hash = None
+        self._str = None
+        self._escaped = None
+
+    def __getitem__(self, key):
+        return self._dict[key]
+
+    def __iter__(self):
+        return iter(self._dict)
+
+    def __len__(self):
+        return len(self._dict)
+
+    # Mapping's views go through __getitem__, which is much slower
+    def keys(self):
+        return self._dict.keys()
+
+    def items(self):
+        return self._dict.items()
+
+    def values(self):
+        return self._dict.values()
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(frozenset(self._dict.items()))
+        return self._hash
+
+    def __str__(self):
+        if self._str is None:
+            self._str = settings2str(self._dict, escape=False)
+        return self._str
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self._dict!r})'
+
+    @property
+    def escaped(self):
+        if self._escaped is None:
+            self._escaped = settings2str(self._dict, escape=True)
+        return self._escaped
+
+def iter_sample_settings(*strings):
+    # Generate Settings for all combinations of all settings in each string
     for string in strings:
-        # Each setting can have multiple values separated by unescaped "/"
-        settings = parse_settings(string)
-        for k,v in settings.items():
-            if v is not None:
-                settings[k] = [v.replace('\\/', '/')
-                               for v in re.split(r'(?<!\\)/', v)]
-            else:
-                # Flags (e.g. no-deblock) have no value
-                settings[k] = [None]
-
-        # Create all combinations of all settings
-        # https://stackoverflow.com/a/5228294
-        keys = settings.keys()
-        value_lists = settings.values()
-        for values in itertools.product(*value_lists):
+        settings = parse_sample_settings(string)
+        keys = tuple(settings)
+        flags = [k for k,values in settings.items() if values == [None]]
+        for values in itertools.product(*settings.values()):
             d = dict(zip(keys, values))
-            # For each encountered flag (boolean setting), add another sample
-            # with that flag removed.
-            for k,v in tuple(d.items()):
-                if v is None:
-                    d2 = d.copy()
-                    d2.pop(k)
-                    combinations.append(d2)
-            combinations.append(d)
-    return combinations
+            # For each flag (boolean setting), add another sample with that
+            # flag removed.
+            for flag in flags:
+                yield Settings((k, v) for k,v in d.items() if k != flag)
+            yield Settings(d)
+
+def count_sample_settings(*strings):
+    # Same as len(generate_sample_settings(*strings)) without generating
+    # anything
+    count = 0
+    for string in strings:
+        settings = parse_sample_settings(string)
+        combinations = 1
+        for values in settings.values():
+            combinations *= len(values)
+        # Every flag has only one value
+        flags = sum(1 for values in settings.values() if values == [None])
+        count += combinations * (flags + 1)
+    return count
+
+def generate_sample_settings(*strings):
+    return list(iter_sample_settings(*strings))
 
 def sample_keys(sample_settings):
     # Same thing as set().union(), but preserve order.
-    keys = []
+    keys = {}
     for settings in sample_settings:
-        for key in settings.keys():
-            if key not in keys:
-                keys.append(key)
-    return keys
+        keys.update(zip(settings.keys(), itertools.repeat(None)))
+    return list(keys)
 
 def settings2str(settings, delimiter=':', escape=False, replace_in_values={':':','}):
+    # Settings cache their strings
+    if (isinstance(settings, Settings) and delimiter == ':'
+        and replace_in_values == {':':','}):
+        return settings.escaped if escape else str(settings)
+
     # Values that use ":" as a separator (e.g. deblock) can also use ",", which
     # makes the whole string easier to parse.
     def apply_riv(value):
@@ -177,35 +376,29 @@ def settings2str(settings, delimiter=':', escape=False, replace_in_values={':':'
             value = value.replace('=', '\\=')
         return value
 
-    if isinstance(settings, abc.Sequence):
-        # Group together settings with identical key sets and map each group to
-        # a tuple of the shared keys.
-        # Example: {('crf', 'bframes'): [{'crf': '22', 'bframes': '8'},
-        #                                {'crf': '22', 'bframes': '16'},
-        #                                {'crf': '21', 'bframes': '8'},
-        #                                {'crf': '21', 'bframes': '16'}],
-        #           ('b-adapt', 'bframes'): [{'b-adapt': '1', 'bframes': '3'},
-        #                                    {'b-adapt': '1', 'bframes': '6'},
-        #                                    {'b-adapt': '2', 'bframes': '3'},
-        #                                    {'b-adapt': '2', 'bframes': '6'}]}
-        groups = defaultdict(lambda: [])
+    if not isinstance(settings, abc.Mapping):
+        # Group together settings with identical key sets and map each key in
+        # each group to its values. Dicts are used as ordered sets.
+        # Example: {('crf', 'bframes'): {'crf': {'22': '22', '21': '21'},
+        #                                'bframes': {'8': '8', '16': '16'}},
+        #           ('b-adapt', 'bframes'): {'b-adapt': {'1': '1', '2': '2'},
+        #                                    'bframes': {'3': '3', '6': '6'}}}
+        groups = {}
         for settings in settings:
-            groups[tuple(settings.keys())].append(settings)
-        # For each group, map each key to a list of values.
-        strings = []
-        for keys,list_of_settings in groups.items():
-            value_lists = defaultdict(lambda: [])
-            for key in keys:
+            keys = tuple(settings.keys())
+            value_lists = groups.get(keys)
+            if value_lists is None:
+                value_lists = groups[keys] = {key: {} for key in keys}
+            for key,value in settings.items():
                 value_list = value_lists[key]
-                for settings in list_of_settings:
-                    value = settings[key]
-                    if value not in value_list:
-                        value = normalize_value(value)
-                        if value:
-                            value_list.append(value)
+                if value not in value_list:
+                    value_list[value] = normalize_value(value)
+        strings = []
+        for value_lists in groups.values():
             # Separate value with "/"
             parts = []
             for key,values in value_lists.items():
+                values = [v for v in dict.fromkeys(values.values()) if v]
                 if len(values) > 0:
                     parts.append(f'{key}=' + '/'.join(values))
                 else:
@@ -221,39 +414,180 @@ def settings2str(settings, delimiter=':', escape=False, replace_in_values={':':'
         for k,v in settings.items():
             value = normalize_value(v)
             if value:
-                parts.append(f'{k}={normalize_value(v)}')
+                parts.append(f'{k}={value}')
             else:
                 parts.append(f'{k}')
         return delimiter.join(parts)
 
-def read_estimates(estimates_file):
+# Estimates are appended to a journal as JSON objects, one per line, so
+# adding an estimate is cheap and a crash can only lose the line that is being
+# written. Records with the same "settings" are merged, later fields win. A
+# record with "deleted" set removes all previous records with the same
+# "settings". compact_estimates() merges the journal into the estimates file,
+# which has one line per sample:
+#
+#   <settings> / <time_str> / <time> / <size_str> / <size> / <all_settings>[ / <field>=<value> ...]
+#
+# txs-compare.lua reads both files and appends "deleted" records to the
+# journal, but it can't lock it.
+
+ESTIMATES_FIELDS = ('settings', 'time_str', 'time', 'size_str', 'size', 'all_settings')
+
+def estimates_journal(estimates_file):
+    return estimates_file + '.journal'
+
+@contextlib.contextmanager
+def _journal_lock(journal, exclusive):
+    if not exclusive and not os.path.exists(journal):
+        # Don't create the journal (or fail because the samples directory
+        # doesn't exist yet) just to read estimates
+        yield None
+        return
+    with open(journal, 'a+', errors='replace') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield f
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _estimates_lock(estimates_file, exclusive):
+    return _journal_lock(estimates_journal(estimates_file), exclusive)
+
+def _journal_records(journal):
+    journal.seek(0)
+    for line in journal:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Incomplete line from a crashed writer
+            continue
+
+def _append_journal(journal_file, records):
+    lines = ''.join(json.dumps(record) + '\n' for record in records)
+    with _journal_lock(journal_file, exclusive=True) as journal:
+        # Terminate incomplete line from a crashed writer
+        end = journal.seek(0, os.SEEK_END)
+        if end > 0:
+            journal.seek(end - 1)
+            if journal.read(1) != '\n':
+                lines = '\n' + lines
+        journal.write(lines)
+        journal.flush()
+        os.fsync(journal.fileno())
+
+def _parse_estimates_line(line):
+    parts = [part.strip() for part in line.split(' / ')]
+    if len(parts) < len(ESTIMATES_FIELDS):
+        return None
+    record = dict(zip(ESTIMATES_FIELDS, parts))
+    for field in ('time', 'size'):
+        try:
+            record[field] = int(record[field])
+        except ValueError:
+            pass
+    for part in parts[len(ESTIMATES_FIELDS):]:
+        if '=' in part:
+            k, v = part.split('=', maxsplit=1)
+            try:
+                record[k] = json.loads(v)
+            except ValueError:
+                record[k] = v
+    return record
+
+def _format_estimates_line(record, key_width=0):
+    parts = [str(record.get(field, '')) for field in ESTIMATES_FIELDS]
+    parts[0] = parts[0].ljust(key_width)
+    for k,v in record.items():
+        if k not in ESTIMATES_FIELDS:
+            parts.append(f'{k}={json.dumps(v, ensure_ascii=False)}')
+    return ' / '.join(parts)
+
+def _read_estimates(estimates_file, journal):
     est = {}
     if os.path.exists(estimates_file):
         with open(estimates_file, 'r') as f:
-            for line in f.readlines():
-                parts = [part.strip() for part in line.split('/')]
-                est[parts[0]] = {'settings'     : parts[0],
-                                 'time_str'     : parts[1],
-                                 'time'         : parts[2],
-                                 'size_str'     : parts[3],
-                                 'size'         : parts[4],
-                                 'all_settings' : parts[5]}
+            for line in f:
+                record = _parse_estimates_line(line)
+                if record is not None:
+                    est[record['settings']] = record
+    if journal is not None:
+        for record in _journal_records(journal):
+            key = record.get('settings')
+            if key is None:
+                continue
+            elif record.get('deleted'):
+                est.pop(key, None)
+            else:
+                est.setdefault(key, {}).update(record)
     return est
 
-def update_estimates(estimates_file, diff_settings, est_time, est_size, settings):
-    est = read_estimates(estimates_file)
-    diff_settings_str = utils.settings2str(diff_settings, escape=False)
-    est[diff_settings_str] = {'settings'     : diff_settings_str,
-                              'time_str'     : utils.duration2str(est_time),
-                              'time'         : int(est_time),
-                              'size_str'     : utils.bytes2str(est_size),
-                              'size'         : int(est_size),
-                              'all_settings' : utils.settings2str(settings, escape=True)}
-    max_key_width = max(len(k) for k in est)
-    with open(estimates_file, 'w') as f:
-        for key,values in est.items():
-            values = ' / '.join(str(v) for v in tuple(values.values())[1:])
-            f.write(f'{key.ljust(max_key_width)} / {values}\n')
+def read_estimates(estimates_file):
+    with _estimates_lock(estimates_file, exclusive=False) as journal:
+        return _read_estimates(estimates_file, journal)
+
+def append_estimates(estimates_file, *records):
+    _append_journal(estimates_journal(estimates_file), records)
+
+def delete_estimates(estimates_file, *keys):
+    append_estimates(estimates_file, *({'settings': key, 'deleted': True} for key in keys))
+
+def update_estimates(estimates_file, diff_settings, est_time, est_size, settings,
+                     time_err=None, size_err=None, time_norm=None, time_norm_err=None, **fields):
+    record = {'settings'     : utils.settings2str(diff_settings, escape=False),
+              'time_str'     : utils.duration2str(est_time),
+              'time'         : int(est_time),
+              'size_str'     : utils.bytes2str(est_size),
+              'size'         : int(est_size),
+              'all_settings' : utils.settings2str(settings, escape=True),
+              **fields}
+    # Estimates from multiple ranges come with their standard error
+    if time_err is not None:
+        record['time_str'] += f' ±{utils.duration2str(time_err, with_seconds=True)}'
+        record['time_err'] = int(time_err)
+    if size_err is not None:
+        record['size_str'] += f' ±{utils.bytes2str(size_err).strip()}'
+        record['size_err'] = int(size_err)
+    # Encoding time from CPU time, see ffmpeg.calibration()
+    if time_norm is not None:
+        record['time_norm_str'] = utils.duration2str(time_norm)
+        record['time_norm'] = int(time_norm)
+        if time_norm_err is not None:
+            record['time_norm_str'] += f' ±{utils.duration2str(time_norm_err, with_seconds=True)}'
+            record['time_norm_err'] = int(time_norm_err)
+    append_estimates(estimates_file, record)
+    return record
+
+def compact_estimates(estimates_file):
+    if not os.path.exists(estimates_journal(estimates_file)):
+        return read_estimates(estimates_file)
+    with _estimates_lock(estimates_file, exclusive=True) as journal:
+        # txs-compare.lua appends to the journal without the lock, so only the
+        # records that were there before reading are removed below
+        end = os.fstat(journal.fileno()).st_size
+        est = _read_estimates(estimates_file, journal)
+        if est:
+            key_width = max(len(k) for k in est)
+            tmp_file = estimates_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                for record in est.values():
+                    f.write(_format_estimates_line(record, key_width) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, estimates_file)
+        elif os.path.exists(estimates_file):
+            os.remove(estimates_file)
+        # Records in the journal are idempotent, so crashing before it is
+        # truncated or merging records that were appended while reading doesn't
+        # do any harm.
+        with open(journal.name, 'r+b') as f:
+            f.seek(end)
+            tail = f.read()
+            f.seek(0)
+            f.write(tail)
+            f.truncate(len(tail))
+            f.flush()
+            os.fsync(f.fileno())
+    return est
 
 if os.name == 'posix':
     MPV = 'mpv'
@@ -262,7 +596,60 @@ elif os.name == 'nt':
 else:
     raise RuntimeError('Unsupported os: {os.name!r}')
 
-def compare_samples(sample_dir, debug=None, playlist_size=None, font_size=None, estimates_file=None):
+# Each samples directory has a manifest, which is a journal like the estimates
+# journal, that records the state of each sample:
+#
+#   {"job": <settings>, "hash": <hash>, "state": "running"}
+#   {"job": <settings>, "hash": <hash>, "state": "done", "result": {...}}
+#   {"job": <settings>, "hash": <hash>, "state": "rejected", "time": ..., "size": ...}
+#   {"job": <settings>, "hash": <hash>, "state": "pruned"}
+#
+# "hash" identifies everything that goes into the sample (see job_hash()). A
+# sample that is "done" with the same hash doesn't need to be encoded, probed
+# or checked again. A sample that is "rejected" was killed because its
+# projected encoding time or size exceeded the budget and is only encoded
+# again if it fits a larger budget. A sample that is "pruned" was deleted by
+# "metrics --prune" and is only encoded again with --overwrite. Any other sample
+# was interrupted or failed and must be encoded again, even if its file exists.
+
+MANIFEST_FILE = 'manifest'
+
+def job_hash(*parts):
+    return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+def read_manifest(samples_dir):
+    manifest = {}
+    with _journal_lock(os.path.join(samples_dir, MANIFEST_FILE), exclusive=False) as journal:
+        if journal is not None:
+            for record in _journal_records(journal):
+                if 'job' in record:
+                    manifest[record['job']] = record
+    return manifest
+
+def update_manifest(samples_dir, job, hash, state, **fields):
+    _append_journal(os.path.join(samples_dir, MANIFEST_FILE),
+                    [{'job': job, 'hash': hash, 'state': state, **fields}])
+
+# Resource usage of each encode is appended to a telemetry file in the samples
+# directory as JSON objects, one per line
+TELEMETRY_FILE = 'telemetry'
+
+def append_telemetry(samples_dir, *records):
+    _append_journal(os.path.join(samples_dir, TELEMETRY_FILE), records)
+
+# Ways of txs-compare.lua to decide which samples are compared next
+SCHEDULERS = ('default', 'knockout', 'swiss')
+
+# txs-compare.lua stores the state of tournaments and their ranking in this
+# file in the samples directory
+TOURNAMENT_FILE = 'tournament'
+
+# Intra-only copies of the samples and the original for txs-compare.lua are
+# stored in this directory in the samples directory with the same file names
+PROXIES_DIR = '.proxies'
+
+def compare_samples(sample_dir, debug=None, playlist_size=None, font_size=None, estimates_file=None,
+                    scheduler=None, seed_by=None, proxies=None):
     script_path_user = os.path.join(site.USER_BASE, f'share/{__name__}/lua/{__name__}-compare.lua')
     script_path_system = os.path.join(sys.prefix, f'share/{__name__}/lua/{__name__}-compare.lua')
     if os.path.exists(script_path_user):
@@ -285,8 +672,38 @@ def compare_samples(sample_dir, debug=None, playlist_size=None, font_size=None,
         scriptopts.append(f'{__name__}-font_size={font_size}')
     if estimates_file:
         scriptopts.append(f'{__name__}-estimates_file={estimates_file}')
+    if scheduler:
+        scriptopts.append(f'{__name__}-scheduler={scheduler}')
+    if seed_by:
+        scriptopts.append(f'{__name__}-seed_by={seed_by}')
+    if proxies:
+        scriptopts.append(f'{__name__}-proxies=yes')
     if scriptopts:
         cmd.append(f'--script-opts={",".join(scriptopts)}')
+    compact_estimates(os.path.join(sample_dir, estimates_file or './estimates'))
     if debug:
         print(cmd2str(cmd))
+    start_time = time.time()
     subprocess.run(cmd, cwd=sample_dir)
+    print_ranking(sample_dir, since=start_time)
+
+def print_ranking(sample_dir, since=None):
+    # Show ranking of the tournament that was saved when mpv quit unless it
+    # wasn't touched since `since`
+    path = os.path.join(sample_dir, TOURNAMENT_FILE)
+    try:
+        if since is not None and os.path.getmtime(path) < since:
+            return
+        with open(path, 'r') as f:
+            tournament = json.load(f)
+    except (OSError, ValueError):
+        return
+    ranking = tournament.get('ranking')
+    if ranking:
+        state = 'final' if tournament.get('finished') else f'after round {tournament.get("round")}'
+        print(f'Ranking of {tournament.get("scheduler")} tournament ({state}):')
+        for i,entry in enumerate(ranking, start=1):
+            line = f'{i:4d}. {entry["settings"] or entry["sample"]}  ({entry["points"]:g} points)'
+            if entry.get('withdrawn'):
+                line += ' (withdrawn)'
+            print(line)
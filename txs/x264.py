@@ -0,0 +1,124 @@
+import re
+import decimal
+
+from . import utils
+
+# Values of x264's default preset (medium) for options that are commonly
+# tested. Options that are set to these values are the same as options that
+# aren't set at all.
+DEFAULTS = {'crf': '23',
+            'bframes': '3',
+            'b-adapt': '1',
+            'b-bias': '0',
+            'b-pyramid': 'normal',
+            'direct': 'spatial',
+            'ref': '3',
+            'me': 'hex',
+            'merange': '16',
+            'subme': '7',
+            'psy-rd': '1,0',
+            'trellis': '1',
+            'aq-mode': '1',
+            'aq-strength': '1',
+            'weightp': '2',
+            'rc-lookahead': '40',
+            'scenecut': '40',
+            'keyint': '250',
+            'qcomp': '0.6',
+            'ipratio': '1.4',
+            'pbratio': '1.3',
+            'chroma-qp-offset': '0',
+            'deblock': '0,0',
+            'deadzone-inter': '21',
+            'deadzone-intra': '11',
+            'nr': '0'}
+
+# Options that are enabled by default and disabled with "no-<option>"
+ENABLED = ('deblock', 'weightb', 'mixed-refs', '8x8dct', 'cabac', 'fast-pskip',
+           'dct-decimate', 'mbtree', 'psy', 'chroma-me')
+
+# Options that change the defaults of other options
+PRESETS = ('preset', 'tune', 'profile')
+
+_B_PYRAMID = {'0': 'none', '1': 'strict', '2': 'normal'}
+
+def _number(string):
+    # Decimal keeps all digits, so different numbers never look the same
+    try:
+        number = decimal.Decimal(string.strip())
+    except decimal.InvalidOperation:
+        return None
+    return number if number.is_finite() else None
+
+def _format(number):
+    number = decimal.Decimal(number).normalize()
+    return format(number if number else decimal.Decimal(0), 'f')
+
+def _normalize_value(value):
+    # "0:0", "0,0" and "0.0,0" are all the same
+    parts = []
+    for part in re.split(r'[:,]', value):
+        number = _number(part)
+        parts.append(_format(number) if number is not None else part.strip())
+    return ','.join(parts)
+
+def canonical(settings):
+    # Return Settings that x264 encodes exactly like `settings`: Values are
+    # normalized and options that are at their default or have no effect
+    # because of other options are removed. Settings that are equivalent are
+    # equal.
+    #
+    # Presets, tunings and profiles change the defaults, so with any of them
+    # only options that are set explicitly are known and nothing is removed
+    # for being at its default.
+    defaults = {} if any(key in settings for key in PRESETS) else DEFAULTS
+    s = {}
+    for key,value in settings.items():
+        if value is None:
+            if key in ENABLED and defaults:
+                # Enabling an enabled option does nothing
+                continue
+            s[key] = None
+        else:
+            s[key] = _normalize_value(value)
+
+    def get(key):
+        return s.get(key, defaults.get(key))
+
+    def number(key):
+        value = get(key)
+        return _number(value) if value is not None else None
+
+    if 'b-pyramid' in s:
+        s['b-pyramid'] = _B_PYRAMID.get(s['b-pyramid'], s['b-pyramid'])
+    if 'no-cabac' in s:
+        # Trellis quantization needs CABAC
+        s['trellis'] = '0'
+    if number('bframes') == 0:
+        for key in ('b-adapt', 'b-bias', 'b-pyramid', 'direct', 'no-weightb'):
+            s.pop(key, None)
+    elif number('bframes') == 1:
+        # x264 needs at least 2 B-frames for a pyramid
+        s.pop('b-pyramid', None)
+    if 'no-deblock' in s:
+        s.pop('deblock', None)
+    if number('aq-mode') == 0:
+        s.pop('aq-strength', None)
+    if number('ref') == 1:
+        s.pop('no-mixed-refs', None)
+    if get('me') in ('dia', 'hex') and number('merange') is not None:
+        # merange is limited to 4-16 for these methods
+        s['merange'] = _format(min(max(number('merange'), 4), 16))
+    if 'no-psy' in s:
+        s.pop('psy-rd', None)
+    elif get('psy-rd') is not None:
+        psy_rd, psy_trellis = (get('psy-rd').split(',') + ['0'])[:2]
+        if number('subme') is not None and number('subme') < 6:
+            # Psychovisual rate-distortion optimization needs subme >= 6
+            psy_rd = '0'
+        if number('trellis') == 0:
+            psy_trellis = '0'
+        s['psy-rd'] = f'{psy_rd},{psy_trellis}'
+
+    return utils.Settings(sorted((key, value) for key,value in s.items()
+                                 if key not in defaults or value != defaults[key]))